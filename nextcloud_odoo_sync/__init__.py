@@ -2,6 +2,7 @@
 # Copyright (c) 2022 iScale Solutions Inc.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 
+from . import controllers
 from . import models
 from . import wizard
 from . import tests
\ No newline at end of file
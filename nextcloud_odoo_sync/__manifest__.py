@@ -3,7 +3,7 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 {
     'name': 'Nextcloud-Odoo Sync',
-    'version': '0.3',
+    'version': '0.4',
     'category': 'Others',
     'description': """Sync Nextcloud apps into Odoo""",
     'author': 'iScale Solutions Inc.',
@@ -21,6 +21,8 @@
              'views/calendar_event_views.xml',
              'views/nc_sync_user_views.xml',
              'views/nc_sync_log_views.xml',
+             'views/nc_sync_request_views.xml',
+             'views/nc_sync_journal_views.xml',
              'views/nc_sync_error_views.xml',
              'views/res_users_views.xml',
              'views/res_config_settings_views.xml',
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from . import main
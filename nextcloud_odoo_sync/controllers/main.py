@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import hmac
+import json
+import logging
+
+from odoo import http
+from odoo.http import request, Response
+
+_logger = logging.getLogger(__name__)
+
+
+class NextcloudWebhook(http.Controller):
+
+    @http.route('/nextcloud_odoo_sync/webhook', type='http', auth='public', methods=['POST'], csrf=False)
+    def nextcloud_webhook(self, **kwargs):
+        """
+        Receive Nextcloud calendar change notifications (webhook_listeners / workflow)
+        and queue a targeted sync for the affected user and calendar.
+        The request must send the configured secret as "Authorization: Bearer <secret>"
+        """
+        secret = request.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.webhook_secret')
+        authorization = request.httprequest.headers.get('Authorization', '')
+        if not secret or not hmac.compare_digest(authorization.encode(), ('Bearer %s' % secret).encode()):
+            return Response(status=401)
+        try:
+            payload = json.loads(request.httprequest.get_data() or b'{}')
+        except ValueError:
+            return Response(status=400)
+        if not isinstance(payload, dict):
+            return Response(status=400)
+        request_ids = request.env['nc.sync.request'].sudo().add_notification(payload)
+        _logger.info('Nextcloud notification queued %s sync request(s)' % len(request_ids))
+        return Response(json.dumps({'queued': request_ids.ids}), status=202, content_type='application/json')
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    A Nextcloud event can only be linked once per user (unique(user_id, nc_uid) on calendar.event).
+    The oldest Odoo event keeps the link, the duplicates are unlinked and archived.
+    """
+    if not version:
+        return
+    cr.execute("""
+        UPDATE calendar_event e
+           SET nc_uid = NULL, nc_calendar_hash = NULL, nc_synced = true, active = false
+          FROM calendar_event o
+         WHERE o.user_id = e.user_id
+           AND o.nc_uid = e.nc_uid
+           AND o.id < e.id
+    """)
+    if cr.rowcount:
+        _logger.warning('Archived %s calendar event(s) linked to the same Nextcloud event as an older event of their user' % cr.rowcount)
@@ -5,12 +5,17 @@
 from . import nextcloud_base
 from . import nextcloud_webdav
 from . import nextcloud_caldav
+from . import nextcloud_carddav
 from . import calendar_event
 from . import nc_sync_user
 from . import nc_sync_log
+from . import nc_sync_journal
+from . import nc_sync_request
 from . import nc_sync_error
 from . import nc_calendar
+from . import nc_addressbook
 from . import nc_event_status
 from . import res_users
 from . import res_partner
+from . import ir_attachment
 from . import res_config_settings
\ No newline at end of file
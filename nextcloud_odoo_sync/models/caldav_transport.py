@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urljoin, urlparse
+from xml.sax.saxutils import escape
+
+import requests
+from lxml import etree
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import httpx
+except (ImportError, IOError) as err:
+    httpx = None
+    _logger.debug(err)
+
+DAV_NS = 'DAV:'
+CALDAV_NS = 'urn:ietf:params:xml:ns:caldav'
+CARDDAV_NS = 'urn:ietf:params:xml:ns:carddav'
+NSMAP = {'d': DAV_NS, 'c': CALDAV_NS, 'card': CARDDAV_NS}
+# Number of events (or vCards) downloaded by a multiget REPORT
+MULTIGET_CHUNK_SIZE = 100
+# Default requests per second of the concurrent transport (nextcloud_odoo_sync.caldav_rate_limit). It has its own
+# limiter: push_rate_limit (10 requests/s) holds the serial caldav library calls, which wait for each response.
+DEFAULT_RATE_LIMIT = 50
+# Opening tag, data property and closing tag of the multiget REPORT per collection type
+MULTIGET_REPORTS = {
+    'calendar': ('<c:calendar-multiget xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav">',
+                 '<c:calendar-data/>', '</c:calendar-multiget>'),
+    'addressbook': ('<card:addressbook-multiget xmlns:d="DAV:" xmlns:card="urn:ietf:params:xml:ns:carddav">',
+                    '<card:address-data/>', '</card:addressbook-multiget>'),
+}
+
+
+class Request(object):
+    __slots__ = ('method', 'url', 'body', 'headers')
+
+    def __init__(self, method, url, body=None, headers=None):
+        self.method = method
+        self.url = url
+        self.body = body
+        self.headers = headers or {}
+
+
+class Response(object):
+    __slots__ = ('request', 'status', 'headers', 'content', 'error')
+
+    def __init__(self, request, status=0, headers=None, content=b'', error=None):
+        self.request = request
+        self.status = status
+        self.headers = headers or {}
+        self.content = content
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and 200 <= self.status < 300
+
+
+class CaldavTransport(object):
+    """
+    Send CalDAV requests concurrently behind a synchronous interface. Requests go through
+    a thread pool of requests sessions, or through httpx with asyncio when it is enabled
+    and installed (httpx is an optional dependency).
+    """
+
+    def __init__(self, username, password, max_in_flight=8, timeout=30, rate_limiter=None, use_httpx=False):
+        """
+        @param: username, string
+        @param: password, string
+        @param: max_in_flight, int, maximum number of concurrent requests to the server
+        @param: timeout, float, timeout of each request in seconds
+        @param: rate_limiter, throttle.RateLimiter shared with the other requests to the server
+        @param: use_httpx, bool, send the requests with httpx instead of the thread pool if it is installed
+        """
+        self.auth = (username, password)
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        if use_httpx and not httpx:
+            _logger.warning('httpx is not installed, the CalDAV requests are sent by a thread pool')
+        self.use_httpx = bool(use_httpx and httpx)
+        self._local = threading.local()
+
+    def send(self, request_list):
+        """
+        Send the requests and wait for all the responses
+        @param: request_list, list of Request
+        @return: list of Response, in the order of the requests
+        """
+        if not request_list:
+            return []
+        if self.use_httpx:
+            return run_coroutine(self._send_all(request_list))
+        # As many workers as requests in flight
+        with ThreadPoolExecutor(min(self.max_in_flight, len(request_list))) as executor:
+            return list(executor.map(self._send_blocking, request_list))
+
+    async def _send_all(self, request_list):
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+        async with httpx.AsyncClient(auth=self.auth, timeout=self.timeout, limits=limits) as client:
+            return await asyncio.gather(*[self._send_httpx(client, semaphore, x) for x in request_list])
+
+    async def _throttle(self):
+        if self.rate_limiter:
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _send_httpx(self, client, semaphore, request):
+        async with semaphore:
+            await self._throttle()
+            try:
+                response = await client.request(request.method, request.url, content=request.body, headers=request.headers)
+                return Response(request, response.status_code, response.headers, response.content)
+            except Exception as error:
+                return Response(request, error=error)
+
+    def _send_blocking(self, request):
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.auth = self.auth
+        try:
+            response = session.request(request.method, request.url, data=request.body,
+                                       headers=request.headers, timeout=self.timeout)
+            return Response(request, response.status_code, response.headers, response.content)
+        except Exception as error:
+            return Response(request, error=error)
+
+    def put_request(self, url, data, headers=None):
+        """
+        @param: url, string, event URL
+        @param: data, string or bytes, iCalendar data
+        @param: headers, dictionary of additional headers (e.g. If-Match)
+        @return: Request
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return Request('PUT', url, data, dict({'Content-Type': 'text/calendar; charset=utf-8'}, **(headers or {})))
+
+    def delete_request(self, url, headers=None):
+        return Request('DELETE', url, headers=headers)
+
+    def multiget_requests(self, calendar_url, urls, collection='calendar'):
+        """
+        Build the calendar-multiget (or addressbook-multiget) REPORT requests downloading the given events
+        @param: calendar_url, string, calendar (or address book) URL
+        @param: urls, list of event URLs of the calendar
+        @param: collection, string, 'calendar' or 'addressbook'
+        @return: list of Request, one per chunk of MULTIGET_CHUNK_SIZE events
+        """
+        result = []
+        report_open, data_prop, report_close = MULTIGET_REPORTS[collection]
+        for i in range(0, len(urls), MULTIGET_CHUNK_SIZE):
+            hrefs = ''.join('<d:href>%s</d:href>' % escape(urlparse(url).path) for url in urls[i:i + MULTIGET_CHUNK_SIZE])
+            body = ('<?xml version="1.0" encoding="utf-8"?>'
+                    '%s<d:prop><d:getetag/>%s</d:prop>%s%s' % (report_open, data_prop, hrefs, report_close))
+            result.append(Request('REPORT', calendar_url, body.encode('utf-8'),
+                                  {'Content-Type': 'application/xml; charset=utf-8', 'Depth': '1'}))
+        return result
+
+    def multiget(self, calendar_urls, collection='calendar'):
+        """
+        Download events (or vCards) concurrently
+        @param: calendar_urls, dictionary, calendar (or address book) URL as key and list of member URLs as value
+        @param: collection, string, 'calendar' or 'addressbook'
+        @return: dictionary, member URL as key and a dictionary with ETag and iCalendar (or vCard) data as value
+        """
+        request_list = []
+        for calendar_url, urls in calendar_urls.items():
+            request_list.extend(self.multiget_requests(calendar_url, urls, collection))
+        result = {}
+        for response in self.send(request_list):
+            if not response.ok:
+                raise response.error or requests.exceptions.HTTPError('REPORT %s: %s' % (response.request.url, response.status))
+            result.update(parse_multistatus(response.content, response.request.url))
+        return result
+
+    def list_addressbooks(self, home_url):
+        """
+        List the address books of an address book home with a PROPFIND request
+        @param: home_url, string, e.g. https://cloud.example.com/remote.php/dav/addressbooks/users/admin/
+        @return: dictionary, address book URL as key and display name as value
+        """
+        body = ('<?xml version="1.0" encoding="utf-8"?><d:propfind xmlns:d="DAV:">'
+                '<d:prop><d:resourcetype/><d:displayname/></d:prop></d:propfind>')
+        request = Request('PROPFIND', home_url, body.encode('utf-8'), {'Content-Type': 'application/xml; charset=utf-8', 'Depth': '1'})
+        response = self.send([request])[0]
+        if not response.ok:
+            raise response.error or requests.exceptions.HTTPError('PROPFIND %s: %s' % (home_url, response.status))
+        result = {}
+        root = etree.fromstring(response.content, parser=etree.XMLParser(resolve_entities=False))
+        for item in root.iterfind('d:response', NSMAP):
+            href = item.findtext('d:href', namespaces=NSMAP)
+            prop = item.find('d:propstat/d:prop', NSMAP)
+            if href and prop is not None and prop.find('d:resourcetype/card:addressbook', NSMAP) is not None:
+                result[urljoin(home_url, href)] = prop.findtext('d:displayname', namespaces=NSMAP) or unquote(href.rstrip('/').split('/')[-1])
+        return result
+
+    def sync_collection(self, collection_url, sync_token=False):
+        """
+        List the members of a collection changed since the sync token with a sync-collection REPORT (RFC 6578)
+        @param: collection_url, string
+        @param: sync_token, string, token returned by the previous call, all the members are listed if not set
+        @return: dictionary of changed member URL and ETag, list of removed member URLs and the new sync token,
+                 or None if the server no longer accepts the sync token
+        """
+        body = ('<?xml version="1.0" encoding="utf-8"?><d:sync-collection xmlns:d="DAV:">'
+                '<d:sync-token>%s</d:sync-token><d:sync-level>1</d:sync-level>'
+                '<d:prop><d:getetag/></d:prop></d:sync-collection>' % escape(sync_token or ''))
+        request = Request('REPORT', collection_url, body.encode('utf-8'), {'Content-Type': 'application/xml; charset=utf-8'})
+        response = self.send([request])[0]
+        if sync_token and response.status in (403, 409) and b'valid-sync-token' in response.content:
+            return None
+        if not response.ok:
+            raise response.error or requests.exceptions.HTTPError('REPORT %s: %s' % (collection_url, response.status))
+        return parse_sync_collection(response.content, collection_url)
+
+
+def run_coroutine(coroutine):
+    """
+    Run a coroutine from synchronous code. asyncio.run() fails when an event loop already
+    runs in the current thread, the coroutine then runs in a thread of its own.
+    @param: coroutine, coroutine object
+    @return: result of the coroutine
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def parse_multistatus(content, base_url):
+    """
+    Parse the multistatus body of a calendar-multiget or addressbook-multiget REPORT
+    @param: content, bytes
+    @param: base_url, string, URL the hrefs are relative to
+    @return: dictionary, event URL as key and a dictionary with ETag and iCalendar data as value
+    """
+    result = {}
+    root = etree.fromstring(content, parser=etree.XMLParser(resolve_entities=False, huge_tree=True))
+    for response in root.iterfind('d:response', NSMAP):
+        href = response.findtext('d:href', namespaces=NSMAP)
+        if not href:
+            continue
+        for propstat in response.iterfind('d:propstat', NSMAP):
+            if ' 200 ' not in (propstat.findtext('d:status', namespaces=NSMAP) or ''):
+                continue
+            data = propstat.findtext('d:prop/c:calendar-data', namespaces=NSMAP) or propstat.findtext('d:prop/card:address-data', namespaces=NSMAP)
+            if data:
+                result[urljoin(base_url, href)] = {'etag': propstat.findtext('d:prop/d:getetag', namespaces=NSMAP),
+                                                   'data': data,
+                                                   'path': unquote(href)}
+    return result
+
+
+def parse_sync_collection(content, base_url):
+    """
+    Parse the multistatus body of a sync-collection REPORT
+    @param: content, bytes
+    @param: base_url, string, URL the hrefs are relative to
+    @return: dictionary of changed member URL and ETag, list of removed member URLs, new sync token
+    """
+    changed = {}
+    removed = []
+    root = etree.fromstring(content, parser=etree.XMLParser(resolve_entities=False, huge_tree=True))
+    for response in root.iterfind('d:response', NSMAP):
+        href = response.findtext('d:href', namespaces=NSMAP)
+        if not href:
+            continue
+        url = urljoin(base_url, href)
+        # Removed members only have a status, changed members have their properties
+        if ' 404 ' in (response.findtext('d:status', namespaces=NSMAP) or ''):
+            removed.append(url)
+            continue
+        for propstat in response.iterfind('d:propstat', NSMAP):
+            etag = propstat.findtext('d:prop/d:getetag', namespaces=NSMAP)
+            if etag and ' 200 ' in (propstat.findtext('d:status', namespaces=NSMAP) or ''):
+                changed[url] = etag
+    return changed, removed, root.findtext('d:sync-token', namespaces=NSMAP)
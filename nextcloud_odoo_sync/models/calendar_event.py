@@ -2,6 +2,8 @@
 # Copyright (c) 2023 iScale Solutions Inc.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 
+from collections import defaultdict
+
 from odoo import api, models, fields, _
 from odoo.exceptions import ValidationError
 
@@ -10,14 +12,13 @@ class CalendarEvent(models.Model):
     _inherit = 'calendar.event'
 
     def _get_nc_calendar_selection(self):
-        nc_calendar_ids = self.env['nc.calendar'].search([('user_id', '=', self.env.user.id)])
-        values = []
-        if nc_calendar_ids:
-            [values.append((x.id, x.name)) for x in nc_calendar_ids]
-        return values
-
-    nc_uid = fields.Char(string="UID")
-    nc_calendar_hash = fields.Char(string="Calendar Hash")
+        # The calendars of the user are read once and kept in the environment cache
+        return [(x.id, x.name) for x in self.env.user.nc_calendar_ids]
+
+    nc_uid = fields.Char(string="UID", copy=False)
+    nc_calendar_hash = fields.Char(string="Calendar Hash", copy=False)
+    nc_href = fields.Char(string="Nextcloud URL", copy=False)
+    nc_etag = fields.Char(string="ETag", copy=False)
     nc_color = fields.Char(string="Color")
     nc_calendar_id = fields.Many2one('nc.calendar', 'Nextcloud Calendar', compute='_compute_nc_calendar')
     nc_calendar_select = fields.Selection(_get_nc_calendar_selection, string='Nextcloud Calendar',
@@ -30,6 +31,18 @@ class CalendarEvent(models.Model):
     nc_to_delete = fields.Boolean(string="To Delete")
     nc_allday = fields.Boolean(string="Nextcloud All day")
 
+    _sql_constraints = [('nc_uid_user_uniq', 'unique(user_id, nc_uid)', 'A Nextcloud event can only be linked once per user')]
+
+    def init(self):
+        # Partial indexes: most events are never synced, or are synced and not to delete
+        for name, definition in [('calendar_event_nc_uid_index', '(nc_uid) WHERE nc_uid IS NOT NULL'),
+                                 ('calendar_event_nc_calendar_hash_index', '(nc_calendar_hash) WHERE nc_calendar_hash IS NOT NULL'),
+                                 ('calendar_event_nc_href_index', '(user_id, nc_href) WHERE nc_href IS NOT NULL'),
+                                 ('calendar_event_nc_unsynced_index', '(user_id) WHERE nc_synced IS NOT TRUE'),
+                                 ('calendar_event_nc_to_delete_index', '(user_id) WHERE nc_to_delete IS TRUE'),
+                                 ('calendar_event_duplicate_index', '(start, stop, user_id) WHERE active IS TRUE')]:
+            self.env.cr.execute('CREATE INDEX IF NOT EXISTS %s ON calendar_event %s' % (name, definition))
+
     @api.model
     def default_get(self, fields):
         res = super(CalendarEvent, self).default_get(fields)
@@ -41,27 +54,30 @@ class CalendarEvent(models.Model):
         """
         This method determine whether to require a value for the Nextcloud calendar
         """
-        nc_calendar_ids = self.env['nc.calendar'].search([('user_id', '=', self.env.user.id)])
-        if nc_calendar_ids:
-            self.nc_require_calendar = True
-        else:
-            self.nc_require_calendar = False
+        nc_require_calendar = bool(self.env.user.nc_calendar_ids)
+        for event in self:
+            event.nc_require_calendar = nc_require_calendar
 
     @api.depends('nc_calendar_ids')
     def _compute_nc_calendar(self):
         """
         This method computes the value of the Nextcloud calendar name to display
         """
+        user_calendar_ids = self.env.user.nc_calendar_ids
+        to_select = defaultdict(list)
         # TODO: Handle calendar event with privacy == 'private' without using sudo()
-        for event in self.sudo().with_context(sync=True):
-            calendar = calendar_id = False
-            if event.nc_calendar_ids:
-                # Get calendar to display on the event based on the current user
-                calendar_id = event.nc_calendar_ids.filtered(lambda x: x.user_id == self.env.user)
-                if calendar_id:
-                    calendar = calendar_id.ids[0]
+        for event, sudo_event in zip(self, self.sudo()):
+            # Get calendar to display on the event based on the current user
+            calendar = (sudo_event.nc_calendar_ids & user_calendar_ids)[:1].id
             event.nc_calendar_id = calendar
-            event.nc_calendar_select = calendar_id.ids[0] if calendar_id else False
+            if str(sudo_event.nc_calendar_select or False) == str(calendar):
+                continue
+            if isinstance(event.id, models.NewId):
+                event.nc_calendar_select = calendar
+            else:
+                to_select[calendar].append(event.id)
+        for calendar, event_ids in to_select.items():
+            self.browse(event_ids).sudo().with_context(sync=True).write({'nc_calendar_select': calendar})
 
     @api.onchange('user_id')
     def onchange_nc_user_id(self):
@@ -87,13 +103,29 @@ class CalendarEvent(models.Model):
 
     @api.constrains('user_id', 'name', 'start', 'stop', 'start_date', 'stop_date')
     def check_duplicate(self):
-        for event in self:
-            fields = ['name', 'start', 'stop', 'start_date', 'stop_date']
-            domain = [('id', '!=', event.id), ('user_id', '=', event.user_id.id)]
-            [domain.append(('%s' % key, '=', event[key])) for key in fields]
-            duplicate_id = self.search(domain)
-            if duplicate_id:
-                raise ValidationError(_('An existing event named %s with the same date and attendees already exist' % event.name))
+        # Events synced from Nextcloud are identified by their UID
+        if self._context.get('sync', False) or not self.ids:
+            return
+        fields = ['user_id', 'name', 'start', 'stop', 'start_date', 'stop_date', 'active']
+        self.flush(fields)
+        # One query for the whole recordset, supported by calendar_event_duplicate_index
+        self.env.cr.execute("""
+            SELECT e.name
+              FROM calendar_event e
+              JOIN calendar_event o ON o.start = e.start
+                                   AND o.stop = e.stop
+                                   AND o.name = e.name
+                                   AND o.id != e.id
+                                   AND o.user_id IS NOT DISTINCT FROM e.user_id
+                                   AND o.start_date IS NOT DISTINCT FROM e.start_date
+                                   AND o.stop_date IS NOT DISTINCT FROM e.stop_date
+                                   AND o.active IS TRUE
+             WHERE e.id IN %s
+             LIMIT 1
+        """, (tuple(self.ids),))
+        row = self.env.cr.fetchone()
+        if row:
+            raise ValidationError(_('An existing event named %s with the same date and attendees already exist' % row[0]))
 
     @api.model
     def create(self, vals):
@@ -107,19 +139,31 @@ class CalendarEvent(models.Model):
             # Check if a value for calendar exist for the user:
             nc_sync_user_id = self.env['nc.sync.user'].search([('user_id', '=', self.env.user.id)], limit=1)
             if nc_sync_user_id and nc_sync_user_id.nc_calendar_id:
-                res.nc_calendar_ids = [(4, nc_sync_user_id.nc_calendar_id.id)]
+                # Part of the creation journaled below, not a change of its own
+                res.with_context(sync=True).nc_calendar_ids = [(4, nc_sync_user_id.nc_calendar_id.id)]
         if 'nc_status' not in vals:
             vals['nc_status'] = self.env.ref('nextcloud_odoo_sync.nc_event_status_confirmed').id
+        if not self._context.get('sync', False):
+            self.env['nc.sync.journal'].log_changes(res, 'create')
         return res
 
     def write(self, vals):
         if not self._context.get('sync', False):
             vals['nc_synced'] = False
-        return super(CalendarEvent, self).write(vals)
+        res = super(CalendarEvent, self).write(vals)
+        if not self._context.get('sync', False):
+            self.env['nc.sync.journal'].log_changes(self, 'write', [x for x in vals if x != 'nc_synced'])
+        return res
 
     def unlink(self):
-        for record in self:
-            if not self._context.get('sync', False) and record.nc_require_calendar and not self.env.context.get('force_delete', False):
-                record.write({'nc_to_delete': True})
-            else:
-                return super(CalendarEvent, self).unlink()
+        if self._context.get('sync', False) or self.env.context.get('force_delete', False):
+            to_delete = self
+        else:
+            # Flagged in one write, journaled once for the whole recordset
+            to_delete = self.filtered(lambda x: not x.nc_require_calendar)
+            (self - to_delete).write({'nc_to_delete': True})
+        if not to_delete:
+            return True
+        if not self._context.get('sync', False):
+            self.env['nc.sync.journal'].log_changes(to_delete, 'unlink')
+        return super(CalendarEvent, to_delete).unlink()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import hashlib
+import html
+import re
+import threading
+from collections import OrderedDict
+from html.entities import html5
+
+from bs4 import BeautifulSoup
+
+# Total number of characters kept in the conversion cache
+CACHE_MAX_SIZE = 4 * 1024 * 1024
+
+TAG_RE = re.compile(r'</?[A-Za-z][^>"\']*(?:(?:"[^"]*"|\'[^\']*\')[^>"\']*)*/?>')
+# Well-formed tag: name then attributes with an optional quoted or unquoted value
+PLAIN_TAG_RE = re.compile(r'</?[A-Za-z][^\s/<>"\'=]*(?:\s+[^\s/<>"\'=]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s"\'=<>`]+))?)*\s*/?>\Z')
+# Markup that the regex path does not handle the way BeautifulSoup does
+COMPLEX_RE = re.compile(r'<!|<\?|<(?:script|style|textarea|title)\b', re.IGNORECASE)
+# Whitespace-only text node (carriage returns excepted)
+SPACE_RE = re.compile(r'[ \t\n\f]+\Z')
+# Named character references: html.unescape also resolves unknown or unterminated ones (e.g. &copy2023) unlike BeautifulSoup
+ENTITY_RE = re.compile(r'&([A-Za-z][A-Za-z0-9]*)(;?)')
+
+
+class BoundedCache(object):
+    """
+    LRU cache bounded by the total length of the cached values
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data or len(value) > self.max_size:
+                return
+            self._data[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _key, old_value = self._data.popitem(last=False)
+                self.size -= len(old_value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+_cache = BoundedCache(CACHE_MAX_SIZE)
+
+
+def _convert(value):
+    if '<' not in value and '&' not in value and not value.isspace():
+        return value
+    nodes = TAG_RE.split(value)
+    # Carriage returns, the stray '<' of unclosed tags and malformed tags (e.g. quotes left open)
+    # are handled by html.parser on its own: such markup takes the BeautifulSoup path
+    if '\r' in value or COMPLEX_RE.search(value) or any(not x.group(2) or x.group(1) + ';' not in html5 for x in ENTITY_RE.finditer(value)) \
+            or any('<' in x for x in nodes) or not all(PLAIN_TAG_RE.match(x) for x in TAG_RE.findall(value)):
+        return BeautifulSoup(value, 'html.parser').get_text('\n')
+    # Text nodes joined by new lines like BeautifulSoup.get_text('\n'), which collapses
+    # whitespace-only text nodes into a new line (if they hold one) or a space
+    return '\n'.join(('\n' if '\n' in x else ' ') if SPACE_RE.match(x) else html.unescape(x) for x in nodes if x)
+
+
+def html_to_text(value):
+    """
+    Convert the HTML of an Odoo description into the plain text sent to Nextcloud.
+    Results are cached by content hash so unchanged descriptions are never parsed twice.
+    @param: value, string, HTML content
+    @return: string
+    """
+    if not value:
+        return ''
+    key = hashlib.sha1(value.encode('utf-8')).digest()
+    result = _cache.get(key)
+    if result is None:
+        result = _convert(value)
+        _cache.set(key, result)
+    return result
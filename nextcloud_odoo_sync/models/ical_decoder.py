@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import logging
+from datetime import date, datetime
+from functools import lru_cache
+
+import pytz
+from dateutil.parser import parse
+
+_logger = logging.getLogger(__name__)
+
+try:
+    from icalendar import Timezone
+except (ImportError, IOError) as err:
+    _logger.debug(err)
+
+
+# iCalendar property name -> value type, every other property is decoded as text
+PROPERTY_TYPES = {
+    'dtstart': 'date-time',
+    'dtend': 'date-time',
+    'due': 'date-time',
+    'recurrence-id': 'date-time',
+    'last-modified': 'date-time',
+    'created': 'date-time',
+    'dtstamp': 'date-time',
+}
+
+
+def split_property(key):
+    """
+    Split a jicson property key into its name and parameters
+    e.g. 'DTSTART;TZID=Europe/Berlin' -> ('dtstart', {'TZID': 'Europe/Berlin'})
+    @param: key, string
+    @return: string, dictionary
+    """
+    name, _sep, rest = key.partition(';')
+    params = {}
+    if rest:
+        for param in rest.split(';'):
+            param_name, _sep, param_value = param.partition('=')
+            params[param_name.upper()] = param_value.strip('"')
+    return name.lower(), params
+
+
+@lru_cache(maxsize=256)
+def get_timezone(tzid):
+    """
+    Return the (cached) pytz timezone for the given Olson name
+    @param: tzid, string (e.g. 'Asia/Manila')
+    @return: tzinfo or None if unknown
+    """
+    try:
+        return pytz.timezone(tzid)
+    except pytz.UnknownTimeZoneError:
+        return None
+
+
+@lru_cache(maxsize=64)
+def _get_vtimezone(vtimezone):
+    try:
+        return Timezone.from_ical(vtimezone).to_tz()
+    except Exception as error:
+        _logger.warning('Unable to parse VTIMEZONE: %s' % error)
+        return None
+
+
+def _extract_vtimezone(tzid, raw):
+    """
+    Return the VTIMEZONE block of the raw iCalendar text defining the given TZID
+    """
+    start = 0
+    while True:
+        start = raw.find('BEGIN:VTIMEZONE', start)
+        if start < 0:
+            return False
+        end = raw.find('END:VTIMEZONE', start)
+        if end < 0:
+            return False
+        end += len('END:VTIMEZONE')
+        block = raw[start:end]
+        if 'TZID:%s' % tzid in block or 'TZID=%s' % tzid in block:
+            return block
+        start = end
+
+
+def resolve_timezone(tzid, raw=False):
+    """
+    Resolve a TZID into a tzinfo, falling back on the VTIMEZONE embedded
+    in the raw iCalendar data for non Olson names (e.g. Outlook timezones)
+    @param: tzid, string
+    @param: raw, string, raw iCalendar data of the event
+    @return: tzinfo or None if unknown
+    """
+    tz = get_timezone(tzid)
+    if tz is None and raw:
+        vtimezone = _extract_vtimezone(tzid, raw)
+        if vtimezone:
+            tz = _get_vtimezone(vtimezone)
+    return tz
+
+
+def parse_date_value(value):
+    """
+    Decode an iCalendar DATE (YYYYMMDD) or DATE-TIME (YYYYMMDDTHHMMSS[Z]) value
+    @param: value, string
+    @return: date or datetime (aware in UTC when the value ends with Z)
+    """
+    try:
+        if len(value) == 8:
+            return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+        if len(value) in (15, 16) and value[8] == 'T':
+            dt = datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]),
+                          int(value[9:11]), int(value[11:13]), int(value[13:15]))
+            if len(value) == 16:
+                if value[15] != 'Z':
+                    raise ValueError(value)
+                dt = dt.replace(tzinfo=pytz.utc)
+            return dt
+    except ValueError:
+        pass
+    # Non conforming value, let dateutil figure it out
+    return parse(value)
+
+
+def decode_date(value, params, raw=False):
+    """
+    Decode a DATE/DATE-TIME property value
+    @param: value, string
+    @param: params, dictionary of property parameters (see split_property)
+    @param: raw, string, raw iCalendar data used to resolve embedded VTIMEZONE
+    @return: date for all day values, naive UTC datetime otherwise
+    """
+    data = parse_date_value(value)
+    if params.get('VALUE', '').upper() == 'DATE' and isinstance(data, datetime):
+        data = data.date()
+    if not isinstance(data, datetime):
+        return data
+    if data.tzinfo is None:
+        tz = resolve_timezone(params['TZID'], raw) if params.get('TZID') else None
+        if tz is None:
+            # Floating time: nothing to convert
+            return data
+        data = tz.localize(data, is_dst=False) if hasattr(tz, 'localize') else data.replace(tzinfo=tz)
+    return data.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def decode_property(name, params, value, raw=False):
+    """
+    Decode a property value according to its iCalendar value type
+    @param: name, string, lower case property name
+    @param: params, dictionary of property parameters
+    @param: value, property value as returned by jicson
+    @param: raw, string, raw iCalendar data of the event
+    @return: decoded value
+    """
+    if PROPERTY_TYPES.get(name) == 'date-time' and isinstance(value, str):
+        return decode_date(value, params, raw)
+    return value
+
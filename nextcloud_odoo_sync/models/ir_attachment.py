@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from odoo import models, fields
+
+
+class IrAttachment(models.Model):
+    _inherit = 'ir.attachment'
+
+    nc_path = fields.Char(string='Nextcloud Path', index=True, copy=False, help='Path of the file in the Nextcloud files of the sync account')
+    nc_etag = fields.Char(string='Nextcloud ETag', copy=False)
+    nc_last_modified = fields.Datetime(string='Nextcloud Last Modified', copy=False)
+    nc_checksum = fields.Char(string='Transferred Checksum', copy=False, help='Checksum of the content last transferred to or from Nextcloud')
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from odoo import models, fields
+
+
+class NcAddressbook(models.Model):
+    _name = 'nc.addressbook'
+    _description = 'Nextcloud Addressbook'
+
+    name = fields.Char(string='Address Book')
+    user_id = fields.Many2one('res.users', string='User', ondelete='cascade', index=True)
+    addressbook_url = fields.Char(string='Address Book URL')
+    sync_token = fields.Char(copy=False, help='Token of the last sync, only the vCards changed since then are downloaded')
+    date_last_sync = fields.Datetime('Last Sync', copy=False)
+    partner_ids = fields.One2many('res.partner', 'nc_addressbook_id', string='Contacts')
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import random
+from datetime import datetime, timedelta
+from odoo import api, models, fields
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class NcSyncJournal(models.Model):
+    _name = 'nc.sync.journal'
+    _description = 'Nextcloud Sync Journal'
+    _order = 'id'
+
+    event_id = fields.Many2one('calendar.event', string='Event', ondelete='set null', index=True)
+    res_id = fields.Integer(string='Event ID')
+    user_id = fields.Many2one('res.users', string='User', index=True)
+    operation = fields.Selection([('create', 'Create'),
+                                  ('write', 'Write'),
+                                  ('unlink', 'Delete')], required=True)
+    changed_fields = fields.Char(help='Comma separated list of the changed calendar.event fields')
+    nc_uid = fields.Char(string='UID')
+    nc_href = fields.Char(string='Nextcloud URL')
+    state = fields.Selection([('pending', 'Pending'),
+                              ('dead', 'Failed')], default='pending', required=True, index=True)
+    attempt_count = fields.Integer(string='Attempts')
+    date_next_attempt = fields.Datetime(string='Next Attempt', index=True)
+    last_error = fields.Text()
+
+    def init(self):
+        # Journal the events of the synced users left unsynced before the journal existed
+        self.env.cr.execute("""
+            INSERT INTO nc_sync_journal (event_id, res_id, user_id, operation, nc_uid, state, attempt_count, create_uid, create_date, write_uid, write_date)
+            SELECT e.id, e.id, e.user_id, 'write', e.nc_uid, 'pending', 0, 1, now() at time zone 'UTC', 1, now() at time zone 'UTC'
+              FROM calendar_event e
+             WHERE e.nc_synced IS NOT TRUE
+               AND e.user_id IN (SELECT u.user_id FROM nc_sync_user u WHERE u.sync_calendar IS TRUE)
+               AND NOT EXISTS (SELECT 1 FROM nc_sync_journal j WHERE j.res_id = e.id)
+        """)
+
+    @api.model
+    def log_changes(self, event_ids, operation, changed_fields=False):
+        """
+        Append an entry per event to the journal, the users of the events are synced at the next scheduled sync.
+        Only the events of the users syncing their calendar are journaled, nothing would ever drain the others.
+        @param: event_ids, calendar.event recordset
+        @param: operation, string ('create', 'write' or 'unlink')
+        @param: changed_fields, list of changed field names, all the fields if not set
+        @return: nc.sync.journal recordset
+        """
+        sync_user_obj = self.env['nc.sync.user'].sudo()
+        sync_users = sync_user_obj.get_calendar_sync_users()
+        event_ids = event_ids.filtered(lambda x: x.user_id.id in sync_users)
+        if not event_ids:
+            return self.browse()
+        # Once for the whole recordset
+        sync_user_obj.browse([sync_users[x] for x in event_ids.user_id.ids]).reset_sync_interval()
+        return self.sudo().create([{
+            'event_id': event.id,
+            'res_id': event.id,
+            'user_id': event.user_id.id,
+            'operation': operation,
+            'changed_fields': ','.join(sorted(changed_fields)) if changed_fields else False,
+            'nc_uid': event.nc_uid,
+            'nc_href': event.nc_href,
+        } for event in event_ids])
+
+    @api.model
+    def get_due_entries(self, user_id):
+        """
+        Get the journal entries of the user that are not waiting for a retry,
+        along with the pending entries of the same events so that no change is left behind
+        @param: user_id, int, res.users ID
+        @return: nc.sync.journal recordset
+        """
+        limit = int(self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.push_batch_size', 500))
+        entry_ids = self.search([('user_id', '=', user_id), ('state', '=', 'pending'), '|',
+                                 ('date_next_attempt', '=', False), ('date_next_attempt', '<=', datetime.now())], limit=limit)
+        if entry_ids.event_id:
+            entry_ids |= self.search([('event_id', 'in', entry_ids.event_id.ids), ('state', '=', 'pending')])
+        return entry_ids.sorted('id')
+
+    def register_failure(self, error, operation=False):
+        """
+        Schedule the next attempt of the entries with an exponential backoff,
+        entries reaching the maximum number of attempts are moved to the 'dead' state (shown as Failed)
+        @param: error, exception or string
+        @param: operation, string, operation to retry if different from the journaled one
+        """
+        config_obj = self.env['ir.config_parameter'].sudo()
+        max_attempts = int(config_obj.get_param('nextcloud_odoo_sync.push_max_attempts', 8))
+        base_delay = int(config_obj.get_param('nextcloud_odoo_sync.push_retry_delay', 60))
+        for entry in self:
+            attempt_count = entry.attempt_count + 1
+            # 1, 2, 4, 8... times the base delay, capped at a day, with a jitter to avoid retry storms
+            delay = min(base_delay * 2 ** (attempt_count - 1), 86400) * random.uniform(1, 1.1)
+            vals = {'attempt_count': attempt_count,
+                    'date_next_attempt': datetime.now() + timedelta(seconds=delay),
+                    'last_error': str(error),
+                    'state': 'dead' if attempt_count >= max_attempts else 'pending'}
+            if operation:
+                vals['operation'] = operation
+            entry.write(vals)
+            if vals['state'] == 'dead':
+                _logger.warning('Giving up pushing event %s to Nextcloud after %s attempts: %s' % (entry.res_id, attempt_count, error))
+
+    def action_retry(self):
+        self.write({'state': 'pending', 'attempt_count': 0, 'date_next_attempt': False})
+
+    def get_pending_changes(self):
+        """
+        Replay the journal entries in order
+        @return: calendar.event recordset of the events to push (in order),
+                 dictionary of event ID and set of changed fields (False when the whole event has to be sent),
+                 list of dictionaries with the UID and URL of the deleted events
+        """
+        event_ids = []
+        changed_fields = {}
+        deleted_nc_events = {}
+        for entry in self:
+            if not entry.event_id:
+                if entry.operation == 'unlink' and entry.nc_uid and entry.nc_uid not in deleted_nc_events:
+                    deleted_nc_events[entry.nc_uid] = {'uid': entry.nc_uid, 'href': entry.nc_href}
+                continue
+            if entry.event_id.id not in changed_fields:
+                event_ids.append(entry.event_id.id)
+                changed_fields[entry.event_id.id] = set()
+            if changed_fields[entry.event_id.id] is False or entry.operation != 'write' or not entry.changed_fields:
+                changed_fields[entry.event_id.id] = False
+            else:
+                changed_fields[entry.event_id.id].update(entry.changed_fields.split(','))
+        events = self.env['calendar.event'].browse(event_ids).filtered(lambda x: not x.nc_synced)
+        return events, changed_fields, list(deleted_nc_events.values())
+
+    def unlink_drained(self):
+        """
+        Remove the entries whose event was pushed to Nextcloud or no longer exists,
+        except the ones which just failed and wait for a retry
+        """
+        now = datetime.now()
+        self.filtered(lambda x: (x.event_id and x.event_id.nc_synced) or (
+            not x.event_id and x.state == 'pending' and not (x.date_next_attempt and x.date_next_attempt > now))).unlink()
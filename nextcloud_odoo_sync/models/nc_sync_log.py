@@ -3,7 +3,8 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 
 from datetime import datetime, timedelta
-from odoo import models, fields
+from odoo import api, models, fields
+from odoo.tools import sql
 
 import logging
 _logger = logging.getLogger(__name__)
@@ -12,7 +13,7 @@ _logger = logging.getLogger(__name__)
 class NcSyncLog(models.Model):
     _name = 'nc.sync.log'
     _description = 'Nextcloud Sync Log'
-    _order = 'create_date, desc'
+    _order = 'create_date desc'
 
     name = fields.Char(string="Sync code")
     description = fields.Char()
@@ -25,7 +26,12 @@ class NcSyncLog(models.Model):
                               ('error', 'Error')])
     next_cloud_url = fields.Char(string="NextCloud URL")
     odoo_url = fields.Char(string="Odoo URL")
+    sync_type = fields.Selection([('calendar', 'Calendar'),
+                                  ('contact', 'Contacts')], default='calendar', string='Synced App')
+    shard = fields.Char(help='Shard cron which ran the sync, out of the number of shards')
     duration = fields.Char()
+    duration_seconds = fields.Float(string='Duration (seconds)')
+    rolled_up = fields.Boolean(copy=False, help='Counted in the log rollups, the log is being deleted')
     line_ids = fields.One2many('nc.sync.log.line', 'log_id')
 
     def get_time_diff(self, date_from, date_to=False):
@@ -43,15 +49,120 @@ class NcSyncLog(models.Model):
         minutes, seconds = divmod(remainder, 60)
         return hours, minutes, seconds
 
-    def check_and_log_users(self, sync_log_id):
+    def get_severity_counts(self):
+        """
+        Count the lines of the log per severity
+        @return: dictionary, severity as key (False for lines without severity) and number of lines as value
+        """
+        groups = self.env['nc.sync.log.line'].read_group([('log_id', '=', self.id)], ['severity'], ['severity'])
+        return {x['severity']: x['severity_count'] for x in groups}
+
+    def log_summary(self, elapsed, sync_start, create_count, write_count, delete_count, error_count):
+        """
+        Summarize the sync run in its log: severity counts, duration and totals
+        @param: elapsed, float, duration of the run in seconds
+        @param: sync_start, datetime, start of the run
+        @param: create_count, write_count, delete_count, error_count, int, totals of the run
+        """
+        severity_counts = self.get_severity_counts()
+        errors = severity_counts.get('error', 0) + severity_counts.get('critical', 0)
+        warnings = severity_counts.get('warning', 0)
+        infos = severity_counts.get(False, 0) + severity_counts.get('info', 0)
+        self.description = f'{errors} Error(s), {warnings} Warning(s) and {infos} Info(s)'
+
+        duration = round(elapsed, 2)
+        self.duration = self.env['nextcloud.caldav'].convert_readable_time_duration(duration)
+        self.duration_seconds = duration
+
+        hours, minutes, seconds = self.get_time_diff(sync_start)
+        summary_message = '''Sync process duration: %s:%s:%s\n - Total create %s\n - Total write %s\n - Total delete %s\n - Total error %s''' % (
+            hours, minutes, seconds, create_count, write_count, delete_count, error_count)
+        self.log_event('text', self, message=summary_message)
+
+    @api.model
+    def cleanup_logs(self):
+        """
+        Roll the logs older than the retention period up into nc.sync.log.rollup and delete them.
+        Lines are deleted in batches, committing between batches. The logs are flagged as rolled up along
+        with the rollup, a cleanup interrupted before their deletion does not count them twice.
+        """
+        config_obj = self.env['ir.config_parameter'].sudo()
+        retention_days = int(config_obj.get_param('nextcloud_odoo_sync.log_retention_days', 30))
+        period = config_obj.get_param('nextcloud_odoo_sync.log_rollup_period', 'day')
+        batch_size = int(config_obj.get_param('nextcloud_odoo_sync.log_cleanup_batch_size', 10000))
+        if retention_days <= 0 or period not in ('day', 'week'):
+            return
+        date_limit = datetime.now() - timedelta(days=retention_days)
+        self.flush()
+        self.env.cr.execute("""
+            SELECT date_trunc(%s, log.create_date)::date,
+                   count(*),
+                   coalesce(sum(log.duration_seconds), 0),
+                   coalesce(max(log.duration_seconds), 0),
+                   coalesce(sum(line.error_count), 0),
+                   coalesce(sum(line.warning_count), 0),
+                   coalesce(sum(line.info_count), 0)
+              FROM nc_sync_log log
+              LEFT JOIN LATERAL (
+                   SELECT count(*) FILTER (WHERE severity IN ('error', 'critical')) AS error_count,
+                          count(*) FILTER (WHERE severity = 'warning') AS warning_count,
+                          count(*) FILTER (WHERE severity IS NULL OR severity = 'info') AS info_count
+                     FROM nc_sync_log_line
+                    WHERE log_id = log.id) line ON true
+             WHERE log.create_date < %s
+               AND log.rolled_up IS NOT TRUE
+             GROUP BY 1
+        """, (period, date_limit))
+        rollup_obj = self.env['nc.sync.log.rollup']
+        for date, run_count, duration_total, duration_max, error_count, warning_count, info_count in self.env.cr.fetchall():
+            rollup_id = rollup_obj.search([('date', '=', date), ('period', '=', period)], limit=1)
+            if not rollup_id:
+                rollup_id = rollup_obj.create({'date': date, 'period': period})
+            rollup_id.write({'run_count': rollup_id.run_count + run_count,
+                             'duration_total': rollup_id.duration_total + duration_total,
+                             'duration_max': max(rollup_id.duration_max, duration_max),
+                             'error_count': rollup_id.error_count + error_count,
+                             'warning_count': rollup_id.warning_count + warning_count,
+                             'info_count': rollup_id.info_count + info_count})
+        rollup_obj.flush()
+        self.env.cr.execute('UPDATE nc_sync_log SET rolled_up = true WHERE create_date < %s AND rolled_up IS NOT TRUE', (date_limit,))
+        self.env.cr.commit()
+
+        while True:
+            self.env.cr.execute("""
+                DELETE FROM nc_sync_log_line
+                 WHERE id IN (SELECT line.id
+                                FROM nc_sync_log_line line
+                                JOIN nc_sync_log log ON log.id = line.log_id
+                               WHERE log.rolled_up IS TRUE
+                               LIMIT %s)
+            """, (batch_size,))
+            deleted = self.env.cr.rowcount
+            self.env.cr.commit()
+            if deleted < batch_size:
+                break
+        self.env.cr.execute('DELETE FROM nc_sync_log WHERE rolled_up IS TRUE')
+        self.invalidate_cache()
+        self.env['nc.sync.log.line'].invalidate_cache()
+
+    def check_and_log_users(self, sync_log_id, sync_user_ids=False, due_only=False):
         """
         Function to Check and log NextCloud users information.
         @sync_log_id = Object, nc.sync.log object
+        @sync_user_ids = List, nc.sync.user IDs to check, all the users if not set
+        @due_only = Bool, only check the users whose next sync is due or whose last sync was interrupted
         @return = List, NextCloud users that are in linked in odoo
         """
         nc_users = self.env['nextcloud.base'].get_users()["ocs"]["data"]["users"]
         nc_user_email = [nc['id'] for nc in nc_users] + [nc['email'] for nc in nc_users]
-        odoo_users = self.env['nc.sync.user'].search_read([('sync_calendar', '=', True)])
+        domain = [('sync_calendar', '=', True)]
+        if sync_user_ids:
+            domain.append(('id', 'in', sync_user_ids))
+        if due_only:
+            domain += ['|', '|', ('sync_checkpoint', '!=', False), ('date_next_sync', '=', False), ('date_next_sync', '<=', datetime.now())]
+        odoo_users = self.env['nc.sync.user'].search_read(domain)
+        # Interrupted users first, then the least recently synced ones
+        odoo_users.sort(key=lambda x: (not x['sync_checkpoint'], x['date_last_sync'] or datetime.min))
         stg_users_odoo_not_in_nc = [x for x in odoo_users if x['user_name'] not in nc_user_email]
         stg_users_nc_not_in_odoo = [x for x in nc_users if x['email'] not in [o['user_name'] for o in odoo_users]]
         stg_users_nc_in_odoo = []
@@ -113,6 +224,7 @@ class NcSyncLog(models.Model):
                 'name': datetime.now().strftime('%Y%m%d-%H%M%S'),
                 'date_start': datetime.now(),
                 'state': 'connecting',
+                'shard': params.get('shard'),
                 'next_cloud_url': nc_url,
                 'odoo_url': odoo_url,
                 'line_ids': [(0, 0, {'operation_type': 'login',
@@ -135,7 +247,7 @@ class NcSyncLog(models.Model):
 
             # Compare Nextcloud users with Odoo users and vice versa
             if result['resume'] and log_id:
-                result['stg_users_nc_in_odoo'] = self.check_and_log_users(log_id)
+                result['stg_users_nc_in_odoo'] = self.check_and_log_users(log_id, params.get('sync_user_ids'), params.get('due_only'))
 
         else:
             error = str(params['error']) if 'error' in params else False
@@ -176,7 +288,7 @@ class NcSyncLogLine(models.Model):
     _name = 'nc.sync.log.line'
     _description = 'Nextcloud Sync Log Line'
 
-    log_id = fields.Many2one('nc.sync.log', ondelete='cascade')
+    log_id = fields.Many2one('nc.sync.log', ondelete='cascade', index=True)
     operation_type = fields.Selection([('create', 'Create'),
                                        ('write', 'Write'),
                                        ('delete', 'Delete'),
@@ -195,3 +307,30 @@ class NcSyncLogLine(models.Model):
                                  ('error', 'Error'),
                                  ('critical', 'Critical')], default='info')
     response_description = fields.Text()
+
+    def init(self):
+        sql.create_index(self.env.cr, 'nc_sync_log_line_log_id_severity_index', self._table, ['log_id', 'severity'])
+
+
+class NcSyncLogRollup(models.Model):
+    _name = 'nc.sync.log.rollup'
+    _description = 'Nextcloud Sync Log Rollup'
+    _order = 'date desc'
+
+    date = fields.Date(required=True, index=True)
+    period = fields.Selection([('day', 'Day'),
+                               ('week', 'Week')], required=True, default='day')
+    run_count = fields.Integer(string='Runs')
+    duration_total = fields.Float(string='Total Duration (seconds)')
+    duration_max = fields.Float(string='Longest Run (seconds)')
+    duration_average = fields.Float(string='Average Duration (seconds)', compute='_compute_duration_average')
+    error_count = fields.Integer(string='Errors')
+    warning_count = fields.Integer(string='Warnings')
+    info_count = fields.Integer(string='Infos')
+
+    _sql_constraints = [('date_period_uniq', 'unique(date, period)', 'Only one rollup per period is allowed')]
+
+    @api.depends('run_count', 'duration_total')
+    def _compute_duration_average(self):
+        for rollup in self:
+            rollup.duration_average = rollup.duration_total / rollup.run_count if rollup.run_count else 0
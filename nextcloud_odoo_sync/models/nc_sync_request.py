@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from datetime import datetime, timedelta
+from odoo import api, models, fields
+from odoo.addons.nextcloud_odoo_sync.models.nextcloud_caldav import SYNC_USER_LOCK
+
+import logging
+_logger = logging.getLogger(__name__)
+
+
+class NcSyncRequest(models.Model):
+    _name = 'nc.sync.request'
+    _description = 'Nextcloud Sync Request'
+    _order = 'date_run, id'
+
+    sync_user_id = fields.Many2one('nc.sync.user', string='User', required=True, ondelete='cascade')
+    calendar_uri = fields.Char(string='Calendar', help='Nextcloud calendar URI, all the calendars of the user when empty')
+    state = fields.Selection([('pending', 'Pending'),
+                              ('done', 'Done')], default='pending', index=True)
+    date_run = fields.Datetime(string='Run After', help='Notifications received before this date are coalesced in this request')
+    notification_count = fields.Integer(default=1)
+
+    @api.model
+    def parse_notification(self, payload):
+        """
+        Get the Nextcloud user and calendar affected by a webhook_listeners / workflow notification
+        @param: payload, dictionary
+        @return: string, string (False if the whole user has to be synced)
+        """
+        event = payload.get('event') if isinstance(payload.get('event'), dict) else {}
+        calendar_data = event.get('calendarData') or {}
+        principal = calendar_data.get('principaluri') or ''
+        user = payload.get('user')
+        if principal.startswith('principals/users/'):
+            user_name = principal.split('/')[-1]
+        elif isinstance(user, dict):
+            user_name = user.get('uid')
+        else:
+            user_name = user
+        return user_name, calendar_data.get('uri') or False
+
+    @api.model
+    def add_notification(self, payload):
+        """
+        Queue a sync for the user and calendar of a Nextcloud notification. Notifications
+        received within the coalescing delay are merged into the same pending request.
+        @param: payload, dictionary
+        @return: nc.sync.request recordset
+        """
+        user_name, calendar_uri = self.parse_notification(payload)
+        if not user_name:
+            return self
+        sync_user_ids = self.env['nc.sync.user'].search([('sync_calendar', '=', True), '|',
+                                                         ('nextcloud_user_id', '=', user_name),
+                                                         ('user_name', '=ilike', user_name)])
+        delay = int(self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.webhook_delay', 10))
+        result = self
+        for sync_user_id in sync_user_ids:
+            domain = [('sync_user_id', '=', sync_user_id.id), ('state', '=', 'pending'), '|',
+                      ('calendar_uri', '=', False), ('calendar_uri', '=', calendar_uri)]
+            request_id = self.search(domain, limit=1)
+            if request_id:
+                request_id.notification_count += 1
+            else:
+                request_id = self.create({'sync_user_id': sync_user_id.id,
+                                          'calendar_uri': calendar_uri,
+                                          'date_run': datetime.now() + timedelta(seconds=delay)})
+                self.env.ref('nextcloud_odoo_sync.ir_cron_nextcloud_sync_request')._trigger(at=request_id.date_run)
+            result |= request_id
+        return result
+
+    @api.model
+    def run_sync_requests(self):
+        """
+        Run a targeted sync for the users and calendars of the due requests. The requests of a user are done once
+        the sync of the user completed, users skipped (e.g. being synced by another run) or interrupted stay pending.
+        """
+        request_ids = self.search([('state', '=', 'pending'), ('date_run', '<=', datetime.now())])
+        if not request_ids:
+            return
+        calendar_uris = {}
+        for request_id in request_ids:
+            uris = calendar_uris.setdefault(request_id.sync_user_id.id, [])
+            if uris is not False:
+                calendar_uris[request_id.sync_user_id.id] = [request_id.calendar_uri] + uris if request_id.calendar_uri else False
+        notification_counts = {x.id: x.notification_count for x in request_ids}
+        sync_start = fields.Datetime.now()
+        self.env['nextcloud.caldav'].sync_cron(sync_user_ids=list(calendar_uris), calendar_uris=calendar_uris)
+        self.invalidate_cache()
+        self.env['nc.sync.user'].invalidate_cache(['date_last_sync'])
+        # Notifications received during the sync are coalesced in the same requests, which are left for the next run
+        done_ids = request_ids.exists().filtered(lambda x: x.state == 'pending' and x.notification_count == notification_counts[x.id]
+                                                 and x.sync_user_id.date_last_sync and x.sync_user_id.date_last_sync >= sync_start)
+        done_ids.write({'state': 'done'})
+        if request_ids - done_ids:
+            _logger.warning('%s Nextcloud sync request(s) not processed, retried on the next run' % len(request_ids - done_ids))
+            # Users synced by another run are retried shortly, failing users wait for the hourly run
+            caldav_obj = self.env['nextcloud.caldav']
+            busy_user_ids = (request_ids - done_ids).sync_user_id.filtered(lambda x: not caldav_obj.acquire_sync_lock(SYNC_USER_LOCK, x.id))
+            caldav_obj.release_sync_locks()
+            if busy_user_ids:
+                delay = int(self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.webhook_delay', 10))
+                self.env.ref('nextcloud_odoo_sync.ir_cron_nextcloud_sync_request')._trigger(at=datetime.now() + timedelta(seconds=delay))
+        # Purge processed requests
+        self.search([('state', '=', 'done'), ('date_run', '<', datetime.now() - timedelta(days=1))]).unlink()
@@ -2,8 +2,10 @@
 # Copyright (c) 2023 iScale Solutions Inc.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 
-from odoo import models, fields, api, _
+from datetime import datetime, timedelta
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import ValidationError
+from odoo.tools import frozendict
 
 
 class NcSyncUser(models.Model):
@@ -14,10 +16,25 @@ class NcSyncUser(models.Model):
     nextcloud_user_id = fields.Char('Nextcloud User ID')
     user_name = fields.Char('Username')
     sync_calendar = fields.Boolean('Sync Calendar', default=True)
+    sync_contacts = fields.Boolean('Sync Contacts', help='Import the contacts of the Nextcloud address books of the user')
     user_events_hash = fields.Text('Event Hash')
     nc_password = fields.Char('Password')
     nc_calendar_id = fields.Many2one('nc.calendar', 'Default Nextcloud Calendar')
     user_has_calendar = fields.Boolean('User has calendar')
+    calendar_assign_pending = fields.Boolean('Calendar Assignment Pending', copy=False,
+                                             help='The default calendar is being linked to the existing events of the user in the background')
+    sync_checkpoint = fields.Selection([('pull', 'Updating Odoo'),
+                                        ('push', 'Updating Nextcloud')], 'Interrupted Sync', copy=False,
+                                       help='Phase in which the last sync of the user ran out of time, the next sync resumes this user first')
+    sync_pull_cursor = fields.Char('Pull Cursor', copy=False, help='Last event downloaded by the interrupted sync, the next sync continues after it')
+    date_last_sync = fields.Datetime('Last Sync', copy=False)
+    date_last_activity = fields.Datetime('Last Activity', copy=False, help='Last sync which changed events in Odoo or Nextcloud')
+    change_rate = fields.Float('Changes per Sync', copy=False, digits=(16, 2),
+                               help='Moving average of the number of events changed by the syncs of the user')
+    sync_interval = fields.Integer('Sync Interval (minutes)', copy=False,
+                                   help='Time between two scheduled syncs of the user, increased after each sync without changes')
+    date_next_sync = fields.Datetime('Next Sync', copy=False, index=True,
+                                     help='Scheduled syncs skip the user until then, any change in Odoo brings it forward')
     user_message = fields.Char(default='"Default Calendar" field will be used as your default odoo calendar when creating new events')
 
     @api.constrains('user_id')
@@ -42,13 +59,148 @@ class NcSyncUser(models.Model):
         """
         return self.env.ref('calendar.action_calendar_event').sudo().read()[0]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super(NcSyncUser, self).create(vals_list)
+        self.clear_caches()
+        return res
+
     def write(self, vals):
-        if 'nc_calendar_id' in vals:
-            calendar_event_ids = self.env['calendar.event'].search(
-                ['|', ('user_id', '=', self.user_id.id), ('partner_ids', 'in', self.user_id.partner_id.id)]
-            ).filtered(lambda x: not x.nc_calendar_ids or (x.nc_calendar_ids and self.user_id.partner_id.id not in x.nc_calendar_ids.ids))
-            calendar_event_ids.with_context(sync=True).write({'nc_calendar_ids': [(4, vals['nc_calendar_id'])]})
-        return super(NcSyncUser, self).write(vals)
+        if vals.get('nc_calendar_id'):
+            # Linked to the existing events by a cron, the form does not wait for it
+            vals['calendar_assign_pending'] = True
+        res = super(NcSyncUser, self).write(vals)
+        if vals.get('nc_calendar_id'):
+            self.env.ref('nextcloud_odoo_sync.ir_cron_nextcloud_assign_calendar')._trigger()
+        if 'user_id' in vals or 'sync_calendar' in vals:
+            self.clear_caches()
+        return res
+
+    @api.model
+    @tools.ormcache()
+    def get_calendar_sync_users(self):
+        """
+        Get the users syncing their calendar, cached as every change of an event looks them up
+        @return: dictionary, res.users ID as key and nc.sync.user ID as value
+        """
+        self.flush(['user_id', 'sync_calendar'])
+        self.env.cr.execute('SELECT user_id, id FROM nc_sync_user WHERE sync_calendar IS TRUE AND user_id IS NOT NULL')
+        return frozendict(self.env.cr.fetchall())
+
+    @api.model
+    def assign_default_calendars(self):
+        """
+        Link the default calendar of the users whose default calendar changed to their existing events,
+        in chunks committed one by one
+        """
+        chunk_size = int(self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.calendar_assign_chunk_size', 10000))
+        for user in self.search([('calendar_assign_pending', '=', True)]):
+            nc_calendar_id = user.nc_calendar_id.id
+            # Linked events leave the candidate events, the loop stops on the first incomplete chunk
+            while nc_calendar_id:
+                linked = user.set_default_calendar(nc_calendar_id, chunk_size)
+                self.env.cr.commit()
+                if linked < chunk_size:
+                    break
+            # Unless the default calendar changed again meanwhile
+            self.env.cr.execute('UPDATE nc_sync_user SET calendar_assign_pending = false WHERE id = %s AND nc_calendar_id IS NOT DISTINCT FROM %s',
+                                (user.id, nc_calendar_id or None))
+            self.env.cr.commit()
+        self.invalidate_cache(['calendar_assign_pending'])
+
+    def set_default_calendar(self, nc_calendar_id, limit=None):
+        """
+        Link the calendar to the events of the user (as organizer or attendee) that have no calendar
+        of the user yet. Only the missing relation rows are inserted, and the linked events of the users
+        syncing their calendar are journaled by the same statement so that the change is pushed.
+        @param: nc_calendar_id, int, nc.calendar ID
+        @param: limit, int, maximum number of events to link, all of them if not set
+        @return: int, number of linked events
+        """
+        event_obj = self.env['calendar.event']
+        calendar_field = event_obj._fields['nc_calendar_ids']
+        partner_field = event_obj._fields['partner_ids']
+        event_obj.flush(['user_id', 'partner_ids', 'nc_calendar_ids', 'active', 'nc_synced'])
+        self.env['nc.sync.journal'].flush()
+        query = """
+            WITH linked AS (
+                INSERT INTO {rel} ({event_col}, {calendar_col})
+                SELECT e.id, %(calendar_id)s
+                  FROM calendar_event e
+                 WHERE e.active IS TRUE
+                   AND (e.user_id = %(user_id)s OR EXISTS (
+                        SELECT 1 FROM {partner_rel} p WHERE p.{partner_event_col} = e.id AND p.{partner_col} = %(partner_id)s))
+                   AND NOT EXISTS (
+                        SELECT 1
+                          FROM {rel} r
+                          JOIN nc_calendar c ON c.id = r.{calendar_col}
+                         WHERE r.{event_col} = e.id AND (c.user_id = %(user_id)s OR c.id = %(calendar_id)s))
+                 LIMIT %(limit)s
+                RETURNING {event_col} AS event_id
+            ), unsynced AS (
+                UPDATE calendar_event e
+                   SET nc_synced = false
+                  FROM linked l
+                 WHERE e.id = l.event_id AND e.nc_synced IS TRUE
+            ), journaled AS (
+                INSERT INTO nc_sync_journal (event_id, res_id, user_id, operation, changed_fields, nc_uid, nc_href, state, attempt_count,
+                                             create_uid, create_date, write_uid, write_date)
+                SELECT e.id, e.id, e.user_id, 'write', 'nc_calendar_ids', e.nc_uid, e.nc_href, 'pending', 0,
+                       %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+                  FROM linked l
+                  JOIN calendar_event e ON e.id = l.event_id
+                 WHERE e.user_id IN (SELECT u.user_id FROM nc_sync_user u WHERE u.sync_calendar IS TRUE)
+                RETURNING user_id
+            )
+            SELECT (SELECT count(*) FROM linked), ARRAY(SELECT DISTINCT user_id FROM journaled)
+        """.format(rel=calendar_field.relation, event_col=calendar_field.column1, calendar_col=calendar_field.column2,
+                   partner_rel=partner_field.relation, partner_event_col=partner_field.column1, partner_col=partner_field.column2)
+        self.env.cr.execute(query, {'calendar_id': nc_calendar_id, 'user_id': self.user_id.id, 'partner_id': self.user_id.partner_id.id,
+                                    'limit': limit, 'uid': self.env.uid})
+        linked, user_ids = self.env.cr.fetchone()
+        event_obj.invalidate_cache(['nc_calendar_ids', 'nc_calendar_id', 'nc_synced'])
+        if user_ids:
+            sync_users = self.get_calendar_sync_users()
+            self.browse([sync_users[x] for x in user_ids if x in sync_users]).reset_sync_interval()
+        return linked
+
+    def get_sync_intervals(self):
+        """
+        @return: int, minimum interval (minutes), int, maximum interval (minutes), float, backoff factor
+        """
+        config_obj = self.env['ir.config_parameter'].sudo()
+        min_interval = max(int(config_obj.get_param('nextcloud_odoo_sync.sync_interval_min', 5)), 1)
+        max_interval = max(int(config_obj.get_param('nextcloud_odoo_sync.sync_interval_max', 240)), min_interval)
+        backoff_factor = max(float(config_obj.get_param('nextcloud_odoo_sync.sync_backoff_factor', 2)), 1)
+        return min_interval, max_interval, backoff_factor
+
+    def schedule_next_sync(self, change_count):
+        """
+        Schedule the next sync of the users after a complete sync. Users with changes are synced again
+        after the minimum interval, the interval of idle users grows exponentially up to the maximum interval.
+        @param: change_count, int, number of events changed in Odoo and Nextcloud by the sync
+        """
+        min_interval, max_interval, backoff_factor = self.get_sync_intervals()
+        now = datetime.now()
+        for user in self:
+            vals = {'change_rate': user.change_rate * 0.8 + change_count * 0.2}
+            if change_count:
+                vals.update(sync_interval=min_interval, date_last_activity=now)
+            else:
+                vals['sync_interval'] = min(round(max(user.sync_interval, min_interval) * backoff_factor), max_interval)
+            vals['date_next_sync'] = now + timedelta(minutes=vals['sync_interval'])
+            user.write(vals)
+
+    def reset_sync_interval(self):
+        """
+        Put the users back in the fast lane: the next scheduled sync picks them up
+        and they are synced at the minimum interval again
+        """
+        min_interval = self.get_sync_intervals()[0]
+        now = datetime.now()
+        # Users already due are not written again on every change
+        self.filtered(lambda x: x.sync_interval > min_interval or (x.date_next_sync and x.date_next_sync > now)).write({
+            'sync_interval': min_interval, 'date_next_sync': now})
 
     def get_user_connection(self):
         params = {'nextcloud_login': 'Login', 'nextcloud_password': 'Password', 'nextcloud_url': 'Server URL'}
@@ -100,4 +252,5 @@ class NcSyncUser(models.Model):
             nc_calendar_ids = self.env['nc.calendar'].search([('user_id', 'in', self.user_id.ids)])
             if nc_calendar_ids:
                 nc_calendar_ids.unlink()
+        self.clear_caches()
         return super(NcSyncUser, self).unlink()
@@ -2,27 +2,45 @@
 # Copyright (c) 2022 iScale Solutions Inc.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 
+import bisect
 import logging
 import requests
 import pytz
 import time as ttime
 import hashlib
-import ast
 import json
-from bs4 import BeautifulSoup
-from dateutil.parser import parse
-from datetime import datetime, timedelta
+import uuid
+from urllib.parse import unquote, urlparse
+from datetime import date, datetime, timedelta
 from odoo import models
-from odoo.addons.nextcloud_odoo_sync.models import jicson
+from odoo.tools import config, split_every
+from odoo.addons.nextcloud_odoo_sync.models import caldav_transport, html_text, ical_decoder, jicson, sync_merge, sync_record, throttle, vevent_writer
 
 _logger = logging.getLogger(__name__)
 
 try:
     import caldav
-    from icalendar import Calendar, Event, Alarm
+    from caldav.elements import dav
 except (ImportError, IOError) as err:
     _logger.debug(err)
 
+# Keys of the PostgreSQL advisory locks guarding the sync: (SYNC_RUN_LOCK, 0) for every run (exclusive
+# over all the users, shared by the shard runs), (SYNC_RUN_LOCK, shard + 1) for a shard run and
+# (SYNC_USER_LOCK, nc.sync.user ID) for a user being synced
+SYNC_RUN_LOCK = 1313030001
+SYNC_USER_LOCK = 1313030002
+
+# Shard crons: the main sync cron runs the first shard, the other ones have an XML ID ending with the shard index
+SYNC_CRON_NAME = 'NextCloud-Odoo Sync Cron'
+SHARD_CRON_XMLID = 'ir_cron_nextcloud_odoo_sync_cron_shard_'
+
+# calendar.event fields holding the NextCloud state of an event, writing only them does not change the event
+NC_STATE_FIELDS = {'nc_etag', 'nc_href', 'nc_calendar_hash'}
+
+# Number of events created in Nextcloud between two commits
+CREATE_CHUNK_SIZE = 50
+PROPFIND_ETAG = '<?xml version="1.0" encoding="utf-8"?><d:propfind xmlns:d="DAV:"><d:prop><d:getetag/></d:prop></d:propfind>'
+
 
 class Nextcloudcaldav(models.AbstractModel):
     _name = 'nextcloud.caldav'
@@ -35,26 +53,201 @@ class Nextcloudcaldav(models.AbstractModel):
                'enabled': config_obj.sudo().get_param('nextcloud_odoo_sync.enable_calendar_sync')}
         return res
 
-    def sync_cron(self):
+    def sync_cron(self, sync_user_ids=False, calendar_uris=False, shard=None, force=False):
+        """
+        Function to update events from NextCloud to Odoo and Odoo to NextCloud.
+        A run over all the users excludes every other run, shards run alongside each other, and a user is never synced by two runs at once.
+        @sync_user_ids = List, nc.sync.user IDs to sync, all the users if not set
+        @calendar_uris = Dictionary, nc.sync.user ID as key and the list of NextCloud calendar URIs to sync as value
+        @shard = Int, index of the shard cron running the sync, only the users of the shard are synced
+        @force = Bool, sync all the users instead of the ones whose next sync is due
+        @return = Bool, False if another run is already syncing all the users or the shard
+        """
+        # Scheduled runs skip the users which are not due, explicitly requested users are always synced
+        due_only = not force and (not sync_user_ids or shard is not None)
+        if shard is not None:
+            shard_count = self.get_sync_shard_count()
+            if shard >= shard_count:
+                # Shard cron left from a greater shard count
+                return False
+            sync_user_ids = self.get_shard_user_ids(shard, shard_count)
+            if not sync_user_ids:
+                return True
+        if (not sync_user_ids or shard is not None) and not self.acquire_run_lock(shard):
+            _logger.warning('Another Nextcloud sync is running, skipping this run')
+            return False
+        try:
+            self.run_sync(sync_user_ids, calendar_uris, shard, due_only)
+        except Exception:
+            # Session locks cannot be released in an aborted transaction
+            self.env.cr.rollback()
+            raise
+        finally:
+            self.release_sync_locks()
+        return True
+
+    def acquire_sync_lock(self, key, res_id=0, shared=False):
+        """
+        Function to take a session level advisory lock. Unlike row locks, it survives the commits of the sync
+        and is released by PostgreSQL if the worker dies.
+        @key = Int, SYNC_RUN_LOCK or SYNC_USER_LOCK
+        @res_id = Int, ID of the locked record
+        @shared = Bool, take the lock in shared mode, only exclusive holders are refused
+        @return = Bool, False if the lock is held by another connection
+        """
+        self.env.cr.execute('SELECT pg_try_advisory_lock%s(%%s, %%s)' % ('_shared' if shared else ''), (key, res_id))
+        return self.env.cr.fetchone()[0]
+
+    def release_sync_lock(self, key, res_id=0, shared=False):
+        self.env.cr.execute('SELECT pg_advisory_unlock%s(%%s, %%s)' % ('_shared' if shared else ''), (key, res_id))
+
+    def acquire_run_lock(self, shard=None):
+        """
+        Function to take the run lock. Every run checks the same key, (SYNC_RUN_LOCK, 0): a run over all the users
+        (the cron without shards or the sync wizard) holds it exclusively, shard runs hold it shared so that shards
+        run alongside each other but never alongside a run over all the users. Shard runs also hold their own key.
+        @shard = Int, index of the shard, None for a run over all the users
+        @return = Bool, False if a conflicting run holds the lock
+        """
+        if shard is None:
+            return self.acquire_sync_lock(SYNC_RUN_LOCK)
+        if not self.acquire_sync_lock(SYNC_RUN_LOCK, shared=True):
+            return False
+        if not self.acquire_sync_lock(SYNC_RUN_LOCK, shard + 1):
+            self.release_sync_lock(SYNC_RUN_LOCK, shared=True)
+            return False
+        return True
+
+    def get_sync_shard_count(self):
+        """
+        Function to get the number of shard crons the users are split across
+        @return = Int, 1 if the users are not sharded
+        """
+        shard_count = self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.sync_shard_count')
+        return max(int(shard_count or 1), 1)
+
+    def get_shard_user_ids(self, shard, shard_count):
+        """
+        Function to get the users of a shard. Users are assigned by ID modulo the shard count,
+        so a user stays in the same shard as long as the shard count does not change.
+        @shard = Int, index of the shard
+        @shard_count = Int, number of shards
+        @return = List, nc.sync.user IDs
+        """
+        user_ids = self.env['nc.sync.user'].sudo().search([('sync_calendar', '=', True)]).ids
+        return [x for x in user_ids if x % shard_count == shard]
+
+    def get_sync_cron(self, shard=None):
+        """
+        Function to get the cron running the sync of a shard, the main sync cron runs the first shard
+        @shard = Int, index of the shard, None for the main sync cron
+        @return = ir.cron record or False
+        """
+        if not shard:
+            return self.env.ref('nextcloud_odoo_sync.ir_cron_nextcloud_odoo_sync_cron', raise_if_not_found=False)
+        return self.env.ref('nextcloud_odoo_sync.%s%s' % (SHARD_CRON_XMLID, shard), raise_if_not_found=False)
+
+    def update_sync_shard_crons(self):
+        """
+        Function to create and remove the shard crons according to the shard count. The shard crons
+        run at the same interval as the main sync cron, which runs the first shard.
+        """
+        shard_count = self.get_sync_shard_count()
+        cron_id = self.get_sync_cron()
+        if not cron_id:
+            return
+        cron_id = cron_id.sudo()
+        data_obj = self.env['ir.model.data'].sudo()
+        shard_crons = {}
+        for data in data_obj.search([('module', '=', 'nextcloud_odoo_sync'), ('model', '=', 'ir.cron'),
+                                     ('name', '=like', SHARD_CRON_XMLID + '%')]):
+            shard_crons[int(data.name[len(SHARD_CRON_XMLID):])] = self.env['ir.cron'].sudo().browse(data.res_id)
+
+        if shard_count > 1:
+            cron_id.write({'name': '%s (shard 1/%s)' % (SYNC_CRON_NAME, shard_count), 'code': 'model.sync_cron(shard=0)'})
+        else:
+            cron_id.write({'name': SYNC_CRON_NAME, 'code': 'model.sync_cron()'})
+        for shard in range(1, shard_count):
+            vals = {'name': '%s (shard %s/%s)' % (SYNC_CRON_NAME, shard + 1, shard_count),
+                    'code': 'model.sync_cron(shard=%s)' % shard,
+                    'active': cron_id.active,
+                    'interval_number': cron_id.interval_number,
+                    'interval_type': cron_id.interval_type}
+            if shard in shard_crons:
+                shard_crons.pop(shard).write(vals)
+            else:
+                vals['nextcall'] = cron_id.nextcall
+                shard_cron_id = cron_id.copy(vals)
+                # No update: the cron is kept when the module is updated
+                data_obj._update_xmlids([{'xml_id': 'nextcloud_odoo_sync.%s%s' % (SHARD_CRON_XMLID, shard),
+                                          'record': shard_cron_id, 'noupdate': True}])
+        for shard_cron_id in shard_crons.values():
+            shard_cron_id.unlink()
+
+    def release_sync_locks(self):
+        """
+        Function to release every sync advisory lock held by the connection, which goes back to the pool
+        """
+        self.env.cr.execute("""
+            SELECT CASE WHEN mode = 'ShareLock' THEN pg_advisory_unlock_shared(classid::bigint::int, objid::bigint::int)
+                        ELSE pg_advisory_unlock(classid::bigint::int, objid::bigint::int) END
+              FROM pg_locks
+             WHERE locktype = 'advisory'
+               AND pid = pg_backend_pid()
+               AND objsubid = 2
+               AND classid::bigint IN %s
+        """, ((SYNC_RUN_LOCK, SYNC_USER_LOCK),))
+
+    def run_sync(self, sync_user_ids=False, calendar_uris=False, shard=None, due_only=False):
         """
         Function to update events from NextCloud to Odoo and Odoo to NextCloud.
         Also logs the error and changes
+        @sync_user_ids = List, nc.sync.user IDs to sync, all the users if not set
+        @calendar_uris = Dictionary, nc.sync.user ID as key and the list of NextCloud calendar URIs to sync as value
+        @shard = Int, index of the shard cron running the sync
+        @due_only = Bool, only sync the users whose next sync is due
         """
         self = self.sudo()
         start_time = ttime.perf_counter()
         log_obj = self.env['nc.sync.log']
 
         calendar_event_obj = self.env['calendar.event']
+        journal_obj = self.env['nc.sync.journal']
         caldav_api_credentials = self.get_caldav_credentials()
+        push_rate = float(self.env['ir.config_parameter'].get_param('nextcloud_odoo_sync.push_rate_limit', 10))
+        rate_limiter = throttle.get_rate_limiter(caldav_api_credentials['url'], push_rate)
+        pull_batch_size = int(self.env['ir.config_parameter'].get_param('nextcloud_odoo_sync.pull_batch_size', 1000))
+        budget = self.get_sync_time_budget()
+        interrupted = False
+        create_count = write_count = delete_count = error_count = 0
 
         # Start Sync Process: Date + Time
         sync_start = datetime.now()
-        result = log_obj.log_event('pre_sync')
+        shard_name = '%s/%s' % (shard + 1, self.get_sync_shard_count()) if shard is not None else False
+        result = log_obj.log_event('pre_sync', sync_user_ids=sync_user_ids, shard=shard_name, due_only=due_only)
         sync_log_id = result['log_id']
         if sync_log_id and result['resume']:
             stg_users_nc_in_odoo = result['stg_users_nc_in_odoo']
-            create_count = write_count = delete_count = error_count = 0
+            claimed_user_id = False
             for user in stg_users_nc_in_odoo:
+                if claimed_user_id:
+                    self.release_sync_lock(SYNC_USER_LOCK, claimed_user_id)
+                    claimed_user_id = False
+                if self.check_time_budget(start_time, budget):
+                    interrupted = True
+                    break
+                # Claim the user, users being synced by another run are skipped
+                if not self.acquire_sync_lock(SYNC_USER_LOCK, user['id']):
+                    log_obj.log_event('text', sync_log_id, message='"%s" is being synced by another run, skipped' % user['user_name'])
+                    continue
+                claimed_user_id = user['id']
+                user_change_count = create_count + write_count + delete_count
+                # Odoo events only updated with a new ETag or URL, not counted as changes of the user
+                user_retag_count = 0
+                # Phase in which the sync of the user ran out of time
+                checkpoint = False
+                if user['sync_checkpoint']:
+                    log_obj.log_event('text', sync_log_id, message='Resuming the interrupted sync of "%s"' % user['user_name'])
                 connection, connection_principal = self.check_nextcloud_connection(url=caldav_api_credentials['url'], username=user['user_name'], password=user['nc_password'])
                 if isinstance(connection_principal, dict) and connection_principal.get('sync_error_id'):
                     error_id = connection_principal.get('sync_error_id')
@@ -62,102 +255,111 @@ class Nextcloudcaldav(models.AbstractModel):
                     log_obj.log_event('error', sync_log_id, error=error, message='Nextcloud:')
                     _logger.warning('Error: %s' % error)
                     continue
+                transport = self.get_caldav_transport(user)
 
                 # Collect events in both Odoo and NextCloud
                 log_obj.log_event('text', sync_log_id, message='Getting events for "%s"' % user['user_name'])
                 _logger.warning('Getting events for "%s"' % user['user_name'])
                 try:
-                    nc_events = self.get_all_nc_user_events(connection_principal)
-                    nc_events_hash = self.get_event_hash('list', nc_events)
+                    # Only download the events whose ETag changed since the last sync, events
+                    # applied by an interrupted run already have their ETag saved
+                    user_calendar_uris = calendar_uris.get(user['id'], False) if calendar_uris else False
+                    nc_calendars = self.get_nc_user_calendars(connection_principal, user_calendar_uris)
+                    nc_listing = self.get_nc_user_event_listing(nc_calendars)
+                    known_etags = self.get_odoo_event_etags(user)
+                    changed_hrefs = [href for href in nc_listing if not nc_listing[href]['etag'] or nc_listing[href]['etag'] != known_etags.get(href)]
+                    # NextCloud changes not applied in Odoo yet
+                    pending_hrefs = set(changed_hrefs)
+                    pull_cursor = False
+                    if pull_batch_size and len(changed_hrefs) > pull_batch_size:
+                        # Large initial syncs are downloaded over several runs, each run starts where the
+                        # previous one stopped so that events failing on every run do not block the others
+                        changed_hrefs = self.get_pull_batch(changed_hrefs, user['sync_pull_cursor'], pull_batch_size)
+                        pull_cursor = changed_hrefs[-1]
+                        checkpoint = 'pull'
+                    full_sync = not user_calendar_uris and len(changed_hrefs) == len(nc_listing)
                 except Exception as error:
                     log_obj.log_event('error', sync_log_id, error=error, message='Nextcloud:')
                     _logger.warning('Error: %s' % error)
-                try:
-                    odoo_events_hash = ast.literal_eval(user['user_events_hash']) if user['user_events_hash'] else []
-                except Exception as error:
-                    log_obj.log_event('error', sync_log_id, error=error, message='Odoo:')
-                    _logger.warning('Error: %s' % error)
+                    continue
                 stg_events_not_in_odoo = {'create': [], 'write': [], 'delete': []}
                 stg_events_not_in_nc = {'create': [], 'write': [], 'delete': []}
 
-                # NextCloud -> Odoo
-                log_obj.log_event('text', sync_log_id, message='Comparing events for "%s"' % user['user_name'])
-                _logger.warning('Comparing events for %s' % user['user_name'])
+                journal_ids = journal_obj
+                # Odoo -> NextCloud
                 try:
-                    # User calendar hash not saved
-                    if not odoo_events_hash:
-                        stg_events_not_in_odoo['create'].extend(self.get_caldav_record(nc_events, user))
-                    # User calendar unequal hash
-                    elif odoo_events_hash != nc_events_hash:
-                        # Same user calendar hash count (it means there's a modified record)
-                        if len(odoo_events_hash) == len(nc_events_hash):
-                            listed_nc_event = self.get_to_update_data_in_odoo(odoo_events_hash, nc_events_hash, nc_events, user)
-                            if listed_nc_event:
-                                stg_events_not_in_odoo['write'].extend(listed_nc_event)
-
-                        # odoo events < nextcloud events
-                        elif len(odoo_events_hash) < len(nc_events_hash):
-                            to_create = self.get_to_create_data_in_odoo(user, nc_events)
-                            to_update = self.get_to_update_data_in_odoo(odoo_events_hash, nc_events_hash, nc_events, user)
-                            if to_create:
-                                stg_events_not_in_odoo['create'].extend(to_create)
-                            if to_update:
-                                stg_events_not_in_odoo['write'].extend(to_update)
-
-                        # odoo events > nextcloud events
-                        elif len(odoo_events_hash) > len(nc_events_hash):
-                            odoo_event_ids = calendar_event_obj.search([('user_id', '=', user['user_id'][0])])
-                            nc_uids = [x.vobject_instance.vevent.uid.value for x in nc_events]
-                            calendar_event_ids = self.env['calendar.event'].search([('nc_uid', 'in', nc_uids)])
-                            nc_listed_events = self.get_caldav_record(nc_events, user, calendar_event_ids)
-                            to_create = self.get_to_create_data_in_odoo(user, nc_events)
-                            to_update = self.get_to_update_data_in_odoo(odoo_events_hash, nc_events_hash, nc_events, user)
-                            for event in odoo_event_ids:
-                                if event.nc_uid not in [e['nc_uid'] for e in nc_listed_events]:
-                                    stg_events_not_in_odoo['delete'].append({'id': event.id})
-                            if to_create:
-                                stg_events_not_in_odoo['create'].extend(to_create)
-                            if to_update:
-                                stg_events_not_in_odoo['write'].extend(to_update)
-                    else:
-                        to_update = self.get_events_with_updated_calendar(nc_events, user)
-                        if to_update:
-                            stg_events_not_in_odoo['write'].extend(to_update)
-
-                    # Odoo -> NextCloud
-                    # get unsynced event records
-                    all_odoo_event_ids = calendar_event_obj.search([('user_id', '=', user['user_id'][0])])
-                    unsynced_odoo_event_ids = all_odoo_event_ids.filtered(lambda x: not x.nc_synced)
-                    # events with uid
-                    calendar_event_ids = self.set_caldav_record(unsynced_odoo_event_ids.filtered(lambda x: x.nc_uid == False and x.nc_to_delete == False))
-                    for odoo_events in calendar_event_ids:
-                        odoo_events['odoo_id'] = odoo_events.pop('id')
-                        if odoo_events:
-                            stg_events_not_in_nc['create'].append(odoo_events)
+                    # get unsynced event records from the outbound journal
+                    journal_ids = journal_obj.get_due_entries(user['user_id'][0])
+                    unsynced_odoo_event_ids, odoo_changed_fields, deleted_nc_events = journal_ids.get_pending_changes()
                     # events without uid
-                    calendar_event_ids = self.set_caldav_record(unsynced_odoo_event_ids.filtered(lambda x: x.nc_uid != False and x.nc_to_delete == False))
-                    for odoo_events in calendar_event_ids:
-                        odoo_events['odoo_id'] = odoo_events.pop('id')
-                        all_day = odoo_events.pop('all_day', False)
-                        if odoo_events:
-                            if not all_day and self.env['calendar.event'].browse(odoo_events['odoo_id']).nc_allday:
-                                stg_events_not_in_nc['delete'].append(odoo_events.copy())
-                                stg_events_not_in_nc['create'].append(odoo_events.copy())
-                                stg_events_not_in_odoo['write'].append({'id': odoo_events['odoo_id'], 'nc_allday': all_day})
-                            else:
-                                stg_events_not_in_nc['write'].append(odoo_events.copy())
+                    stg_events_not_in_nc['create'].extend(self.set_caldav_record(unsynced_odoo_event_ids.filtered(lambda x: x.nc_uid == False and x.nc_to_delete == False)))
+                    # events with uid
+                    for odoo_event in self.set_caldav_record(unsynced_odoo_event_ids.filtered(lambda x: x.nc_uid != False and x.nc_to_delete == False)):
+                        event_id = calendar_event_obj.browse(odoo_event.odoo_id)
+                        if not odoo_event.all_day and event_id.nc_allday:
+                            # No longer all day: the event is created again
+                            stg_events_not_in_nc['delete'].append({'uid': odoo_event.uid, 'href': event_id.nc_href})
+                            stg_events_not_in_nc['create'].append(odoo_event)
+                            stg_events_not_in_odoo['write'].append({'id': odoo_event.odoo_id, 'nc_allday': False})
+                        else:
+                            stg_events_not_in_nc['write'].append(odoo_event)
                     # To delete handling
                     to_delete_calendar_event_ids = unsynced_odoo_event_ids.filtered(lambda x: x.nc_to_delete == True)
                     if to_delete_calendar_event_ids:
-                        to_delete_nc = [{'uid': event} for event in to_delete_calendar_event_ids.mapped('nc_uid') if event]
+                        to_delete_nc = [{'uid': event.nc_uid, 'href': event.nc_href} for event in to_delete_calendar_event_ids if event.nc_uid]
                         if to_delete_nc:
                             stg_events_not_in_nc['delete'].extend(to_delete_nc)
                         stg_events_not_in_odoo['delete'].extend([{'id': odoo_event.id} for odoo_event in to_delete_calendar_event_ids])
+                    # Events deleted in Odoo
+                    stg_events_not_in_nc['delete'].extend(deleted_nc_events)
                 except Exception as error:
                     log_obj.log_event('error', sync_log_id, error=error)
                     _logger.warning('Error: %s' % error)
 
-                update_user_events_hash = False
+                # NextCloud -> Odoo: download, compare, merge and apply one chunk of events at a time
+                log_obj.log_event('text', sync_log_id, message='Comparing events for "%s"' % user['user_name'])
+                _logger.warning('Comparing events for %s' % user['user_name'])
+                od_start = datetime.now()
+                pulled_uids = set()
+                pulled_counts = {'create': 0, 'write': 0}
+                try:
+                    for hrefs, nc_uids, to_sync in self.iter_nc_changes(nc_listing, changed_hrefs, user, transport):
+                        # Events changed on both sides: keep the most recent change
+                        stg_events_not_in_nc['write'], to_sync['write'] = sync_merge.merge_writes(stg_events_not_in_nc['write'], to_sync['write'])
+                        counts = self.apply_odoo_changes(to_sync, user, sync_log_id)
+                        create_count += counts['create']
+                        write_count += counts['write']
+                        error_count += counts['error']
+                        user_retag_count += counts['retag']
+                        pulled_counts['create'] += counts['create']
+                        pulled_counts['write'] += counts['write']
+                        pulled_uids.update(nc_uids)
+                        pending_hrefs.difference_update(hrefs)
+                        self.env.cr.commit()
+                        if self.check_time_budget(start_time, budget):
+                            checkpoint = 'pull'
+                            break
+                    # Events not downloaded yet are unknown, do not delete anything before the end of the pull
+                    if not checkpoint:
+                        stg_events_not_in_odoo['delete'].extend(self.get_nc_deleted_in_odoo(nc_listing, pulled_uids, user, full_sync=full_sync,
+                                                                                            calendar_urls=user_calendar_uris and [str(x.url) for x in nc_calendars]))
+                except Exception as error:
+                    log_obj.log_event('error', sync_log_id, error=error, message='Nextcloud:')
+                    _logger.warning('Error: %s' % error)
+                    continue
+                if pulled_counts['create'] or pulled_counts['write']:
+                    hours, minutes, seconds = log_obj.get_time_diff(od_start)
+                    log_obj.log_event('text', sync_log_id, message='Odoo: %s events created and %s events updated from Nextcloud in %s:%s:%s' % (
+                        pulled_counts['create'], pulled_counts['write'], hours, minutes, seconds))
+
+                # Odoo changes of events whose NextCloud changes are not applied yet wait for the next run
+                if pending_hrefs:
+                    to_write = [x for x in stg_events_not_in_nc['write'] if calendar_event_obj.browse(x.odoo_id).nc_href not in pending_hrefs]
+                    if len(to_write) < len(stg_events_not_in_nc['write']):
+                        log_obj.log_event('text', sync_log_id, message='Nextcloud: %s events to write postponed until their Nextcloud changes are applied' % (
+                            len(stg_events_not_in_nc['write']) - len(to_write)))
+                        stg_events_not_in_nc['write'] = to_write
+
                 # Log operation count
                 all_stg_events = {'Nextcloud': stg_events_not_in_nc, 'Odoo': stg_events_not_in_odoo}
                 for stg_events in all_stg_events:
@@ -172,210 +374,261 @@ class Nextcloudcaldav(models.AbstractModel):
                     nc_start = datetime.now()
                     log_obj.log_event('text', sync_log_id, message='Updating Nextcloud events')
                     _logger.warning('Updating Nextcloud events')
-                    update_user_events_hash = True
+                    nc_calendar_objs = {}
+                    organizer = False
                     if stg_events_not_in_nc['create']:
-                        for item in stg_events_not_in_nc['create']:
-                            try:
-                                odoo_id = item.pop('odoo_id')
-                                nc_calendar = item.pop('nc_calendar_ids')
-                                attendees = item.pop('attendee')
-                                nc_valarm = item.pop('valarm', [])
-                                item.pop('uid', False)
-                                item.pop('last-modified', False)
-                                calendar_obj = self.get_user_calendar(connection, connection_principal, nc_calendar)
-                                event = calendar_obj.save_event(**item)
-                                event = calendar_obj.event(event.vobject_instance.vevent.uid.value)
-                                event = self.add_nc_alarm_data(event, nc_valarm)
-                                if attendees:
-                                    event.parent.save_with_invites(event.icalendar_instance, attendees=attendees, schedule_agent="NONE")
-                                event.save()
-                                self.update_odoo_event(event, odoo_id)
-                                create_count += 1
-                            except Exception as error:
+                        # Events are built locally and created with a single PUT each, sent concurrently
+                        for items in split_every(CREATE_CHUNK_SIZE, stg_events_not_in_nc['create'], list):
+                            if self.check_time_budget(start_time, budget):
+                                checkpoint = 'push'
+                                break
+                            to_create = []
+                            failed = []
+                            for item in items:
+                                try:
+                                    nc_calendar = item.calendar_name
+                                    if not nc_calendar:
+                                        raise ValueError('No Nextcloud calendar')
+                                    if nc_calendar not in nc_calendar_objs:
+                                        nc_calendar_objs[nc_calendar] = self.get_user_calendar(connection, connection_principal, nc_calendar)
+                                    if item.attendee and not organizer:
+                                        organizer = connection_principal.get_vcal_address()
+                                    to_create.append((item.odoo_id,) + self.build_nc_event(item, str(nc_calendar_objs[nc_calendar].url), organizer))
+                                except Exception as error:
+                                    failed.append((item.odoo_id, error))
+                            responses = transport.send([transport.put_request(url, data, {'If-None-Match': '*'}) for odoo_id, uid, url, data in to_create])
+                            for (odoo_id, uid, url, data), response in zip(to_create, responses):
+                                if response.ok:
+                                    self.save_nc_event_state(odoo_id, uid, url, data, response.headers.get('ETag'))
+                                    create_count += 1
+                                else:
+                                    failed.append((odoo_id, response.error or 'PUT %s: %s' % (url, response.status)))
+                            # The events exist in Nextcloud now, never lose their UID
+                            self.env.cr.commit()
+                            for odoo_id, error in failed:
                                 log_obj.log_event('error', sync_log_id, error=error, message='Error creating Nextcloud event for %s:\n' % user['user_name'])
                                 _logger.warning('Error creating Nextcloud event for %s: %s' % (user['user_name'], error))
+                                journal_ids.filtered(lambda x: x.event_id.id == odoo_id).register_failure(error)
                                 error_count += 1
-                                continue
-                    if stg_events_not_in_nc['write']:
-                        for not_in_nc_item in stg_events_not_in_nc['write']:
+                    if stg_events_not_in_nc['write'] and checkpoint != 'push':
+                        # Events listed in NextCloud are replaced with PUTs conditioned on their listed ETag,
+                        # changes made in NextCloud meanwhile are rejected with 412 instead of being overwritten
+                        to_update = []
+                        legacy_items = []
+                        for item in stg_events_not_in_nc['write']:
+                            href = calendar_event_obj.browse(item.odoo_id).nc_href
+                            if href in nc_listing and nc_listing[href]['etag'] and self.is_nc_calendar(nc_listing[href]['calendar'], item.calendar_name):
+                                to_update.append((href, item))
+                            else:
+                                legacy_items.append(item)
+                        if not organizer and any(item.attendee for item in stg_events_not_in_nc['write']):
+                            organizer = connection_principal.get_vcal_address()
+                        for items in split_every(CREATE_CHUNK_SIZE, to_update, list):
+                            if self.check_time_budget(start_time, budget):
+                                checkpoint = 'push'
+                                break
+                            updated_count, conflicts, failed = self.update_nc_events(items, nc_listing, transport, organizer)
+                            write_count += updated_count
+                            if conflicts:
+                                log_obj.log_event('text', sync_log_id, operation_type='conflict',
+                                                  message='%s event(s) changed in Nextcloud while updating them for "%s"' % (len(conflicts), user['user_name']))
+                                try:
+                                    retry_items, inbound, missing = self.resolve_nc_conflicts(conflicts, nc_listing, user, transport)
+                                    stg_events_not_in_odoo['write'].extend(inbound)
+                                    failed.extend(missing)
+                                    updated_count, conflicts, retry_failed = self.update_nc_events(retry_items, nc_listing, transport, organizer)
+                                    write_count += updated_count
+                                    failed.extend(retry_failed)
+                                    # Changed again in NextCloud, retried on the next run
+                                    failed.extend((item.odoo_id, 'Event changed in Nextcloud during the update') for href, item in conflicts)
+                                except Exception as error:
+                                    failed.extend((item.odoo_id, error) for href, item in conflicts)
+                            self.env.cr.commit()
+                            for odoo_id, error in failed:
+                                log_obj.log_event('error', sync_log_id, error=error, message='Error updating Nextcloud event for %s:\n' % user['user_name'])
+                                _logger.warning('Error updating Nextcloud event for %s: %s' % (user['user_name'], error))
+                                journal_ids.filtered(lambda x: x.event_id.id == odoo_id).register_failure(error)
+                                error_count += 1
+                        # Events unknown to the listing are looked up by UID
+                        for not_in_nc_item in legacy_items:
+                            if checkpoint == 'push' or self.check_time_budget(start_time, budget):
+                                checkpoint = 'push'
+                                break
+                            odoo_id = not_in_nc_item.odoo_id
                             try:
-                                # check if the save record is in stg_events_not_in_odoo. get the most recent one
-                                for not_in_odoo_item in stg_events_not_in_odoo['write']:
-                                    if not_in_nc_item['uid'] == not_in_odoo_item['nc_uid']:
-                                        not_in_nc_last_modif = str(not_in_nc_item.pop('last-modified'))
-                                        not_in_odoo_last_modif = str(not_in_odoo_item.pop('write_date'))
-                                        if not_in_nc_last_modif < not_in_odoo_last_modif:
-                                            stg_events_not_in_nc['write'].remove(not_in_nc_item)
-                                        elif not_in_nc_last_modif > not_in_odoo_last_modif:
-                                            stg_events_not_in_odoo['write'].remove(not_in_odoo_item)
-                                if not_in_nc_item:
-                                    nc_uid = not_in_nc_item.pop('uid')
-                                    odoo_id = not_in_nc_item.pop('odoo_id')
-                                    nc_calendar = not_in_nc_item.pop('nc_calendar_ids')
-                                    nc_valarm = not_in_nc_item.pop('valarm', [])
-                                    attendees = not_in_nc_item.pop('attendee')
-                                    old_calendar_obj = self.get_old_calendar_object(connection_principal, nc_uid)
-                                    event = False
-                                    # Event not moved in to another calendar
-                                    if old_calendar_obj:
-                                        if old_calendar_obj.name.lower() == nc_calendar.replace(' ', '-').lower():
-                                            event = old_calendar_obj.event(nc_uid)
-                                        # Event moved in to another calendar
-                                        else:
-                                            old_event = old_calendar_obj.event_by_uid(nc_uid)
-                                            event_data = old_event.data
-                                            new_calendar_obj = self.get_user_calendar(connection, connection_principal, nc_calendar)
-                                            event = new_calendar_obj.add_event(event_data)
-                                            old_event.delete()
-                                    if event:
-                                        if 'last-modified' in not_in_nc_item:
-                                            not_in_nc_item.pop('last-modified')
-                                        # update alarms
-                                        event = self.add_nc_alarm_data(event, nc_valarm)
-                                        # update transp (busy/free)
-                                        if not event.vobject_instance.vevent.contents.get('transp', False):
-                                            event.icalendar_component.add('transp', not_in_nc_item.pop('transp'))
-
-                                        if 'description' not in not_in_nc_item:
-                                            event.vobject_instance.vevent.contents.pop('description', False)
-                                        elif not event.vobject_instance.vevent.contents.get('description', False):
-                                            event.icalendar_component.add('description', not_in_nc_item.pop('description'))
-
-                                        if 'location' not in not_in_nc_item:
-                                            event.vobject_instance.vevent.contents.pop('location', False)
-                                        elif not event.vobject_instance.vevent.contents.get('location', False):
-                                            event.icalendar_component.add('location', not_in_nc_item.pop('location'))
-
-                                        # update every field
-                                        [exec(f'event.vobject_instance.vevent.{i}.value = val', {'event': event, 'val': not_in_nc_item[i]}) for i in not_in_nc_item]
-
-                                        # Reset attendees
-                                        if 'attendee' in event.vobject_instance.vevent.contents:
-                                            event.vobject_instance.vevent.contents.pop('attendee')
-                                        # Save new attendees
-                                        # attendees.append(connection_principal.get_vcal_address())
-                                        if attendees:
-                                            event.parent.save_with_invites(event.icalendar_instance, attendees=attendees, schedule_agent="NONE")
-
-                                        event.save()
-                                        self.update_odoo_event(event, odoo_id)
+                                rate_limiter.wait()
+                                nc_uid = not_in_nc_item.uid
+                                nc_calendar = not_in_nc_item.calendar_name
+                                old_calendar_obj = self.get_old_calendar_object(connection_principal, nc_uid)
+                                event = False
+                                # Event not moved in to another calendar
+                                if old_calendar_obj:
+                                    if self.is_nc_calendar(old_calendar_obj, nc_calendar):
+                                        event = old_calendar_obj.event(nc_uid)
+                                    # Event moved in to another calendar: build it from the Odoo values
+                                    else:
+                                        old_event = old_calendar_obj.event_by_uid(nc_uid)
+                                        new_calendar_obj = self.get_user_calendar(connection, connection_principal, nc_calendar)
+                                        event = new_calendar_obj.add_event(self.get_nc_event_data(not_in_nc_item, nc_uid, organizer))
+                                        old_event.delete()
+                                if event:
+                                    # update the changed fields only
+                                    keys = self.get_caldav_keys(odoo_changed_fields.get(odoo_id, False))
+                                    vals = not_in_nc_item.get_values(keys)
+                                    if vals.get('attendee') and organizer:
+                                        vals['organizer'] = organizer
+                                        keys = keys and keys | {'organizer'}
+                                    vevent_writer.write_properties(event.icalendar_component, vals, keys)
+                                    event.save()
+                                    self.update_odoo_event(event, odoo_id)
+                                    self.env.cr.commit()
                                 write_count += 1
                             except Exception as error:
                                 log_obj.log_event('error', sync_log_id, error=error, message='Error updating Nextcloud event for %s:\n' % user['user_name'])
                                 _logger.warning('Error updating Nextcloud event for %s: %s' % (user['user_name'], error))
+                                journal_ids.filtered(lambda x: x.event_id.id == odoo_id).register_failure(error)
                                 error_count += 1
                                 continue
 
-                    if stg_events_not_in_nc['delete']:
+                    if stg_events_not_in_nc['delete'] and checkpoint != 'push':
                         log_obj.log_event('text', sync_log_id, message='Nextcloud: Deleting records', operation_type='delete')
+                        # Events with a known URL are deleted concurrently
+                        to_delete_nc = [i for i in stg_events_not_in_nc['delete'] if i.get('href')]
+                        responses = transport.send([transport.delete_request(i['href']) for i in to_delete_nc])
+                        for i, response in zip(to_delete_nc, responses):
+                            # Already deleted in NextCloud
+                            if response.ok or response.status == 404:
+                                delete_count += 1
+                                continue
+                            error = response.error or 'HTTP %s' % response.status
+                            log_obj.log_event('error', sync_log_id, error=error, message='Error deleting Nextcloud event for %s:\n' % user['user_name'])
+                            _logger.warning('Error deleting Nextcloud event for %s: %s' % (user['user_name'], error))
+                            journal_ids.filtered(lambda x: x.nc_uid == i['uid']).register_failure(error, operation='unlink')
+                            error_count += 1
+                        # The others are looked up by UID
                         for i in stg_events_not_in_nc['delete']:
-                            calendar_obj = self.get_old_calendar_object(connection_principal, i['uid'])
+                            if i.get('href'):
+                                continue
+                            if self.check_time_budget(start_time, budget):
+                                checkpoint = 'push'
+                                break
                             try:
+                                rate_limiter.wait()
+                                calendar_obj = self.get_old_calendar_object(connection_principal, i['uid'])
                                 calendar_obj.event(i['uid']).delete()
                                 delete_count += 1
                             except Exception as error:
                                 log_obj.log_event('error', sync_log_id, error=error, message='Error deleting Nextcloud event for %s:\n' % user['user_name'])
                                 _logger.warning('Error deleting Nextcloud event for %s: %s' % (user['user_name'], error))
+                                journal_ids.filtered(lambda x: x.nc_uid == i['uid']).register_failure(error, operation='unlink')
                                 error_count += 1
                                 continue
                     hours, minutes, seconds = log_obj.get_time_diff(nc_start)
                     log_obj.log_event('text', sync_log_id, message='Update Nextcloud duration: %s:%s:%s' % (hours, minutes, seconds))
 
-                # Saving process: NextCloud -> Odoo
-                if stg_events_not_in_odoo['create'] or stg_events_not_in_odoo['write'] or stg_events_not_in_odoo['delete']:
+                # Saving process: NextCloud -> Odoo, changes left by the update of NextCloud
+                if checkpoint != 'push' and (stg_events_not_in_odoo['create'] or stg_events_not_in_odoo['write'] or stg_events_not_in_odoo['delete']):
                     od_start = datetime.now()
                     log_obj.log_event('text', sync_log_id, message='Updating Odoo events')
-                    update_user_events_hash = True
-                    if stg_events_not_in_odoo['create']:
-                        log_obj.log_event('text', sync_log_id, message='Odoo: Creating records', operation_type='create')
-                        for items in stg_events_not_in_odoo['create']:
-                            try:
-                                # TODO: Handle issue with duplicate event in Odoo when the user is an attendee
-                                calendar_event_obj.with_context(sync=True).sudo().create(items)
-                                create_count += 1
-                            except Exception as error:
-                                log_obj.log_event('error', sync_log_id, error=error, message='Error creating Odoo event for %s:\n' % user['user_name'])
-                                _logger.warning('Error creating Odoo event for %s: %s' % (user['user_name'], error))
-                                error_count += 1
-                                continue
-                    if stg_events_not_in_odoo['write']:
-                        for items in stg_events_not_in_odoo['write']:
-                            try:
-                                calendar_event_obj.browse(items.pop('id')).with_context(sync=True).sudo().write(items)
-                                write_count += 1
-                            except Exception as error:
-                                log_obj.log_event('error', sync_log_id, error=error, message='Error updating Odoo event for %s:\n' % user['user_name'])
-                                _logger.warning('Error updating Odoo event for %s: %s' % (user['user_name'], error))
-                                continue
-                    if stg_events_not_in_odoo['delete']:
+                    counts = self.apply_odoo_changes(stg_events_not_in_odoo, user, sync_log_id)
+                    create_count += counts['create']
+                    write_count += counts['write']
+                    error_count += counts['error']
+                    user_retag_count += counts['retag']
+                    # Events not downloaded yet are unknown, do not delete anything before the end of the pull
+                    if stg_events_not_in_odoo['delete'] and not checkpoint:
                         log_obj.log_event('text', sync_log_id, message='Odoo: Deleting records', operation_type='delete')
                         for items in stg_events_not_in_odoo['delete']:
                             try:
                                 calendar_event_obj.browse(items.pop('id')).with_context(sync=True).sudo().unlink()
+                                delete_count += 1
                             except Exception as error:
                                 log_obj.log_event('error', sync_log_id, error=error, message='Error deleting Odoo event for %s:\n' % user['user_name'])
                                 _logger.warning('Error deleting Odoo event for %s: %s' % (user['user_name'], error))
-                                delete_count += 1
+                                error_count += 1
                                 continue
 
                     hours, minutes, seconds = log_obj.get_time_diff(od_start)
                     log_obj.log_event('text', sync_log_id, message='Update Odoo duration: %s:%s:%s' % (hours, minutes, seconds))
 
-                # Save nextcloud infos to odoo event
-                if update_user_events_hash:
-                    nc_events_to_save = self.get_all_nc_user_events(connection_principal)
-                    nc_events_hash_to_save = []
-                    for nc_event_to_save in nc_events_to_save:
-                        calendat_event_ids = calendar_event_obj.search([('nc_uid', '=', nc_event_to_save.vobject_instance.vevent.uid.value)])
-                        if calendat_event_ids:
-                            event_hash = self.get_event_hash('str', nc_event_to_save)
-                            calendat_event_ids.with_context(sync=True).write({'nc_calendar_hash': event_hash})
-                            nc_events_hash_to_save.append(event_hash)
-                    self.env['nc.sync.user'].browse(user['id']).user_events_hash = nc_events_hash_to_save if nc_events_hash_to_save else False
-
-        errors = sync_log_id.line_ids.filtered(lambda x: x.severity in ['error', 'critical'])
-        warnings = sync_log_id.line_ids.filtered(lambda x: x.severity in ['warning'])
-        infos = sync_log_id.line_ids.filtered(lambda x: not x.severity or x.severity in ['info'])
-        sync_log_id.description = f'{len(errors)} Error(s), {len(warnings)} Warning(s) and {len(infos)} Info(s)'
-
-        end_time = ttime.perf_counter()
-        elapsed = end_time - start_time
-        duration = round(elapsed, 2)
-        sync_log_id.duration = self.convert_readable_time_duration(duration)
-
-        hours, minutes, seconds = log_obj.get_time_diff(sync_start)
-        summary_message = '''Sync process duration: %s:%s:%s\n - Total create %s\n - Total write %s\n - Total delete %s\n - Total error %s''' % (
-            hours, minutes, seconds, create_count, write_count, delete_count, error_count)
-        log_obj.log_event('text', sync_log_id, message=summary_message)
+                # NextCloud infos of the Odoo events are saved along each write, pulled events get
+                # the hash and ETag of the downloaded data and pushed events the hash of the sent data
+                journal_ids.unlink_drained()
+
+                # Checkpoint: the user resumes first on the next run
+                sync_user_id = self.env['nc.sync.user'].browse(user['id'])
+                if checkpoint:
+                    sync_user_id.write({'sync_checkpoint': checkpoint, 'sync_pull_cursor': pull_cursor or user['sync_pull_cursor']})
+                    interrupted = True
+                else:
+                    sync_user_id.write({'sync_checkpoint': False, 'sync_pull_cursor': False, 'date_last_sync': datetime.now()})
+                    sync_user_id.schedule_next_sync(create_count + write_count + delete_count - user_change_count - user_retag_count)
+                self.env.cr.commit()
+                if self.check_time_budget(start_time, budget):
+                    break
+
+            if interrupted:
+                log_obj.log_event('text', sync_log_id, message='Sync stopped after %s seconds, it will resume on the next run' % round(ttime.perf_counter() - start_time))
+                cron_id = self.get_sync_cron(shard)
+                # A run which changed nothing (e.g. the same events keep failing) waits for the next scheduled run
+                if cron_id and cron_id.active and create_count + write_count + delete_count:
+                    cron_id._trigger()
+
+        sync_log_id.log_summary(ttime.perf_counter() - start_time, sync_start, create_count, write_count, delete_count, error_count)
+
+    def get_pull_batch(self, hrefs, cursor, size):
+        """
+        Function to get the next batch of events to download, in URL order starting after the last URL
+        of the previous batch and wrapping around at the end of the list
+        @hrefs = List, URLs of the changed events
+        @cursor = String, last URL of the previous batch
+        @size = Int, batch size
+        @return = List, URLs of the batch
+        """
+        hrefs = sorted(hrefs)
+        if cursor:
+            start = bisect.bisect_right(hrefs, cursor)
+            hrefs = hrefs[start:] + hrefs[:start]
+        return hrefs[:size]
+
+    def get_sync_time_budget(self):
+        """
+        Function to get the number of seconds a sync run can last before it stops and resumes on the next run.
+        Defaults to 80% of the worker time limit.
+        @return = Float, 0 if unlimited
+        """
+        budget = self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.sync_time_budget')
+        if budget:
+            return float(budget)
+        if not config.get('workers'):
+            # Threaded server: no time limit
+            return 0
+        # -1: the cron workers use the HTTP workers limit, 0: no limit
+        limit = config.get('limit_time_real_cron')
+        if limit is None or limit < 0:
+            limit = config.get('limit_time_real')
+        return limit * 0.8 if limit and limit > 0 else 0
+
+    def check_time_budget(self, start_time, budget):
+        """
+        Function to check if the sync run used its time budget
+        @start_time = Float, perf_counter value at the start of the run
+        @budget = Float, number of seconds, 0 if unlimited
+        @return = Bool
+        """
+        return bool(budget) and ttime.perf_counter() - start_time > budget
 
     def add_nc_alarm_data(self, event, valarm):
         if valarm:
-            event.vobject_instance.vevent.contents.pop('valarm', False)
-            for item in valarm:
-                alarm_obj = Alarm()
-                alarm_obj.add("action", "DISPLAY")
-                alarm_obj.add("TRIGGER;RELATED=START", item)
-                event.icalendar_component.add_component(alarm_obj)
+            vevent_writer.write_alarms(event.icalendar_component, valarm)
         return event
 
-    def get_events_with_updated_calendar(self, nc_events, user):
-        to_update_events = []
-        nc_uids = [x.vobject_instance.vevent.uid.value for x in nc_events]
-        calendar_event_ids = self.env['calendar.event'].search([('nc_uid', 'in', nc_uids)])
-        for i_nc in nc_events:
-            calendar_event_id = calendar_event_ids.filtered(lambda x: x.nc_uid == i_nc.vobject_instance.vevent.uid.value)
-            nc_calendar = calendar_event_id.nc_calendar_ids.filtered(lambda x: x.user_id == calendar_event_id.user_id)
-            if nc_calendar and calendar_event_id and nc_calendar.calendar_url != i_nc.parent.canonical_url:
-                result = self.get_caldav_record([i_nc], user, calendar_event_ids)
-                result[0].update({'id': calendar_event_id.id})
-                to_update_events.extend(result)
-        return to_update_events
-
     def get_user_calendar(self, connection, connection_principal, nc_calendar):
         principal_calendar_obj = False
         try:
             principal_calendar_obj = connection_principal.calendar(name=nc_calendar)
-            principal_calendar_obj.events()
+            # Fails when the calendar does not exist
+            principal_calendar_obj.get_display_name()
             calendar_obj = connection.calendar(url=principal_calendar_obj.url)
         except:
             calendar_obj = connection_principal.make_calendar(name=nc_calendar)
@@ -399,58 +652,133 @@ class Nextcloudcaldav(models.AbstractModel):
         """
         result = False
         if mode == 'list':
-            result = []
-            for nc_event_item in event:
-                vevent = jicson.fromText(nc_event_item.data).get('VCALENDAR')[0].get('VEVENT')[0]
-                vevent = json.dumps(vevent, sort_keys=True)
-                result.append(hashlib.sha1(vevent.encode('utf-8')).hexdigest())
+            result = [self.get_data_hash(nc_event_item.data) for nc_event_item in event]
         elif mode == 'str':
-            vevent = jicson.fromText(event.data).get('VCALENDAR')[0].get('VEVENT')[0]
-            vevent = json.dumps(vevent, sort_keys=True)
-            result = hashlib.sha1(vevent.encode('utf-8')).hexdigest()
+            result = self.get_data_hash(event.data)
         return result
 
+    def get_data_hash(self, data):
+        """
+        Function to get the hash of the VEVENT of iCalendar data
+        @data = String, iCalendar data
+        @return = String
+        """
+        vevent = jicson.fromText(data).get('VCALENDAR')[0].get('VEVENT')[0]
+        vevent = json.dumps(vevent, sort_keys=True)
+        return hashlib.sha1(vevent.encode('utf-8')).hexdigest()
+
+    def build_nc_event(self, item, calendar_url, organizer=False):
+        """
+        Function to build a new NextCloud event from the Odoo values
+        @item = Object, sync_record.OdooEvent
+        @calendar_url = String, URL of the NextCloud calendar
+        @organizer = Object, vCalAddress of the NextCloud user, organizer of the events with attendees
+        @return = Tuple, UID, URL and iCalendar data of the event
+        """
+        uid = str(uuid.uuid4())
+        return uid, '%s/%s.ics' % (calendar_url.rstrip('/'), uid), self.get_nc_event_data(item, uid, organizer)
+
+    def get_nc_event_data(self, item, uid, organizer=False):
+        """
+        Function to build the iCalendar data of a NextCloud event from the Odoo values, with its alarms and attendees
+        @item = Object, sync_record.OdooEvent
+        @uid = String, UID of the NextCloud event
+        @organizer = Object, vCalAddress of the NextCloud user, organizer of the events with attendees
+        @return = String
+        """
+        vals = item.get_values()
+        vals['uid'] = uid
+        if vals.get('attendee') and organizer:
+            vals['organizer'] = organizer
+        return vevent_writer.build_vcalendar(vals).to_ical().decode('utf-8')
+
+    def is_nc_calendar(self, calendar_obj, nc_calendar):
+        """
+        Function to check if a NextCloud calendar object is the calendar with the given name
+        @calendar_obj = Object, NextCloud calendar object
+        @nc_calendar = String, calendar name
+        @return = Bool
+        """
+        name = (calendar_obj.name or '').lower()
+        return bool(nc_calendar) and name in (nc_calendar.lower(), nc_calendar.replace(' ', '-').lower())
+
+    def update_nc_events(self, items, nc_listing, transport, organizer=False):
+        """
+        Function to replace NextCloud events with the Odoo values using concurrent PUTs conditioned on the
+        ETag of the listing, so that the changes made in NextCloud since the listing are never overwritten
+        @items = List, tuples of event URL and sync_record.OdooEvent
+        @nc_listing = Dictionary, result of get_nc_user_event_listing
+        @transport = Object, caldav_transport.CaldavTransport
+        @organizer = Object, vCalAddress of the NextCloud user, organizer of the events with attendees
+        @return = Tuple, number of updated events, list of conflicting (URL, values) and list of failed (Odoo ID, error)
+        """
+        to_send = []
+        failed = []
+        for href, item in items:
+            try:
+                to_send.append((href, item, self.get_nc_event_data(item, item.uid, organizer)))
+            except Exception as error:
+                failed.append((item.odoo_id, error))
+        responses = transport.send([transport.put_request(href, data, {'If-Match': nc_listing[href]['etag']}) for href, item, data in to_send])
+        updated_count = 0
+        conflicts = []
+        for (href, item, data), response in zip(to_send, responses):
+            if response.ok:
+                self.save_nc_event_state(item.odoo_id, item.uid, href, data, response.headers.get('ETag'))
+                updated_count += 1
+            elif response.status == 412:
+                conflicts.append((href, item))
+            else:
+                failed.append((item.odoo_id, response.error or 'PUT %s: %s' % (href, response.status)))
+        return updated_count, conflicts, failed
+
+    def resolve_nc_conflicts(self, conflicts, nc_listing, user, transport):
+        """
+        Function to resolve the events changed in NextCloud after the listing while Odoo was updating them.
+        Their current version is downloaded and the most recent change wins, see sync_merge.merge_writes.
+        @conflicts = List, tuples of event URL and sync_record.OdooEvent rejected with 412
+        @nc_listing = Dictionary, result of get_nc_user_event_listing, refreshed with the downloaded ETags
+        @user = Dictionary, User data
+        @transport = Object, caldav_transport.CaldavTransport
+        @return = Tuple, list of (URL, OdooEvent) to send again, list of values to write in Odoo
+                  and list of (Odoo ID, error) of the events deleted in NextCloud
+        """
+        nc_events = self.get_nc_events_by_href(nc_listing, [href for href, item in conflicts], transport)
+        downloaded = {x.url for x in nc_events}
+        inbound = self.get_nc_changes_in_odoo(nc_listing, nc_events, user)['write']
+        outbound, inbound = sync_merge.merge_writes([item for href, item in conflicts if href in downloaded], inbound)
+        kept = {id(x) for x in outbound}
+        retry_items = [(href, item) for href, item in conflicts if id(item) in kept]
+        # The ETag written by the retry is the current one
+        retry_ids = {item.odoo_id for href, item in retry_items}
+        inbound = [x for x in inbound if x.get('id') not in retry_ids]
+        missing = [(item.odoo_id, 'Event not found in Nextcloud') for href, item in conflicts if href not in downloaded]
+        return retry_items, inbound, missing
+
     def update_odoo_event(self, event, odoo_id):
         """
-        Function to update NextCloud related fields in odoo
+        Function to update NextCloud related fields in odoo from the event sent to NextCloud.
         @event = Object, NextCloud event object
         @odoo_id = Int, Odoo event ID
         """
-        self.env['calendar.event'].browse(odoo_id).with_context(sync=True).write({'nc_uid': event.vobject_instance.vevent.uid.value, 'nc_synced': True})
+        data = event.data
+        self.save_nc_event_state(odoo_id, sync_record.get_vevent_values(data, 'UID')[0], str(event.url), data)
 
-    def get_to_create_data_in_odoo(self, user, nc_events):
+    def save_nc_event_state(self, odoo_id, nc_uid, href, data, etag=False):
         """
-        Function to get whats to create in odoo
-        @user = Dictionary, User data
-        @nc_events = List, List of NextCloud events
-        @return = List, List of Event data
-        """
-        odoo_event_ids = self.env['calendar.event'].search([('user_id', '=', user['user_id'][0])])
-        nc_uids = [x.vobject_instance.vevent.uid.value for x in nc_events]
-        calendar_event_ids = self.env['calendar.event'].search([('nc_uid', 'in', nc_uids)])
-        nc_listed_events = self.get_caldav_record(nc_events, user, calendar_event_ids)
-        return [event for event in nc_listed_events if event['nc_uid'] not in odoo_event_ids.mapped('nc_uid')]
-
-    def get_to_update_data_in_odoo(self, odoo_events_hash, nc_events_hash, nc_events, user):
-        """
-        Function to get whats to update in odoo
-        @odoo_events_hash = List, Odoo event hash
-        @nc_events_hash = List, NextCloud event hash
-        @nc_events = List, List of NextCloud events
-        @return = List, List of Event data
-        """
-        nc_uids = [x.vobject_instance.vevent.uid.value for x in nc_events]
-        calendar_event_ids = self.env['calendar.event'].search([('nc_uid', 'in', nc_uids)])
-        event_ids = self.env['calendar.event'].search([('nc_calendar_hash', 'in', [event for event in odoo_events_hash if event not in nc_events_hash]), ('nc_synced', '=', True)])
-        stg_events_not_in_odoo = []
-        for odoo_event in event_ids:
-            for nc_event in nc_events:
-                listed_nc_event = self.get_caldav_record([nc_event], user, calendar_event_ids)
-                nc_uid = listed_nc_event[0]['nc_uid'] if listed_nc_event else False
-                if odoo_event.nc_uid == nc_uid:
-                    listed_nc_event[0]['id'] = odoo_event.id
-                    stg_events_not_in_odoo.extend(listed_nc_event)
-        return stg_events_not_in_odoo
+        Function to update NextCloud related fields in odoo from the data sent to NextCloud.
+        Without ETag, the next listing downloads the event and only compares its hash.
+        @odoo_id = Int, Odoo event ID
+        @nc_uid = String, UID of the NextCloud event
+        @href = String, URL of the NextCloud event
+        @data = String, iCalendar data sent to NextCloud
+        @etag = String, ETag returned by NextCloud
+        """
+        self.env['calendar.event'].browse(odoo_id).with_context(sync=True).write({'nc_uid': nc_uid,
+                                                                                  'nc_href': href,
+                                                                                  'nc_calendar_hash': self.get_data_hash(data),
+                                                                                  'nc_etag': etag or False,
+                                                                                  'nc_synced': True})
 
     def check_nextcloud_connection(self, url, username, password):
         """
@@ -476,13 +804,218 @@ class Nextcloudcaldav(models.AbstractModel):
                     'response_description': str(e)
                 }
 
-    def get_all_nc_user_events(self, client=False):
+    def get_nc_event_etags(self, calendar):
+        """
+        Function to list the events of a NextCloud calendar with their ETag using a single PROPFIND
+        @calendar = Object, NextCloud calendar object
+        @return = Dictionary, event URL as key and ETag as value
+        """
+        response = calendar.client.propfind(str(calendar.url), props=PROPFIND_ETAG, depth=1)
+        calendar_url = str(calendar.url).rstrip('/')
+        result = {}
+        for href, props in response.expand_simple_props([dav.GetEtag()]).items():
+            url = str(calendar.url.join(href))
+            if url.rstrip('/') != calendar_url:
+                result[url] = props.get(dav.GetEtag.tag)
+        return result
+
+    def get_nc_user_calendars(self, client, calendar_uris=False):
+        """
+        Function to get the calendars of a NextCloud user
+        @client = Object, NextCloud principal object
+        @calendar_uris = List, calendar URIs to keep, all the calendars if not set
+        @return = List, List of NextCloud calendar objects
+        """
         calendars = client.calendars()
-        result = []
+        if calendar_uris:
+            calendars = [x for x in calendars if unquote(str(x.url).rstrip('/').split('/')[-1]) in calendar_uris]
+        return calendars
+
+    def get_nc_user_event_listing(self, calendars):
+        """
+        Function to list the events of NextCloud calendars without downloading them
+        @calendars = List, List of NextCloud calendar objects
+        @return = Dictionary, event URL as key and a dictionary with ETag and calendar object as value
+        """
+        result = {}
         for calendar in calendars:
-            events = calendar.events()
-            if events:
-                result.extend(calendar.events())
+            for href, etag in self.get_nc_event_etags(calendar).items():
+                result[href] = {'etag': etag, 'calendar': calendar}
+        return result
+
+    def get_nc_events_by_href(self, nc_listing, hrefs, transport):
+        """
+        Function to download the given events with concurrent calendar-multiget REPORTs.
+        The ETags of the listing are refreshed with the downloaded ones.
+        @nc_listing = Dictionary, result of get_nc_user_event_listing
+        @hrefs = List, event URLs to download
+        @transport = Object, caldav_transport.CaldavTransport
+        @return = List, List of sync_record.NcEvent
+        """
+        hrefs_by_calendar = {}
+        for href in hrefs:
+            hrefs_by_calendar.setdefault(str(nc_listing[href]['calendar'].url), []).append(href)
+        downloaded = {x['path']: x for x in transport.multiget(hrefs_by_calendar).values()}
+        result = []
+        for href in hrefs:
+            item = downloaded.get(unquote(urlparse(href).path))
+            # Deleted since the listing
+            if not item:
+                continue
+            if item['etag']:
+                nc_listing[href]['etag'] = item['etag']
+            result.append(sync_record.NcEvent(href, nc_listing[href]['etag'], item['data'], nc_listing[href]['calendar']))
+        return result
+
+    def get_caldav_transport(self, user):
+        """
+        Function to get the concurrent CalDAV transport of a user. Its requests share the transport rate limit
+        of the NextCloud server (nextcloud_odoo_sync.caldav_rate_limit), separate from push_rate_limit.
+        They are sent by a thread pool, or by httpx if nextcloud_odoo_sync.caldav_use_httpx is set and httpx is installed.
+        @user = Dictionary, User data
+        @return = Object, caldav_transport.CaldavTransport
+        """
+        config_obj = self.env['ir.config_parameter'].sudo()
+        rate = float(config_obj.get_param('nextcloud_odoo_sync.caldav_rate_limit', caldav_transport.DEFAULT_RATE_LIMIT))
+        rate_limiter = throttle.get_rate_limiter(self.get_caldav_credentials()['url'], rate, 'transport')
+        return caldav_transport.CaldavTransport(user['user_name'], user['nc_password'],
+                                                max_in_flight=int(config_obj.get_param('nextcloud_odoo_sync.caldav_concurrency', 8)),
+                                                timeout=float(config_obj.get_param('nextcloud_odoo_sync.caldav_timeout', 30)),
+                                                rate_limiter=rate_limiter,
+                                                use_httpx=bool(config_obj.get_param('nextcloud_odoo_sync.caldav_use_httpx')))
+
+    def get_odoo_events_by_uid(self, nc_uids, user_id):
+        """
+        Function to get the Odoo events of a user linked to the given NextCloud UIDs with one query per chunk of UIDs.
+        An event shared with several users has an Odoo event per user, each one is only matched by its own user's sync.
+        @nc_uids = List, NextCloud event UIDs
+        @user_id = Int, res.users ID
+        @return = Dictionary, UID as key and calendar.event recordset as value
+        """
+        result = {}
+        calendar_event_obj = self.env['calendar.event']
+        for chunk in split_every(1000, set(filter(None, nc_uids))):
+            for event in calendar_event_obj.search([('nc_uid', 'in', list(chunk)), ('user_id', '=', user_id)]):
+                result[event.nc_uid] = result.get(event.nc_uid, calendar_event_obj) | event
+        return result
+
+    def get_odoo_event_etags(self, user):
+        """
+        Function to get the ETag saved on the Odoo events of the user during the last sync
+        @user = Dictionary, User data
+        @return = Dictionary, event URL as key and ETag as value
+        """
+        event_ids = self.env['calendar.event'].search_read([('user_id', '=', user['user_id'][0]), ('nc_href', '!=', False)], ['nc_href', 'nc_etag'])
+        return {x['nc_href']: x['nc_etag'] for x in event_ids}
+
+    def get_nc_changes_in_odoo(self, nc_listing, nc_events, user):
+        """
+        Function to get whats to create and update in odoo from the downloaded NextCloud events.
+        Events with a new ETag but an unchanged content only get their ETag updated.
+        @nc_listing = Dictionary, result of get_nc_user_event_listing
+        @nc_events = List, List of changed NextCloud events (sync_record.NcEvent)
+        @user = Dictionary, User data
+        @return = Dictionary, List of Event data per operation
+        """
+        result = {'create': [], 'write': [], 'delete': []}
+        calendar_event_obj = self.env['calendar.event']
+        nc_uids = [x.uid for x in nc_events]
+        odoo_events_by_uid = self.get_odoo_events_by_uid(nc_uids, user['user_id'][0])
+        calendar_event_ids = calendar_event_obj.union(*odoo_events_by_uid.values())
+        odoo_events = {x.nc_uid: x for x in calendar_event_ids}
+        to_parse = []
+        for nc_event, nc_uid in zip(nc_events, nc_uids):
+            href = nc_event.url
+            odoo_event = odoo_events.get(nc_uid)
+            # Secondary check for servers without stable ETags
+            if odoo_event and odoo_event.nc_href == href and odoo_event.nc_calendar_hash == self.get_event_hash('str', nc_event):
+                result['write'].append({'id': odoo_event.id, 'nc_etag': nc_listing[href]['etag']})
+            else:
+                to_parse.append(nc_event)
+        for nc_event, vals in zip(to_parse, self.get_caldav_record(to_parse, user, calendar_event_ids)):
+            href = nc_event.url
+            vals.update({'nc_href': href, 'nc_etag': nc_listing[href]['etag']})
+            odoo_event = odoo_events.get(vals.get('nc_uid'))
+            if odoo_event:
+                vals['id'] = odoo_event.id
+                result['write'].append(vals)
+            else:
+                result['create'].append(vals)
+        return result
+
+    def get_nc_deleted_in_odoo(self, nc_listing, nc_uids, user, full_sync=False, calendar_urls=False):
+        """
+        Function to get the Odoo events whose NextCloud event no longer exists
+        @nc_listing = Dictionary, result of get_nc_user_event_listing
+        @nc_uids = Set, UIDs of the downloaded NextCloud events
+        @user = Dictionary, User data
+        @full_sync = Bool, True when every NextCloud event of the user was downloaded
+        @calendar_urls = List, URLs of the listed calendars when only some calendars of the user are synced
+        @return = List, List of Event data to delete
+        """
+        result = []
+        domain = [('user_id', '=', user['user_id'][0]), ('nc_uid', '!=', False)]
+        if full_sync:
+            domain.append(('nc_uid', 'not in', list(nc_uids)))
+        else:
+            domain.append(('nc_href', '!=', False))
+        for odoo_event in self.env['calendar.event'].search(domain):
+            if calendar_urls and not (odoo_event.nc_href and odoo_event.nc_href.startswith(tuple(calendar_urls))):
+                continue
+            if not odoo_event.nc_href or odoo_event.nc_href not in nc_listing:
+                result.append({'id': odoo_event.id})
+        return result
+
+    def iter_nc_changes(self, nc_listing, hrefs, user, transport):
+        """
+        Function to download and compare the given NextCloud events one calendar and one chunk of events at a time,
+        so that only the events of the current chunk are held in memory
+        @nc_listing = Dictionary, result of get_nc_user_event_listing
+        @hrefs = List, event URLs to download
+        @user = Dictionary, User data
+        @transport = Object, caldav_transport.CaldavTransport
+        @return = Generator of tuples: URLs of the chunk, UIDs of the downloaded events and result of get_nc_changes_in_odoo
+        """
+        chunk_size = int(self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.pull_chunk_size', 500))
+        hrefs_by_calendar = {}
+        for href in hrefs:
+            hrefs_by_calendar.setdefault(str(nc_listing[href]['calendar'].url), []).append(href)
+        for calendar_hrefs in hrefs_by_calendar.values():
+            for chunk in split_every(chunk_size, calendar_hrefs, list):
+                nc_events = self.get_nc_events_by_href(nc_listing, chunk, transport)
+                yield chunk, [x.uid for x in nc_events], self.get_nc_changes_in_odoo(nc_listing, nc_events, user)
+
+    def apply_odoo_changes(self, stg_events, user, sync_log_id):
+        """
+        Function to create and update the Odoo events from the NextCloud changes
+        @stg_events = Dictionary, List of Event data per operation
+        @user = Dictionary, User data
+        @sync_log_id = Object, nc.sync.log single recordset
+        @return = Dictionary, number of created and updated events, number of updates of the NextCloud
+                  state only (retag, e.g. a new ETag for the same content) and number of errors
+        """
+        result = {'create': 0, 'write': 0, 'retag': 0, 'error': 0}
+        log_obj = self.env['nc.sync.log']
+        calendar_event_obj = self.env['calendar.event']
+        for items in stg_events['create']:
+            try:
+                # TODO: Handle issue with duplicate event in Odoo when the user is an attendee
+                calendar_event_obj.with_context(sync=True).sudo().create(items)
+                result['create'] += 1
+            except Exception as error:
+                log_obj.log_event('error', sync_log_id, error=error, message='Error creating Odoo event for %s:\n' % user['user_name'])
+                _logger.warning('Error creating Odoo event for %s: %s' % (user['user_name'], error))
+                result['error'] += 1
+        for items in stg_events['write']:
+            try:
+                calendar_event_obj.browse(items.pop('id')).with_context(sync=True).sudo().write(items)
+                result['write'] += 1
+                if set(items) <= NC_STATE_FIELDS:
+                    result['retag'] += 1
+            except Exception as error:
+                log_obj.log_event('error', sync_log_id, error=error, message='Error updating Odoo event for %s:\n' % user['user_name'])
+                _logger.warning('Error updating Odoo event for %s: %s' % (user['user_name'], error))
+                result['error'] += 1
         return result
 
     def get_caldav_event(self, user, date_from, date_to, calendar):
@@ -503,14 +1036,15 @@ class Nextcloudcaldav(models.AbstractModel):
         result = []
         organizer_user_id = self.env['res.users'].browse(user['user_id'][0])
         result.append(organizer_user_id.partner_id.id)
-        for record in nc_attendees:
-            value = record.split(':')[-1]
-            contact_id = self.env['res.partner'].search([('email', '=', value)], limit=1)
-            if contact_id:
-                result.append(contact_id.id)
-            else:
-                contact_id = self.env['res.partner'].create({'name': value, 'email': value, 'nc_sync': True})
-                result.append(contact_id.id)
+        emails = [record.split(':')[-1] for record in nc_attendees]
+        # One search for all the attendees, the missing contacts are created together
+        partners = {}
+        for contact_id in self.env['res.partner'].search([('email', 'in', emails)]):
+            partners.setdefault(contact_id.email, contact_id.id)
+        missing = [x for x in dict.fromkeys(emails) if x not in partners]
+        for contact_id in self.env['res.partner'].create([{'name': x, 'email': x, 'nc_sync': True} for x in missing]):
+            partners[contact_id.email] = contact_id.id
+        result.extend(partners[x] for x in emails)
         return [(6, 0, result)]
 
     def get_alarms_mapping(self):
@@ -539,53 +1073,47 @@ class Nextcloudcaldav(models.AbstractModel):
     def get_caldav_record(self, event, user, calendar_event_ids=False):
         """
         Function for parsing CalDav event and return a dictionary of Odoo field and values ready for create/write operation.
-        @event = string, event data
+        @event = List, List of sync_record.NcEvent
         @return = dictionary of Odoo fields with data
         """
         result = []
         calendar_ids = self.env['nc.calendar'].search([('user_id', '=', user['user_id'][0])])
+        odoo_field_mapping = self.get_caldav_fields()
         for record in event:
             vevent = jicson.fromText(record.data).get('VCALENDAR')[0].get('VEVENT')[0]
-            odoo_field_mapping = self.get_caldav_fields()
             vals = {}
-            nc_attendees = [value.value for value in record.vobject_instance.vevent.contents.get('attendee', []) if value]
+            nc_attendees = [value for value in sync_record.get_vevent_values(record.data, 'ATTENDEE') if value]
             all_day = False
             for e in vevent:
-                field_name = e.lower().split(";")
-                if field_name[0] in odoo_field_mapping:
-                    data = False
+                field_name, params = ical_decoder.split_property(e)
+                if field_name in odoo_field_mapping:
                     try:
-                        date_data = parse(vevent[e])
-                        tz = field_name[-1].split('=')[-1]
-                        if tz != 'date':
-                            data = self.convert_date(date_data, tz, 'utc')
-                        else:
-                            if field_name[0] == 'dtstart':
-                                data = date_data.date()
-                            elif field_name[0] == 'dtend':
-                                data = date_data.date() - timedelta(days=1)
-                            all_day = True
+                        data = ical_decoder.decode_property(field_name, params, vevent[e], record.data)
                     except Exception:
                         data = vevent[e]
-                    if field_name[0] == 'transp':
+                    if field_name in ('dtstart', 'dtend') and isinstance(data, date) and not isinstance(data, datetime):
+                        if field_name == 'dtend':
+                            data = data - timedelta(days=1)
+                        all_day = True
+                    if field_name == 'transp':
                         if vevent[e].lower() == 'opaque':
                             data = 'busy'
                         elif vevent[e].lower() == 'transparent':
                             data = 'free'
-                    elif field_name[0] == 'status':
+                    elif field_name == 'status':
                         status_vals = {
                             'confirmed': self.env.ref('nextcloud_odoo_sync.nc_event_status_confirmed').id,
                             'tentative': self.env.ref('nextcloud_odoo_sync.nc_event_status_tentative').id,
                             'canceled': self.env.ref('nextcloud_odoo_sync.nc_event_status_canceled').id
                         }
                         data = status_vals[vevent[e].lower()]
-                    elif field_name[0] == 'valarm':
+                    elif field_name == 'valarm':
                         data = self.get_odoo_alarms(vevent.get(e, []))
                     if data:
-                        vals[odoo_field_mapping[field_name[0]]] = data
-            calendar_id = calendar_ids.filtered(lambda x: x.calendar_url == record.parent.canonical_url)
+                        vals[odoo_field_mapping[field_name]] = data
+            calendar_id = calendar_ids.filtered(lambda x: x.calendar_url == record.calendar.canonical_url)
             if not calendar_id:
-                calendar_id = self.env['nc.calendar'].with_context(sync=True).create({'name': record.parent.name, 'user_id': user['user_id'][0], 'calendar_url': record.parent.canonical_url})
+                calendar_id = self.env['nc.calendar'].with_context(sync=True).create({'name': record.calendar.name, 'user_id': user['user_id'][0], 'calendar_url': record.calendar.canonical_url})
             if all_day:
                 vals['start_date'] = vals.pop('start')
                 vals['stop_date'] = vals.pop('stop')
@@ -627,11 +1155,29 @@ class Nextcloudcaldav(models.AbstractModel):
             'id': 'id'
         }
 
+    def get_caldav_keys(self, changed_fields):
+        """
+        Function to get the CalDav fields to update from the changed Odoo fields
+        @changed_fields = Set, changed calendar.event field names, False to update every field
+        @return = Set of CalDav fields, None to update every field
+        """
+        if not changed_fields:
+            return None
+        odoo_field_mapping = {v: [k] for k, v in self.get_caldav_fields().items()}
+        odoo_field_mapping.update({'start_date': ['dtstart'],
+                                   'stop_date': ['dtend'],
+                                   'duration': ['dtend'],
+                                   'allday': ['dtstart', 'dtend']})
+        result = set()
+        for field in changed_fields:
+            result.update(odoo_field_mapping.get(field, []))
+        return result
+
     def set_caldav_record(self, event):
         """
         Function for creating event in CalDav format for sending into NextCloud.
         @event - Odoo calendar single or multiple recordset
-        @return - List of multiple CalDav format events
+        @return - List of sync_record.OdooEvent
         """
         result = []
         odoo_field_mapping = {v: k for k, v in self.get_caldav_fields().items()}
@@ -653,10 +1199,9 @@ class Nextcloudcaldav(models.AbstractModel):
                     elif field == 'partner_ids':
                         vals[odoo_field_mapping[field]] = self.get_attendees(e[field], e)
                     elif field == 'description':
-                        soup = BeautifulSoup(e[field])
-                        description = soup.get_text('\n')
+                        description = html_text.html_to_text(e[field])
                         if description != '':
-                            vals[odoo_field_mapping[field]] = soup.get_text('\n')
+                            vals[odoo_field_mapping[field]] = description
                     elif field == 'nc_calendar_ids':
                         # Get the value related to the user_id
                         event_id = self.env['calendar.event'].browse(e['id'])
@@ -676,7 +1221,10 @@ class Nextcloudcaldav(models.AbstractModel):
                         vals[odoo_field_mapping[field]] = self.get_nc_vevent_values(e[field])
                     else:
                         vals[odoo_field_mapping[field]] = e[field]
-            result.append(vals)
+            result.append(sync_record.OdooEvent(vals.pop('id'),
+                                                calendar_name=vals.pop('nc_calendar_ids', False),
+                                                last_modified=vals.pop('last-modified', False),
+                                                **vals))
         return result
 
     def get_nc_vevent_values(self, value):
@@ -707,12 +1255,15 @@ class Nextcloudcaldav(models.AbstractModel):
         """
         dt_conv = False
         if mode and dt and tz:
+            tz_obj = ical_decoder.get_timezone(tz)
+            if tz_obj is None:
+                raise pytz.UnknownTimeZoneError(tz)
             if mode == 'utc':
-                dt_tz = pytz.timezone(tz).localize(dt, is_dst=None)
+                dt_tz = tz_obj.localize(dt, is_dst=None)
                 dt_conv = dt_tz.astimezone(pytz.utc).replace(tzinfo=None)
             if mode == 'local':
                 dt_tz = dt.replace(tzinfo=pytz.utc)
-                dt_conv = dt_tz.astimezone(pytz.timezone(tz)).replace(tzinfo=None)
+                dt_conv = dt_tz.astimezone(tz_obj).replace(tzinfo=None)
         return dt_conv
 
     def get_events_listed_dict(self, events_obj):
@@ -723,8 +1274,7 @@ class Nextcloudcaldav(models.AbstractModel):
         return result
 
     def get_local_datetime(self, datetime_datetime):
-        user_tz = self.env.user.tz or pytz.utc
-        local = pytz.timezone(user_tz)
+        local = ical_decoder.get_timezone(self.env.user.tz or 'UTC')
         return datetime_datetime.astimezone(local)
 
     def convert_readable_time_duration(self, total_time):
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import logging
+import time as ttime
+from datetime import datetime
+from urllib.parse import quote
+from odoo import models
+from odoo.tools import email_normalize, split_every
+from odoo.addons.nextcloud_odoo_sync.models import sync_record
+
+_logger = logging.getLogger(__name__)
+
+# Key of the PostgreSQL advisory lock guarding the contact sync, see nextcloud.caldav acquire_sync_lock
+CONTACT_SYNC_LOCK = 1313030003
+
+
+class NextcloudCarddav(models.AbstractModel):
+    _name = 'nextcloud.carddav'
+    _description = 'NextCloud CardDav'
+
+    def sync_contacts(self, sync_user_ids=False):
+        """
+        Function to import the contacts of the NextCloud address books into Odoo partners.
+        Only one contact sync can happen at a time.
+        @sync_user_ids = List, nc.sync.user IDs to sync, all the users syncing their contacts if not set
+        @return = Bool, False if another contact sync is running
+        """
+        caldav_obj = self.env['nextcloud.caldav']
+        if not caldav_obj.acquire_sync_lock(CONTACT_SYNC_LOCK):
+            _logger.warning('Another Nextcloud contact sync is running, skipping this run')
+            return False
+        try:
+            self.run_contact_sync(sync_user_ids)
+        except Exception:
+            # Session locks cannot be released in an aborted transaction
+            self.env.cr.rollback()
+            raise
+        finally:
+            caldav_obj.release_sync_lock(CONTACT_SYNC_LOCK)
+        return True
+
+    def run_contact_sync(self, sync_user_ids=False):
+        """
+        Function to sync the address books of the users, logging the errors and changes like the calendar sync
+        @sync_user_ids = List, nc.sync.user IDs to sync, all the users syncing their contacts if not set
+        """
+        self = self.sudo()
+        start_time = ttime.perf_counter()
+        sync_start = datetime.now()
+        log_obj = self.env['nc.sync.log']
+        caldav_obj = self.env['nextcloud.caldav']
+        credentials = caldav_obj.get_caldav_credentials()
+        counts = {'create': 0, 'write': 0, 'delete': 0, 'error': 0}
+
+        sync_log_id = log_obj.create({
+            'name': sync_start.strftime('%Y%m%d-%H%M%S'),
+            'date_start': sync_start,
+            'state': 'connecting',
+            'sync_type': 'contact',
+            'next_cloud_url': credentials['url'],
+            'odoo_url': self.env['ir.config_parameter'].get_param('web.base.url'),
+            'line_ids': [(0, 0, {'operation_type': 'login',
+                                 'response_description': 'Start Contact Sync Process'})],
+        })
+        domain = [('sync_contacts', '=', True)]
+        if sync_user_ids:
+            domain.append(('id', 'in', sync_user_ids))
+        users = self.env['nc.sync.user'].search_read(domain, ['user_id', 'user_name', 'nc_password', 'nextcloud_user_id'])
+        log_obj.log_event('text', sync_log_id, message='Number of users to sync: %s' % len(users))
+        for user in users:
+            log_obj.log_event('text', sync_log_id, message='Getting contacts for "%s"' % user['user_name'])
+            transport = caldav_obj.get_caldav_transport(user)
+            try:
+                addressbook_ids = self.update_user_addressbooks(user, transport, credentials['url'])
+            except Exception as error:
+                self.env.cr.rollback()
+                log_obj.log_event('error', sync_log_id, error=error, message='Error listing the address books of %s:' % user['user_name'])
+                _logger.warning('Error listing the address books of %s: %s' % (user['user_name'], error))
+                counts['error'] += 1
+                continue
+            for addressbook_id in addressbook_ids:
+                try:
+                    result = self.sync_addressbook(addressbook_id, transport)
+                except Exception as error:
+                    self.env.cr.rollback()
+                    log_obj.log_event('error', sync_log_id, error=error, message='Error syncing the address book "%s" of %s:' % (addressbook_id.name, user['user_name']))
+                    _logger.warning('Error syncing the address book "%s" of %s: %s' % (addressbook_id.name, user['user_name'], error))
+                    counts['error'] += 1
+                    continue
+                log_obj.log_event('text', sync_log_id, message='Address book "%s" of %s: %s created, %s updated, %s unlinked' % (
+                    addressbook_id.name, user['user_name'], result['create'], result['write'], result['delete']))
+                for key in result:
+                    counts[key] += result[key]
+        sync_log_id.log_summary(ttime.perf_counter() - start_time, sync_start, counts['create'], counts['write'], counts['delete'], counts['error'])
+
+    def update_user_addressbooks(self, user, transport, dav_url):
+        """
+        Function to discover the address books of a user and keep nc.addressbook in line with them
+        @user = Dictionary, nc.sync.user data
+        @transport = Object, caldav_transport.CaldavTransport of the user
+        @dav_url = String, NextCloud DAV URL
+        @return = Recordset, nc.addressbook of the user
+        """
+        addressbook_obj = self.env['nc.addressbook']
+        home_url = '%s/addressbooks/users/%s/' % (dav_url, quote(user['nextcloud_user_id'] or user['user_name']))
+        nc_addressbooks = transport.list_addressbooks(home_url)
+        addressbook_ids = addressbook_obj.search([('user_id', '=', user['user_id'][0])])
+        addressbook_ids.filtered(lambda x: x.addressbook_url not in nc_addressbooks).unlink()
+        known_urls = addressbook_ids.exists().mapped('addressbook_url')
+        addressbook_obj.create([{'name': name, 'user_id': user['user_id'][0], 'addressbook_url': url}
+                                for url, name in nc_addressbooks.items() if url not in known_urls])
+        return addressbook_obj.search([('user_id', '=', user['user_id'][0])])
+
+    def get_partner_etags(self, addressbook_id, hrefs=None):
+        """
+        Function to get the ETag of the vCards already imported from the address book
+        @addressbook_id = Object, nc.addressbook record
+        @hrefs = List, vCard URLs to look for, all the vCards of the address book if not set
+        @return = Dictionary, vCard URL as key and ETag as value
+        """
+        partner_obj = self.env['res.partner'].with_context(active_test=False)
+        domain = [('nc_addressbook_id', '=', addressbook_id.id)]
+        if hrefs is None:
+            return {x['nc_card_href']: x['nc_card_etag'] for x in partner_obj.search_read(domain, ['nc_card_href', 'nc_card_etag'])}
+        result = {}
+        for chunk in split_every(1000, hrefs):
+            for partner in partner_obj.search_read(domain + [('nc_card_href', 'in', list(chunk))], ['nc_card_href', 'nc_card_etag']):
+                result[partner['nc_card_href']] = partner['nc_card_etag']
+        return result
+
+    def sync_addressbook(self, addressbook_id, transport):
+        """
+        Function to import the vCards changed since the last sync of the address book. The changes are listed
+        with a sync-collection REPORT, the changed vCards are downloaded in chunks with addressbook-multiget
+        and each chunk is committed. The sync token is only saved once every change is applied.
+        @addressbook_id = Object, nc.addressbook record
+        @transport = Object, caldav_transport.CaldavTransport of the user
+        @return = Dictionary, number of created, updated and unlinked partners
+        """
+        counts = {'create': 0, 'write': 0, 'delete': 0}
+        chunk_size = int(self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.contact_chunk_size', 500))
+        url = addressbook_id.addressbook_url
+        full_sync = not addressbook_id.sync_token
+        listing = transport.sync_collection(url, addressbook_id.sync_token)
+        if listing is None:
+            # The token expired on the server: list every vCard again
+            full_sync = True
+            listing = transport.sync_collection(url)
+        changed, removed, sync_token = listing
+
+        # vCards already imported with the same ETag are not downloaded again
+        partner_etags = self.get_partner_etags(addressbook_id, None if full_sync else list(changed) + removed)
+        to_download = [href for href, etag in changed.items() if partner_etags.get(href) != etag]
+        for chunk in split_every(chunk_size, to_download):
+            nc_cards = transport.multiget({url: list(chunk)}, 'addressbook')
+            result = self.upsert_partners([sync_record.NcContact(href, x['etag'], x['data']) for href, x in nc_cards.items()], addressbook_id)
+            counts['create'] += result['create']
+            counts['write'] += result['write']
+            self.env.cr.commit()
+
+        # A full listing has no removed vCards, the imported ones missing from it were removed
+        if full_sync:
+            removed = [x for x in partner_etags if x not in changed]
+        counts['delete'] = self.unlink_removed_partners(addressbook_id, removed)
+        addressbook_id.write({'sync_token': sync_token, 'date_last_sync': datetime.now()})
+        self.env.cr.commit()
+        return counts
+
+    def upsert_partners(self, nc_contacts, addressbook_id):
+        """
+        Function to create or update the partners of a chunk of vCards. Partners are matched in bulk by vCard UID
+        within the address book, then by normalized email among the contacts not linked to a vCard yet:
+        partners already in Odoo only get the values set in the vCard. Companies and the partners of users
+        are never matched by email, a vCard must not overwrite them.
+        @nc_contacts = List, sync_record.NcContact
+        @addressbook_id = Object, nc.addressbook record
+        @return = Dictionary, number of created and updated partners
+        """
+        partner_obj = self.env['res.partner'].with_context(active_test=False)
+        nc_contacts = [x for x in nc_contacts if x.uid and x.name]
+        partners_by_uid = {x.nc_card_uid: x for x in partner_obj.search([('nc_addressbook_id', '=', addressbook_id.id),
+                                                                         ('nc_card_uid', 'in', [x.uid for x in nc_contacts])])}
+        emails = {email_normalize(x.email) for x in nc_contacts if x.uid not in partners_by_uid and x.email} - {False}
+        partners_by_email = {}
+        for partner in self.env['res.partner'].search([('email_normalized', 'in', list(emails)), ('nc_card_uid', '=', False),
+                                                        ('is_company', '=', False), ('user_ids', '=', False)], order='id'):
+            partners_by_email.setdefault(partner.email_normalized, partner)
+
+        vals_list = []
+        write_count = 0
+        for nc_contact in nc_contacts:
+            link_vals = {'nc_card_uid': nc_contact.uid,
+                         'nc_card_href': nc_contact.url,
+                         'nc_card_etag': nc_contact.etag,
+                         'nc_addressbook_id': addressbook_id.id}
+            partner = partners_by_uid.get(nc_contact.uid)
+            if not partner and nc_contact.email:
+                # A partner is linked to a single vCard
+                partner = partners_by_email.pop(email_normalize(nc_contact.email), None)
+            if partner:
+                partner.write(dict(nc_contact.get_partner_values(complete=partner.nc_card_uid == nc_contact.uid), **link_vals))
+                write_count += 1
+            else:
+                vals_list.append(dict(nc_contact.get_partner_values(), nc_sync=True, **link_vals))
+        partner_obj.create(vals_list)
+        return {'create': len(vals_list), 'write': write_count}
+
+    def unlink_removed_partners(self, addressbook_id, hrefs):
+        """
+        Function to unlink the partners from the vCards removed from the address book, the partners are kept in Odoo
+        @addressbook_id = Object, nc.addressbook record
+        @hrefs = List, URLs of the removed vCards
+        @return = Int, number of unlinked partners
+        """
+        count = 0
+        partner_obj = self.env['res.partner'].with_context(active_test=False)
+        for chunk in split_every(1000, hrefs):
+            partner_ids = partner_obj.search([('nc_addressbook_id', '=', addressbook_id.id), ('nc_card_href', 'in', list(chunk))])
+            partner_ids.write({'nc_card_uid': False, 'nc_card_href': False, 'nc_card_etag': False, 'nc_addressbook_id': False})
+            count += len(partner_ids)
+        return count
@@ -2,12 +2,189 @@
 # Copyright (c) 2022 iScale Solutions Inc.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 
-import requests
-from odoo import models
+import io
+import logging
+import mimetypes
+import os
+import tempfile
+from odoo import models, _
 from odoo.exceptions import ValidationError
-from odoo.http import request
+from odoo.addons.nextcloud_odoo_sync.models import webdav_client
+
+_logger = logging.getLogger(__name__)
+
+# Size of the blocks of attachment content read from the database
+DATABASE_BLOCK_SIZE = 1024 * 1024
 
 
 class NextcloudWebdav(models.AbstractModel):
     _name = 'nextcloud.webdav'
     _description = 'NextCloud WebDav'
+
+    def get_webdav_client(self):
+        """
+        Function to get the WebDAV client of the NextCloud account set in the settings
+        @return = Object, webdav_client.WebdavClient
+        """
+        credentials = self.env['nextcloud.caldav'].get_caldav_credentials()
+        config_obj = self.env['ir.config_parameter'].sudo()
+        return webdav_client.WebdavClient(credentials['url'], credentials['username'], credentials['pw'],
+                                          chunk_size=int(config_obj.get_param('nextcloud_odoo_sync.webdav_chunk_size', 10 * 1024 * 1024)),
+                                          timeout=float(config_obj.get_param('nextcloud_odoo_sync.webdav_timeout', 300)))
+
+    def download_attachment(self, path, attachment_id=False, values=None, client=None):
+        """
+        Function to download a NextCloud file into an attachment. The file is streamed straight to the filestore,
+        it is not downloaded again as long as its ETag does not change.
+        @path = String, path of the file in the NextCloud files, e.g. 'Projects/plan.pdf'
+        @attachment_id = Object, ir.attachment record to update, a new attachment is created if not set
+        @values = Dictionary, values of the new attachment (e.g. res_model and res_id)
+        @client = Object, webdav_client.WebdavClient, the one of the settings account if not set
+        @return = Object, ir.attachment record
+        """
+        client = client or self.get_webdav_client()
+        url = client.file_url(path)
+        stat = client.stat(url)
+        if not stat:
+            raise ValidationError(_('The file "%s" does not exist in Nextcloud') % path)
+        if attachment_id and attachment_id.nc_path == path and attachment_id.nc_etag == stat['etag'] \
+                and attachment_id.checksum and attachment_id.checksum == attachment_id.nc_checksum:
+            return attachment_id
+
+        attachment_obj = self.env['ir.attachment']
+        if attachment_obj._storage() == 'file':
+            fname, info = self.download_to_filestore(client, url)
+            content_vals = {}
+        else:
+            # Database storage keeps the content in a column, it cannot be streamed
+            _logger.warning('Attachments are stored in the database, %s is downloaded in memory' % path)
+            buffer = io.BytesIO()
+            info = client.download(url, buffer)
+            fname = False
+            content_vals = {'raw': buffer.getvalue()}
+
+        vals = dict(values or {}, **content_vals)
+        vals.update(nc_path=path, nc_etag=info['etag'] or stat['etag'], nc_last_modified=info['last_modified'] or stat['last_modified'],
+                    nc_checksum=info['checksum'])
+        if not attachment_id:
+            vals.setdefault('name', os.path.basename(path.rstrip('/')))
+            vals.setdefault('mimetype', mimetypes.guess_type(vals['name'])[0] or 'application/octet-stream')
+            attachment_id = attachment_obj.create(dict(vals, type='binary'))
+        else:
+            attachment_id.write(vals)
+        if fname:
+            self.set_attachment_file(attachment_id, fname, info['size'], info['checksum'])
+        return attachment_id
+
+    def download_to_filestore(self, client, url):
+        """
+        Function to stream a file into the filestore: the file is written to a temporary file next to the
+        attachments, then moved to its checksum path
+        @client = Object, webdav_client.WebdavClient
+        @url = String, file URL
+        @return = String, filestore file name, Dictionary, ETag, last modification, size and checksum of the file
+        """
+        attachment_obj = self.env['ir.attachment']
+        root = attachment_obj._full_path('')
+        os.makedirs(root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.nc-download-', dir=root)
+        try:
+            with os.fdopen(fd, 'wb') as fileobj:
+                info = client.download(url, fileobj)
+            fname = '%s/%s' % (info['checksum'][:2], info['checksum'])
+            full_path = attachment_obj._full_path(fname)
+            if os.path.isfile(full_path):
+                # Same content already in the filestore
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(tmp_path, full_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        # Removed by the garbage collector if the transaction is rolled back
+        attachment_obj._mark_for_gc(fname)
+        return fname, info
+
+    def copy_database_content(self, attachment_id):
+        """
+        Function to copy the content of an attachment stored in the database into a temporary file. The
+        content is read by blocks of the chunk size, it is never loaded in memory at once.
+        @attachment_id = Object, ir.attachment record
+        @return = Object, temporary binary file object, removed once closed
+        """
+        self.env['ir.attachment'].flush(['db_datas'], attachment_id)
+        fileobj = tempfile.TemporaryFile(prefix='.nc-upload-')
+        try:
+            offset = 0
+            while True:
+                # substring() of bytea counts from 1
+                self.env.cr.execute("SELECT substring(db_datas FROM %s FOR %s) FROM ir_attachment WHERE id = %s",
+                                    (offset + 1, DATABASE_BLOCK_SIZE, attachment_id.id))
+                row = self.env.cr.fetchone()
+                block = row and row[0] and bytes(row[0])
+                if not block:
+                    break
+                fileobj.write(block)
+                offset += len(block)
+            fileobj.seek(0)
+        except Exception:
+            fileobj.close()
+            raise
+        return fileobj
+
+    def set_attachment_file(self, attachment_id, fname, file_size, checksum):
+        """
+        Function to point an attachment to a file of the filestore. The ORM computes the file name, size
+        and checksum from the content, which is never loaded here.
+        @attachment_id = Object, ir.attachment record
+        @fname = String, filestore file name
+        @file_size = Int
+        @checksum = String, SHA-1 of the content
+        """
+        old_fname = attachment_id.store_fname
+        self.env['ir.attachment'].flush()
+        self.env.cr.execute("""
+            UPDATE ir_attachment
+               SET store_fname = %s, file_size = %s, checksum = %s, db_datas = NULL
+             WHERE id = %s
+        """, (fname, file_size, checksum, attachment_id.id))
+        attachment_id.invalidate_cache(['store_fname', 'file_size', 'checksum', 'db_datas', 'raw', 'datas'])
+        if old_fname and old_fname != fname:
+            attachment_id._file_delete(old_fname)
+
+    def upload_attachment(self, attachment_id, path=False, client=None):
+        """
+        Function to upload an attachment to NextCloud. The content is streamed from the filestore (or from a temporary
+        copy of the database content), in resumable chunks for large files, and is not uploaded again as long as
+        neither side changed.
+        @attachment_id = Object, ir.attachment record
+        @path = String, path of the file in the NextCloud files, the last uploaded path or the attachment name if not set
+        @client = Object, webdav_client.WebdavClient, the one of the settings account if not set
+        @return = Bool, False if the file was already up to date
+        """
+        client = client or self.get_webdav_client()
+        path = path or attachment_id.nc_path or attachment_id.name
+        url = client.file_url(path)
+        if attachment_id.nc_path == path and attachment_id.nc_checksum and attachment_id.nc_checksum == attachment_id.checksum:
+            stat = client.stat(url)
+            if stat and stat['etag'] == attachment_id.nc_etag:
+                return False
+
+        client.make_dirs(url)
+        if attachment_id.store_fname:
+            fileobj = open(attachment_id._full_path(attachment_id.store_fname), 'rb')
+        else:
+            fileobj = self.copy_database_content(attachment_id)
+        with fileobj:
+            size = os.fstat(fileobj.fileno()).st_size
+            # Same content to the same path: an interrupted upload is resumed
+            upload_id = 'odoo-%s-%s' % (attachment_id.id, attachment_id.checksum)
+            etag = client.upload(url, fileobj, size, upload_id)
+        stat = client.stat(url) or {}
+        attachment_id.write({'nc_path': path,
+                             'nc_etag': etag or stat.get('etag'),
+                             'nc_last_modified': stat.get('last_modified'),
+                             'nc_checksum': attachment_id.checksum})
+        return True
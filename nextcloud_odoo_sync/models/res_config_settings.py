@@ -10,6 +10,12 @@ class ResConfigSettings(models.TransientModel):
     nextcloud_password = fields.Char(string="Password")
     nextcloud_connection_status = fields.Selection([('online', 'Online'), ('fail', 'Failed to login')], "Connection Status")
     nextcloud_error = fields.Text(string="Error")
+    nextcloud_webhook_secret = fields.Char(string="Webhook Secret",
+                                           help="Nextcloud calendar notifications sent to /nextcloud_odoo_sync/webhook with this "
+                                                "bearer token trigger a sync of the affected calendar. The sync cron then only runs hourly.")
+    nextcloud_sync_shard_count = fields.Integer(string="Sync Shards", default=1,
+                                                help="Number of crons the users are split across, by ID modulo this number. "
+                                                     "Each cron syncs its own users so that several cron workers sync in parallel.")
 
     @api.model
     def set_values(self):
@@ -18,6 +24,14 @@ class ResConfigSettings(models.TransientModel):
         self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.nextcloud_url', self.nextcloud_url.strip("/"))
         self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.nextcloud_login', self.nextcloud_login)
         self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.nextcloud_password', self.nextcloud_password)
+        self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.webhook_secret', self.nextcloud_webhook_secret)
+        # With push notifications the cron is only a safety net
+        cron_id = self.env.ref('nextcloud_odoo_sync.ir_cron_nextcloud_odoo_sync_cron', raise_if_not_found=False)
+        if cron_id:
+            interval = {'interval_number': 1, 'interval_type': 'hours'} if self.nextcloud_webhook_secret else {'interval_number': 5, 'interval_type': 'minutes'}
+            cron_id.sudo().write(interval)
+        self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.sync_shard_count', max(self.nextcloud_sync_shard_count, 1))
+        self.env['nextcloud.caldav'].update_sync_shard_crons()
 
         if self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.enable_calendar_sync'):
             connection, connection_principal = self.env['nextcloud.caldav'].check_nextcloud_connection(url=self.nextcloud_url + '/remote.php/dav', username=self.nextcloud_login, password=self.nextcloud_password)
@@ -39,5 +53,7 @@ class ResConfigSettings(models.TransientModel):
             nextcloud_password=self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.nextcloud_password'),
             nextcloud_connection_status=self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.nextcloud_connection_status'),
             nextcloud_error=self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.nextcloud_error'),
+            nextcloud_webhook_secret=self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.webhook_secret'),
+            nextcloud_sync_shard_count=int(self.env['ir.config_parameter'].sudo().get_param('nextcloud_odoo_sync.sync_shard_count', 1)),
         )
         return res
@@ -8,4 +8,8 @@ from odoo import api, models, fields
 class ResPartner(models.Model):
     _inherit = 'res.partner'
     
-    nc_sync = fields.Boolean()
\ No newline at end of file
+    nc_sync = fields.Boolean()
+    nc_card_uid = fields.Char(string='vCard UID', index=True, copy=False)
+    nc_card_href = fields.Char(string='vCard URL', index=True, copy=False)
+    nc_card_etag = fields.Char(string='vCard ETag', copy=False)
+    nc_addressbook_id = fields.Many2one('nc.addressbook', string='Nextcloud Address Book', ondelete='set null', index=True, copy=False)
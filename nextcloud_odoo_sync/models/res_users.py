@@ -8,6 +8,8 @@ from odoo import api, models, fields
 class ResUsers(models.Model):
     _inherit = 'res.users'
 
+    nc_calendar_ids = fields.One2many('nc.calendar', 'user_id', string='Nextcloud Calendars')
+
     def setup_nc_sync_user(self):
         action = {
             'name': 'Nextcloud User Setup',
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from odoo import fields
+
+
+def get_winner(odoo_date, nc_date):
+    """
+    Decide which side of an event changed on both sides wins
+    @param: odoo_date, datetime, last update of the Odoo event
+    @param: nc_date, datetime, LAST-MODIFIED of the Nextcloud event
+    @return: string, 'odoo' or 'nextcloud' (Nextcloud wins ties, other clients already see its version)
+    """
+    if odoo_date and (not nc_date or odoo_date > nc_date):
+        return 'odoo'
+    return 'nextcloud'
+
+
+def merge_writes(outbound, inbound):
+    """
+    Resolve the events changed both in Odoo and Nextcloud since the last sync, keeping
+    the most recent change only. Both lists are matched on the event UID in one pass.
+    @param: outbound, list of sync_record.OdooEvent to write in Nextcloud
+    @param: inbound, list of event values to write in Odoo ('nc_uid' and 'write_date' keys)
+    @return: list, list - the outbound and inbound writes to apply
+    """
+    inbound_by_uid = {}
+    for item in inbound:
+        if item.get('nc_uid') and 'write_date' in item:
+            inbound_by_uid.setdefault(item['nc_uid'], []).append(item)
+    if not inbound_by_uid:
+        return outbound, inbound
+
+    outbound_result = []
+    conflict_uids = set()
+    discarded = set()
+    for item in outbound:
+        conflicts = inbound_by_uid.get(item.uid)
+        if not conflicts:
+            outbound_result.append(item)
+            continue
+        conflict_uids.add(item.uid)
+        odoo_date = fields.Datetime.to_datetime(item.last_modified)
+        odoo_wins = True
+        for inbound_item in conflicts:
+            nc_date = fields.Datetime.to_datetime(inbound_item.get('write_date'))
+            if get_winner(odoo_date, nc_date) == 'odoo':
+                discarded.add(id(inbound_item))
+            else:
+                odoo_wins = False
+        if odoo_wins:
+            outbound_result.append(item)
+    inbound_result = []
+    for item in inbound:
+        if id(item) in discarded:
+            continue
+        if item.get('nc_uid') in conflict_uids:
+            # Never force the write date of the Odoo event
+            item.pop('write_date', False)
+        inbound_result.append(item)
+    return outbound_result, inbound_result
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import re
+
+FOLDING = re.compile(r'\r?\n[ \t]')
+# Property name, with its optional vCard group (e.g. item1.EMAIL), up to its parameters or value
+PROPERTY_NAME = re.compile(r'(?:[\w-]+\.)?([\w-]+)')
+
+
+class OdooEvent(object):
+    """
+    Odoo event normalized for Nextcloud, see nextcloud.caldav set_caldav_record
+    """
+    __slots__ = ('odoo_id', 'uid', 'calendar_name', 'all_day', 'last_modified',
+                 'summary', 'dtstart', 'dtend', 'description', 'location', 'status', 'transp',
+                 'attendee', 'valarm', 'categories', 'repeat')
+    # iCalendar properties written by vevent_writer
+    PROPERTIES = ('uid', 'summary', 'dtstart', 'dtend', 'description', 'location', 'status', 'transp',
+                  'attendee', 'valarm', 'categories', 'repeat')
+
+    def __init__(self, odoo_id, uid=False, calendar_name=False, all_day=False, last_modified=False,
+                 summary=False, dtstart=False, dtend=False, description=False, location=False, status=False,
+                 transp=False, attendee=None, valarm=None, categories=False, repeat=False):
+        """
+        @param: odoo_id, int, calendar.event ID
+        @param: uid, string, UID of the Nextcloud event
+        @param: calendar_name, string, name of the Nextcloud calendar
+        @param: all_day, bool, dtstart and dtend are dates
+        @param: last_modified, datetime, last update of the Odoo event
+        @param: attendee, list of vCalAddress or mailto: URIs
+        @param: valarm, list of alarm trigger durations (e.g. ['-PT15M'])
+        """
+        self.odoo_id = odoo_id
+        self.uid = uid
+        self.calendar_name = calendar_name
+        self.all_day = all_day
+        self.last_modified = last_modified
+        self.summary = summary
+        self.dtstart = dtstart
+        self.dtend = dtend
+        self.description = description
+        self.location = location
+        self.status = status
+        self.transp = transp
+        # Shared empty tuples, most events have neither attendees nor alarms
+        self.attendee = attendee or ()
+        self.valarm = valarm or ()
+        self.categories = categories
+        self.repeat = repeat
+
+    def get_values(self, keys=None):
+        """
+        @param: keys, set of iCalendar properties to get, every property if not set
+        @return: dictionary of normalized values, see vevent_writer.write_properties
+        """
+        return {name: getattr(self, name) for name in self.PROPERTIES if keys is None or name in keys}
+
+
+class NcEvent(object):
+    """
+    Event downloaded from Nextcloud. Only the raw data is kept: unlike caldav.Event,
+    no vobject tree stays in memory once the event has been parsed.
+    """
+    __slots__ = ('url', 'etag', 'data', 'calendar', 'uid')
+
+    def __init__(self, url, etag, data, calendar):
+        """
+        @param: url, string, event URL
+        @param: etag, string
+        @param: data, string, iCalendar data
+        @param: calendar, caldav Calendar object of the event
+        """
+        self.url = url
+        self.etag = etag
+        self.data = data
+        self.calendar = calendar
+        values = get_vevent_values(data, 'UID')
+        self.uid = values[0] if values else False
+
+
+class NcContact(object):
+    """
+    vCard downloaded from a Nextcloud address book, reduced to the res.partner fields it maps to
+    """
+    __slots__ = ('url', 'etag', 'uid', 'name', 'email', 'phone', 'mobile', 'company_name', 'function')
+    # vCard properties mapped to res.partner fields
+    PROPERTIES = {'UID', 'FN', 'N', 'EMAIL', 'TEL', 'ORG', 'TITLE'}
+
+    def __init__(self, url, etag, data):
+        """
+        @param: url, string, vCard URL
+        @param: etag, string
+        @param: data, string, vCard data
+        """
+        self.url = url
+        self.etag = etag
+        self.uid = self.name = self.email = self.phone = self.mobile = self.company_name = self.function = False
+        names = False
+        for name, params, value in get_component_lines(data, 'VCARD', self.PROPERTIES):
+            params = params.upper()
+            if name == 'UID':
+                self.uid = self.uid or value.strip()
+            elif name == 'FN':
+                self.name = self.name or unescape_text(value).strip()
+            elif name == 'N':
+                # Family name;Given name;Additional names;Prefix;Suffix
+                parts = split_structured(value) + ['', '']
+                names = ' '.join(x for x in (parts[1], parts[0]) if x)
+            elif name == 'EMAIL':
+                value = unescape_text(value).strip()
+                if value.lower().startswith('mailto:'):
+                    value = value[7:]
+                # Preferred address first
+                if value and (not self.email or 'PREF' in params):
+                    self.email = value
+            elif name == 'TEL':
+                value = unescape_text(value).strip()
+                if value.lower().startswith('tel:'):
+                    value = value[4:]
+                if 'CELL' in params:
+                    self.mobile = self.mobile or value
+                else:
+                    self.phone = self.phone or value
+            elif name == 'ORG':
+                self.company_name = self.company_name or split_structured(value)[0]
+            elif name == 'TITLE':
+                self.function = self.function or unescape_text(value).strip()
+        self.name = self.name or names or self.email
+
+    def get_partner_values(self, complete=True):
+        """
+        @param: complete, bool, include the fields missing in the vCard to clear them in Odoo
+        @return: dictionary of res.partner values
+        """
+        values = {name: getattr(self, name) for name in ('name', 'email', 'phone', 'mobile', 'company_name', 'function')}
+        if not complete:
+            values = {name: value for name, value in values.items() if value}
+        return values
+
+
+def unescape_text(value):
+    """
+    Unescape a vCard text value (RFC 6350 section 3.4)
+    """
+    if '\\' not in value:
+        return value
+    return re.sub(r'\\(.)', lambda x: '\n' if x.group(1) in 'nN' else x.group(1), value)
+
+
+def split_structured(value):
+    """
+    Split a structured vCard value (e.g. N or ORG) on its unescaped semicolons
+    @return: list of unescaped strings
+    """
+    return [unescape_text(x).strip() for x in re.split(r'(?<!\\);', value)]
+
+
+def _get_value(line):
+    # The value starts after the first colon which is not in a quoted parameter
+    quoted = False
+    for i, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ':' and not quoted:
+            return line[i + 1:]
+    return ''
+
+
+def get_vevent_values(data, name):
+    """
+    Get the values of a property of the first VEVENT without parsing the whole
+    event, the properties of its sub-components (e.g. VALARM) are excluded
+    @param: data, string, iCalendar data
+    @param: name, string, property name (e.g. 'ATTENDEE')
+    @return: list of strings
+    """
+    result = []
+    name = name.upper()
+    size = len(name)
+    # 1 inside the VEVENT, more inside its sub-components
+    depth = 0
+    for line in FOLDING.sub('', data).splitlines():
+        if line.startswith('BEGIN:'):
+            if depth or line[6:].strip().upper() == 'VEVENT':
+                depth += 1
+        elif line.startswith('END:'):
+            if depth:
+                depth -= 1
+                if not depth:
+                    break
+        elif depth == 1 and line[:size].upper() == name and line[size:size + 1] in (':', ';'):
+            result.append(_get_value(line))
+    return result
+
+
+def get_component_lines(data, component, names=None):
+    """
+    Iterate over the unfolded property lines of the first component of the given type,
+    the lines of its sub-components (e.g. VALARM) are excluded
+    @param: data, string, iCalendar or vCard data
+    @param: component, string, e.g. 'VEVENT' or 'VCARD'
+    @param: names, set of upper case property names to get, every property if not set
+    @return: iterator of (upper case property name, parameters string, value)
+    """
+    # 1 inside the component, more inside its sub-components
+    depth = 0
+    for line in FOLDING.sub('', data).splitlines():
+        if line.startswith('BEGIN:'):
+            if depth or line[6:].strip().upper() == component:
+                depth += 1
+        elif line.startswith('END:'):
+            if depth:
+                depth -= 1
+                if not depth:
+                    break
+        elif depth == 1:
+            match = PROPERTY_NAME.match(line)
+            if not match:
+                continue
+            name = match.group(1).upper()
+            if names is not None and name not in names:
+                continue
+            value = _get_value(line)
+            yield name, line[match.end() + 1:len(line) - len(value) - 1], value
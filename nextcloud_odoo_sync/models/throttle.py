@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import threading
+import time
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimiter(object):
+    """
+    Spread the requests sent to a server so that no more than `rate` requests are sent per second
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Book the next request slot
+        @return: float, number of seconds to wait before sending the request
+        """
+        if not self.rate or self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+        return slot - now
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_rate_limiter(server, rate, channel='push'):
+    """
+    Return the rate limiter shared by every sync of the worker for the given server
+    @param: server, string, server URL
+    @param: rate, float, maximum number of requests per second
+    @param: channel, string, limiters of different channels are independent (e.g. 'push' or 'transport')
+    @return: RateLimiter
+    """
+    with _limiters_lock:
+        limiter = _limiters.get((server, channel))
+        if limiter is None:
+            limiter = _limiters[(server, channel)] = RateLimiter(rate)
+        limiter.rate = rate
+        return limiter
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import logging
+import uuid
+from datetime import datetime
+
+import pytz
+
+_logger = logging.getLogger(__name__)
+
+try:
+    from icalendar import Calendar, Event, Alarm, vCalAddress, vDuration
+except (ImportError, IOError) as err:
+    _logger.debug(err)
+
+
+# Properties that are removed from the VEVENT when the Odoo value is empty
+CLEARABLE_PROPERTIES = ('description', 'location')
+# Parameters of the attendees, same as the ones set by caldav save_with_invites
+ATTENDEE_PARAMS = {'PARTSTAT': 'NEEDS-ACTION', 'RSVP': 'TRUE', 'ROLE': 'REQ-PARTICIPANT', 'SCHEDULE-AGENT': 'NONE'}
+
+
+def _write_value(component, name, value):
+    component.pop(name, False)
+    component.add(name, value)
+
+
+def _write_upper(component, name, value):
+    _write_value(component, name, str(value).upper())
+
+
+def write_alarms(component, value):
+    """
+    Replace every VALARM of the component with the alarm triggers given
+    @param: component, icalendar Event component
+    @param: value, list of trigger durations (e.g. ['-PT15M', '-P1D'])
+    """
+    triggers = [x for x in value if x]
+    if not triggers:
+        return
+    component.subcomponents = [x for x in component.subcomponents if x.name != 'VALARM']
+    for trigger in triggers:
+        alarm_obj = Alarm()
+        alarm_obj.add('action', 'DISPLAY')
+        alarm_obj.add('trigger', vDuration.from_ical(trigger), parameters={'RELATED': 'START'})
+        component.add_component(alarm_obj)
+
+
+def _write_alarms(component, name, value):
+    write_alarms(component, value)
+
+
+def get_address(value):
+    """
+    @param: value, vCalAddress or string (email or mailto: URI)
+    @return: new vCalAddress, parameters of the given address are kept
+    """
+    address = vCalAddress(str(value) if str(value).lower().startswith('mailto:') else 'mailto:%s' % value)
+    if isinstance(value, vCalAddress):
+        address.params.update(value.params)
+    return address
+
+
+def write_attendees(component, value):
+    """
+    Replace every ATTENDEE of the component, the server must not send invitations
+    @param: component, icalendar Event component
+    @param: value, list of vCalAddress or strings (email or mailto: URI)
+    """
+    component.pop('attendee', False)
+    for attendee in value:
+        address = get_address(attendee)
+        if 'CUTYPE' not in address.params:
+            address.params['CUTYPE'] = 'UNKNOWN'
+        address.params.update(ATTENDEE_PARAMS)
+        component.add('attendee', address)
+
+
+def _write_attendees(component, name, value):
+    write_attendees(component, value)
+
+
+def _write_address(component, name, value):
+    _write_value(component, name, get_address(value))
+
+
+# Normalized Odoo value key (see nextcloud.caldav set_caldav_record) -> writer
+PROPERTY_WRITERS = {
+    'uid': _write_value,
+    'summary': _write_value,
+    'dtstart': _write_value,
+    'dtend': _write_value,
+    'description': _write_value,
+    'location': _write_value,
+    'status': _write_upper,
+    'transp': _write_upper,
+    'valarm': _write_alarms,
+    'attendee': _write_attendees,
+    'organizer': _write_address,
+}
+
+
+def write_properties(component, vals, keys=None):
+    """
+    Write the normalized Odoo values into an icalendar VEVENT component.
+    Keys without a writer (e.g. internal keys like nc_calendar_ids) are skipped
+    instead of failing the whole event.
+    @param: component, icalendar Event component
+    @param: vals, dictionary of normalized Odoo values
+    @param: keys, set of keys to write for a partial update, every key if not set
+    @return: icalendar Event component
+    """
+    for key, value in vals.items():
+        if keys is not None and key not in keys:
+            continue
+        writer = PROPERTY_WRITERS.get(key)
+        if not writer:
+            _logger.debug('No vevent writer for "%s", skipped' % key)
+            continue
+        if value in (False, None, ''):
+            continue
+        writer(component, key, value)
+    for name in CLEARABLE_PROPERTIES:
+        if (keys is None or name in keys) and not vals.get(name):
+            component.pop(name, False)
+    return component
+
+
+def build_vevent(vals):
+    """
+    Build a new VEVENT directly from the normalized Odoo values, without
+    loading the server copy of the event first. All-day events have date
+    values for dtstart and dtend, which are written as VALUE=DATE.
+    @param: vals, dictionary of normalized Odoo values
+    @return: icalendar Event component
+    """
+    component = Event()
+    component.add('uid', vals.get('uid') or str(uuid.uuid4()))
+    component.add('dtstamp', datetime.now(pytz.utc))
+    return write_properties(component, vals)
+
+
+def build_vcalendar(vals):
+    """
+    Wrap the VEVENT built by build_vevent() into a VCALENDAR
+    @param: vals, dictionary of normalized Odoo values
+    @return: icalendar Calendar
+    """
+    calendar = Calendar()
+    calendar.add('prodid', '-//iScale Solutions Inc.//Nextcloud-Odoo Sync//EN')
+    calendar.add('version', '2.0')
+    calendar.add_component(build_vevent(vals))
+    return calendar
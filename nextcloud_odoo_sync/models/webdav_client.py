@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import hashlib
+import logging
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, urljoin
+
+import requests
+from lxml import etree
+
+_logger = logging.getLogger(__name__)
+
+NSMAP = {'d': 'DAV:'}
+PROPFIND_STAT = ('<?xml version="1.0" encoding="utf-8"?><d:propfind xmlns:d="DAV:"><d:prop>'
+                 '<d:getetag/><d:getlastmodified/><d:getcontentlength/><d:resourcetype/></d:prop></d:propfind>')
+# Size of the blocks read from the network or the disk, the memory used by a transfer does not depend on the file size
+BLOCK_SIZE = 64 * 1024
+# Nextcloud rejects the chunks of an upload smaller than 5 MiB (except the last one) or larger than 5 GiB
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+MAX_CHUNK_SIZE = 5 * 1024 * 1024 * 1024
+
+
+class FileSlice(object):
+    """
+    Read-only view on a part of a file, sent by requests block by block with its Content-Length
+    """
+
+    def __init__(self, fileobj, offset, length):
+        """
+        @param: fileobj, binary file object
+        @param: offset, int, start of the part
+        @param: length, int, size of the part
+        """
+        self.fileobj = fileobj
+        self.offset = offset
+        self.length = length
+        self.position = 0
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if not size:
+            return b''
+        # Each read seeks: the chunks of a file may be read in any order
+        self.fileobj.seek(self.offset + self.position)
+        data = self.fileobj.read(size)
+        self.position += len(data)
+        return data
+
+
+class WebdavClient(object):
+    """
+    Stream files to and from the Nextcloud WebDAV API. Large files are uploaded with the chunked
+    upload API (v2) in resumable chunks, so a failed upload only sends its missing chunks again.
+    """
+
+    def __init__(self, dav_url, username, password, chunk_size=10 * 1024 * 1024, timeout=60):
+        """
+        @param: dav_url, string, e.g. https://cloud.example.com/remote.php/dav
+        @param: username, string
+        @param: password, string
+        @param: chunk_size, int, files above this size are uploaded in chunks of this size, between 5 MiB and 5 GiB
+        @param: timeout, float, timeout of each request in seconds
+        """
+        self.dav_url = dav_url.rstrip('/')
+        self.username = username
+        self.chunk_size = min(max(int(chunk_size), MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+
+    def file_url(self, path):
+        """
+        @param: path, string, path of the file in the user files, e.g. 'Projects/plan.pdf'
+        @return: string
+        """
+        return '%s/files/%s/%s' % (self.dav_url, quote(self.username), quote(path.strip('/')))
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def stat(self, url):
+        """
+        @param: url, string, file URL
+        @return: dictionary with the ETag, last modification (naive UTC datetime) and size of the file, None if it does not exist
+        """
+        response = self.request('PROPFIND', url, data=PROPFIND_STAT, headers={'Depth': '0', 'Content-Type': 'application/xml; charset=utf-8'})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        result = parse_propfind(response.content, url)
+        return result.get(url) or next(iter(result.values()), None)
+
+    def make_dirs(self, url):
+        """
+        Create the missing parent folders of a file
+        @param: url, string, file URL
+        """
+        root = '%s/files/%s/' % (self.dav_url, quote(self.username))
+        parts = url[len(root):].split('/')[:-1]
+        for i in range(len(parts)):
+            response = self.request('MKCOL', root + '/'.join(parts[:i + 1]))
+            # 405: the folder already exists
+            if response.status_code not in (201, 405):
+                response.raise_for_status()
+
+    def download(self, url, fileobj):
+        """
+        Stream a file into a file object, block by block
+        @param: url, string, file URL
+        @param: fileobj, binary file object open for writing
+        @return: dictionary with the ETag, last modification, size and SHA-1 of the file
+        """
+        sha1 = hashlib.sha1()
+        size = 0
+        with self.request('GET', url, stream=True) as response:
+            response.raise_for_status()
+            for block in response.iter_content(BLOCK_SIZE):
+                fileobj.write(block)
+                sha1.update(block)
+                size += len(block)
+            return {'etag': response.headers.get('ETag'),
+                    'last_modified': parse_http_date(response.headers.get('Last-Modified')),
+                    'size': size,
+                    'checksum': sha1.hexdigest()}
+
+    def upload(self, url, fileobj, size, upload_id):
+        """
+        Upload a file, in chunks if it is larger than the chunk size
+        @param: url, string, file URL
+        @param: fileobj, binary file object open for reading
+        @param: size, int, file size
+        @param: upload_id, string, stable identifier of the upload, an interrupted upload with the same identifier is resumed
+        @return: string, ETag of the uploaded file
+        """
+        if size <= self.chunk_size:
+            response = self.request('PUT', url, data=FileSlice(fileobj, 0, size))
+            response.raise_for_status()
+            return get_etag(response)
+        return self.upload_chunks(url, fileobj, size, upload_id)
+
+    def upload_chunks(self, url, fileobj, size, upload_id):
+        """
+        Upload a file with the chunked upload API: the chunks are sent to a temporary upload folder,
+        then assembled into the file by Nextcloud. Chunks already in the upload folder are not sent again.
+        """
+        upload_url = '%s/uploads/%s/%s' % (self.dav_url, quote(self.username), quote(upload_id))
+        headers = {'Destination': url, 'OC-Total-Length': str(size)}
+        uploaded = self.list_chunks(upload_url)
+        if uploaded is None:
+            uploaded = {}
+            response = self.request('MKCOL', upload_url, headers=headers)
+            response.raise_for_status()
+        elif uploaded:
+            _logger.info('Resuming the upload of %s, %s chunk(s) already uploaded' % (url, len(uploaded)))
+        for index, offset in enumerate(range(0, size, self.chunk_size), 1):
+            # Chunk names are sorted to assemble the file, from 00001 to 10000
+            name = '%05d' % index
+            length = min(self.chunk_size, size - offset)
+            if uploaded.get(name) == length:
+                continue
+            response = self.request('PUT', '%s/%s' % (upload_url, name), data=FileSlice(fileobj, offset, length), headers=headers)
+            response.raise_for_status()
+        response = self.request('MOVE', '%s/.file' % upload_url, headers=headers)
+        response.raise_for_status()
+        return get_etag(response)
+
+    def list_chunks(self, upload_url):
+        """
+        @param: upload_url, string, upload folder URL
+        @return: dictionary, chunk name as key and size as value, None if the upload folder does not exist
+        """
+        response = self.request('PROPFIND', upload_url, data=PROPFIND_STAT, headers={'Depth': '1', 'Content-Type': 'application/xml; charset=utf-8'})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return {url.rstrip('/').rsplit('/', 1)[-1]: x['size'] for url, x in parse_propfind(response.content, upload_url).items()
+                if not x['collection']}
+
+
+def get_etag(response):
+    # Nextcloud returns the ETag of the assembled file of a chunked upload in OC-ETag
+    return response.headers.get('OC-ETag') or response.headers.get('ETag')
+
+
+def parse_http_date(value):
+    """
+    @param: value, string, HTTP date (e.g. 'Thu, 15 Jun 2023 10:00:00 GMT')
+    @return: naive UTC datetime or False
+    """
+    if not value:
+        return False
+    try:
+        return parsedate_to_datetime(value).astimezone(timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return False
+
+
+def parse_propfind(content, base_url):
+    """
+    Parse the multistatus body of a PROPFIND request
+    @param: content, bytes
+    @param: base_url, string, URL the hrefs are relative to
+    @return: dictionary, resource URL as key and a dictionary with ETag, last modification, size and collection flag as value
+    """
+    result = {}
+    root = etree.fromstring(content, parser=etree.XMLParser(resolve_entities=False))
+    for response in root.iterfind('d:response', NSMAP):
+        href = response.findtext('d:href', namespaces=NSMAP)
+        # Missing properties come in a separate 404 propstat
+        prop = next((x.find('d:prop', NSMAP) for x in response.iterfind('d:propstat', NSMAP)
+                     if ' 200 ' in (x.findtext('d:status', namespaces=NSMAP) or '')), None)
+        if not href or prop is None:
+            continue
+        size = prop.findtext('d:getcontentlength', namespaces=NSMAP)
+        result[urljoin(base_url, href)] = {'etag': prop.findtext('d:getetag', namespaces=NSMAP),
+                                           'last_modified': parse_http_date(prop.findtext('d:getlastmodified', namespaces=NSMAP)),
+                                           'size': int(size) if size else 0,
+                                           'collection': prop.find('d:resourcetype/d:collection', NSMAP) is not None}
+    return result
@@ -1 +1,14 @@
-from . import test_nextcloud_config
\ No newline at end of file
+from . import test_nextcloud_config
+from . import test_ical_decoder
+from . import test_vevent_writer
+from . import test_html_text
+from . import test_webhook
+from . import test_sync_lock
+from . import test_sync_schedule
+from . import test_sync_log
+from . import test_sync_merge
+from . import test_calendar_event
+from . import test_caldav_transport
+from . import test_sync_record
+from . import test_carddav
+from . import test_webdav
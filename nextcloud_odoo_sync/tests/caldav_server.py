@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+NSMAP = {'d': 'DAV:', 'c': 'urn:ietf:params:xml:ns:caldav', 'card': 'urn:ietf:params:xml:ns:carddav'}
+SYNC_TOKEN = 'http://sabre.io/ns/sync/%s'
+
+
+class CaldavStandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _path(self):
+        return unquote(urlparse(self.path).path)
+
+    def do_PUT(self):
+        body = self._read_body()
+        time.sleep(self.server.latency)
+        path = self._path()
+        with self.server.lock:
+            current = self.server.events.get(path)
+            if self.headers.get('If-None-Match') == '*' and current:
+                return self._reply(412)
+            if_match = self.headers.get('If-Match')
+            if if_match and (not current or current['etag'] != if_match):
+                return self._reply(412)
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            self.server.events[path] = {'etag': etag, 'data': body}
+            self.server.changes.append(path)
+        self._reply(204 if current else 201, headers={'ETag': etag})
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        event = self.server.events.get(self._path())
+        if not event:
+            return self._reply(404)
+        self._reply(200, event['data'], {'ETag': event['etag'], 'Content-Type': 'text/calendar'})
+
+    def do_DELETE(self):
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            event = self.server.events.get(self._path())
+            if not event:
+                return self._reply(404)
+            if_match = self.headers.get('If-Match')
+            if if_match and event['etag'] != if_match:
+                return self._reply(412)
+            del self.server.events[self._path()]
+            self.server.changes.append(self._path())
+        self._reply(204)
+
+    def _reply_multistatus(self, responses, extra=''):
+        content = ('<?xml version="1.0" encoding="utf-8"?><d:multistatus xmlns:d="DAV:" xmlns:c="urn:ietf:params:xml:ns:caldav" '
+                   'xmlns:card="urn:ietf:params:xml:ns:carddav">%s%s</d:multistatus>' % (''.join(responses), extra)).encode('utf-8')
+        self._reply(207, content, {'Content-Type': 'application/xml; charset=utf-8'})
+
+    def do_REPORT(self):
+        body = self._read_body()
+        time.sleep(self.server.latency)
+        self.server.reports.append(self._path())
+        root = etree.fromstring(body)
+        if root.tag == '{DAV:}sync-collection':
+            return self._sync_collection(root)
+        data_tag = 'card:address-data' if root.tag.endswith('addressbook-multiget') else 'c:calendar-data'
+        responses = []
+        for href in root.iterfind('d:href', NSMAP):
+            event = self.server.events.get(unquote(href.text))
+            if event:
+                responses.append('<d:response><d:href>%s</d:href><d:propstat><d:prop><d:getetag>%s</d:getetag>'
+                                 '<%s>%s</%s></d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>' % (
+                                     escape(href.text), escape(event['etag']), data_tag, escape(event['data'].decode('utf-8')), data_tag))
+            else:
+                responses.append('<d:response><d:href>%s</d:href><d:status>HTTP/1.1 404 Not Found</d:status></d:response>' % escape(href.text))
+        self._reply_multistatus(responses)
+
+    def _sync_collection(self, root):
+        # Sync tokens are positions in the change log of the server
+        collection = self._path()
+        token = root.findtext('d:sync-token', namespaces=NSMAP)
+        with self.server.lock:
+            if token:
+                position = token[len(SYNC_TOKEN) - 2:]
+                if not token.startswith(SYNC_TOKEN[:-2]) or not position.isdigit() or int(position) > len(self.server.changes):
+                    return self._reply(403, b'<?xml version="1.0" encoding="utf-8"?><d:error xmlns:d="DAV:"><d:valid-sync-token/></d:error>')
+                paths = set(self.server.changes[int(position):])
+            else:
+                paths = set(self.server.events)
+            events = {x: self.server.events.get(x) for x in paths if x.startswith(collection) and x != collection}
+            new_token = SYNC_TOKEN % len(self.server.changes)
+        responses = []
+        for path, event in sorted(events.items()):
+            if event:
+                responses.append('<d:response><d:href>%s</d:href><d:propstat><d:prop><d:getetag>%s</d:getetag></d:prop>'
+                                 '<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>' % (escape(path), escape(event['etag'])))
+            else:
+                responses.append('<d:response><d:href>%s</d:href><d:status>HTTP/1.1 404 Not Found</d:status></d:response>' % escape(path))
+        self._reply_multistatus(responses, '<d:sync-token>%s</d:sync-token>' % escape(new_token))
+
+    def do_PROPFIND(self):
+        # Collections are the parent paths of the stored members
+        self._read_body()
+        home = self._path()
+        collections = {x.rsplit('/', 1)[0] + '/' for x in self.server.events if x.startswith(home)}
+        responses = ['<d:response><d:href>%s</d:href><d:propstat><d:prop><d:resourcetype><d:collection/>%s</d:resourcetype>'
+                     '<d:displayname>%s</d:displayname></d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>' % (
+                         escape(x), '<card:addressbook/>' if '/addressbooks/' in x else '<c:calendar/>', escape(x.rstrip('/').split('/')[-1]))
+                     for x in sorted(collections) if x != home]
+        self._reply_multistatus(responses)
+
+
+class CaldavStandIn(ThreadingHTTPServer):
+    """
+    Minimal local CalDAV and CardDAV server storing events and vCards in memory, each request waits `latency`
+    seconds to simulate the round-trip to a remote Nextcloud
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super(CaldavStandIn, self).__init__(('127.0.0.1', 0), CaldavStandInHandler)
+        self.latency = latency
+        self.events = {}
+        # Paths of the created, updated and deleted members, in order
+        self.changes = []
+        # Paths of the REPORT requests received
+        self.reports = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a request (timeouts) are expected
+        pass
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import asyncio
+import logging
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from odoo.tests import common, tagged
+from odoo.addons.nextcloud_odoo_sync.models import caldav_transport, nextcloud_caldav, sync_record, throttle
+from odoo.addons.nextcloud_odoo_sync.tests.caldav_server import CaldavStandIn
+
+_logger = logging.getLogger(__name__)
+
+EVENT = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//iScale Solutions Inc.//Nextcloud-Odoo Sync//EN
+BEGIN:VEVENT
+UID:%s
+DTSTAMP:20230615T080000Z
+DTSTART:20230615T100000Z
+DTEND:20230615T110000Z
+SUMMARY:Event & <%s>
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+class TestCaldavTransport(common.TransactionCase):
+
+    def setUp(self):
+        super(TestCaldavTransport, self).setUp()
+        self.server = CaldavStandIn().start()
+        self.addCleanup(self.server.stop)
+        self.calendar_url = '%s/remote.php/dav/calendars/admin/personal/' % self.server.url
+        self.transport = caldav_transport.CaldavTransport('admin', 'admin', max_in_flight=4, timeout=5)
+
+    def test_put_multiget_delete(self):
+        urls = ['%sevent-%s.ics' % (self.calendar_url, i) for i in range(150)]
+        responses = self.transport.send([self.transport.put_request(url, EVENT % (i, i)) for i, url in enumerate(urls)])
+        self.assertTrue(all(x.status == 201 for x in responses))
+        self.assertTrue(all(x.headers.get('ETag') for x in responses))
+
+        # Two chunks of REPORT, the events are returned with their ETag
+        result = self.transport.multiget({self.calendar_url: urls})
+        self.assertEqual(set(result), set(urls))
+        self.assertEqual(result[urls[7]]['etag'], responses[7].headers['ETag'])
+        self.assertIn('SUMMARY:Event & <7>', result[urls[7]]['data'])
+
+        responses = self.transport.send([self.transport.delete_request(url) for url in urls[:2]])
+        self.assertEqual([x.status for x in responses], [204, 204])
+        self.assertEqual(len(self.server.events), 148)
+
+    def test_running_event_loop(self):
+        # Sent from code running in an event loop
+        async def send(transport):
+            return transport.send([transport.delete_request('%smissing.ics' % self.calendar_url)])
+        self.assertFalse(self.transport.use_httpx)
+        self.assertEqual(asyncio.run(send(self.transport))[0].status, 404)
+        if caldav_transport.httpx:
+            transport = caldav_transport.CaldavTransport('admin', 'admin', timeout=5, use_httpx=True)
+            self.assertEqual(asyncio.run(send(transport))[0].status, 404)
+
+        async def nested():
+            return caldav_transport.run_coroutine(asyncio.sleep(0, 'done'))
+        self.assertEqual(asyncio.run(nested()), 'done')
+
+    def test_timeout(self):
+        self.server.latency = 0.5
+        transport = caldav_transport.CaldavTransport('admin', 'admin', timeout=0.1)
+        response = transport.send([transport.delete_request('%smissing.ics' % self.calendar_url)])[0]
+        self.assertFalse(response.ok)
+        self.assertTrue(response.error)
+
+
+class TestNcEventPush(common.TransactionCase):
+
+    def setUp(self):
+        super(TestNcEventPush, self).setUp()
+        self.server = CaldavStandIn().start()
+        self.addCleanup(self.server.stop)
+        self.calendar_url = '%s/remote.php/dav/calendars/admin/personal/' % self.server.url
+        self.transport = caldav_transport.CaldavTransport('admin', 'admin')
+        self.caldav_obj = self.env['nextcloud.caldav']
+
+    def create_nc_event(self, item, event_id):
+        uid, url, data = self.caldav_obj.build_nc_event(item, self.calendar_url, 'mailto:admin@example.com')
+        response = self.transport.send([self.transport.put_request(url, data, {'If-None-Match': '*'})])[0]
+        self.assertEqual(response.status, 201)
+        self.caldav_obj.save_nc_event_state(event_id.id, uid, url, data, response.headers.get('ETag'))
+        return url
+
+    def test_create_single_put(self):
+        event_id = self.env['calendar.event'].with_context(sync=True).create({'name': 'Review',
+                                                                              'start': datetime(2023, 6, 15, 10),
+                                                                              'stop': datetime(2023, 6, 15, 11)})
+        url = self.create_nc_event(sync_record.OdooEvent(event_id.id, calendar_name='Personal', summary='Review',
+                                                         dtstart=datetime(2023, 6, 15, 10), dtend=datetime(2023, 6, 15, 11),
+                                                         status='confirmed', transp='TRANSPARENT', valarm=['-PT15M', None],
+                                                         attendee=['mailto:jane@example.com']), event_id)
+        # The event is complete on the server and its ETag is known without downloading it
+        data = self.server.events[url[len(self.server.url):]]
+        self.assertEqual(event_id.nc_etag, data['etag'])
+        self.assertEqual(event_id.nc_href, url)
+        self.assertTrue(event_id.nc_synced)
+        ical = data['data'].decode('utf-8').replace('\r\n ', '')
+        for line in ('UID:%s' % event_id.nc_uid, 'STATUS:CONFIRMED', 'TRANSP:TRANSPARENT', 'TRIGGER;RELATED=START:-PT15M',
+                     'ORGANIZER:mailto:admin@example.com', 'SCHEDULE-AGENT=NONE'):
+            self.assertIn(line, ical)
+        self.assertEqual(ical.count('BEGIN:VALARM'), 1)
+
+        # Creating the same URL again never overwrites the event
+        response = self.transport.send([self.transport.put_request(url, 'BEGIN:VCALENDAR', {'If-None-Match': '*'})])[0]
+        self.assertEqual(response.status, 412)
+
+    def test_create_all_day(self):
+        event_id = self.env['calendar.event'].with_context(sync=True).create({'name': 'Holiday', 'allday': True,
+                                                                              'start': datetime(2023, 6, 15), 'stop': datetime(2023, 6, 15)})
+        url = self.create_nc_event(sync_record.OdooEvent(event_id.id, calendar_name='Personal', summary='Holiday', all_day=True,
+                                                         dtstart=date(2023, 6, 15), dtend=date(2023, 6, 16)), event_id)
+        ical = self.server.events[url[len(self.server.url):]]['data'].decode('utf-8')
+        self.assertIn('DTSTART;VALUE=DATE:20230615', ical)
+        self.assertIn('DTEND;VALUE=DATE:20230616', ical)
+
+    def test_conditional_update(self):
+        event_id = self.env['calendar.event'].with_context(sync=True).create({'name': 'Review',
+                                                                              'start': datetime(2023, 6, 15, 10),
+                                                                              'stop': datetime(2023, 6, 15, 11)})
+        item = sync_record.OdooEvent(event_id.id, calendar_name='Personal', summary='Review',
+                                     dtstart=datetime(2023, 6, 15, 10), dtend=datetime(2023, 6, 15, 11))
+        url = self.create_nc_event(item, event_id)
+        path = url[len(self.server.url):]
+        listed_etag = event_id.nc_etag
+        # Edited in a Nextcloud client after the listing
+        self.transport.send([self.transport.put_request(url, EVENT % (event_id.nc_uid, 'client'))])
+        client_data = self.server.events[path]['data']
+
+        item.summary = 'Review (Odoo)'
+        item.uid = event_id.nc_uid
+        nc_listing = {url: {'etag': listed_etag}}
+        updated_count, conflicts, failed = self.caldav_obj.update_nc_events([(url, item)], nc_listing, self.transport)
+        self.assertEqual((updated_count, conflicts, failed), (0, [(url, item)], []))
+        self.assertEqual(self.server.events[path]['data'], client_data)
+
+        # Sent again with the current ETag
+        nc_listing[url]['etag'] = self.server.events[path]['etag']
+        updated_count, conflicts, failed = self.caldav_obj.update_nc_events([(url, item)], nc_listing, self.transport)
+        self.assertEqual((updated_count, conflicts, failed), (1, [], []))
+        self.assertIn(b'SUMMARY:Review (Odoo)', self.server.events[path]['data'])
+        self.assertEqual(event_id.nc_etag, self.server.events[path]['etag'])
+
+
+class TestNcEventPull(common.TransactionCase):
+
+    def setUp(self):
+        super(TestNcEventPull, self).setUp()
+        self.server = CaldavStandIn().start()
+        self.addCleanup(self.server.stop)
+        self.calendar_url = '%s/remote.php/dav/calendars/admin/personal/' % self.server.url
+        self.transport = caldav_transport.CaldavTransport('admin', 'admin')
+        self.caldav_obj = self.env['nextcloud.caldav']
+
+    def test_iter_nc_changes(self):
+        self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.pull_chunk_size', 2)
+        calendar = SimpleNamespace(url=self.calendar_url, canonical_url=self.calendar_url, name='Personal')
+        urls = ['%sevent-%s.ics' % (self.calendar_url, i) for i in range(5)]
+        responses = self.transport.send([self.transport.put_request(url, EVENT % ('event-%s' % i, i)) for i, url in enumerate(urls)])
+        nc_listing = {url: {'etag': response.headers['ETag'], 'calendar': calendar} for url, response in zip(urls, responses)}
+        user = {'user_id': [self.env.user.id, self.env.user.name], 'user_name': 'admin'}
+
+        # Only one chunk of events is downloaded at a time
+        chunks = list(self.caldav_obj.iter_nc_changes(nc_listing, urls, user, self.transport))
+        self.assertEqual([hrefs for hrefs, nc_uids, to_sync in chunks], [urls[0:2], urls[2:4], urls[4:]])
+        self.assertEqual([nc_uids for hrefs, nc_uids, to_sync in chunks], [['event-0', 'event-1'], ['event-2', 'event-3'], ['event-4']])
+        to_create = [vals for hrefs, nc_uids, to_sync in chunks for vals in to_sync['create']]
+        self.assertEqual([x['nc_href'] for x in to_create], urls)
+        self.assertEqual(to_create[0]['nc_etag'], nc_listing[urls[0]]['etag'])
+
+        counts = self.caldav_obj.apply_odoo_changes({'create': to_create, 'write': []}, user, False)
+        self.assertEqual(counts, {'create': 5, 'write': 0, 'retag': 0, 'error': 0})
+        # A new ETag for the same content is not a change of the event
+        event_id = self.env['calendar.event'].search([('nc_href', '=', urls[0])])
+        counts = self.caldav_obj.apply_odoo_changes({'create': [], 'write': [{'id': event_id.id, 'nc_etag': '"retagged"'},
+                                                                             {'id': event_id.id, 'name': 'Renamed'}]}, user, False)
+        self.assertEqual(counts, {'create': 0, 'write': 2, 'retag': 1, 'error': 0})
+        self.caldav_obj.apply_odoo_changes({'create': [], 'write': [{'id': event_id.id, 'nc_etag': nc_listing[urls[0]]['etag']}]}, user, False)
+        # Nothing to download anymore, and nothing to delete
+        self.assertEqual(self.caldav_obj.get_odoo_event_etags(user), {url: nc_listing[url]['etag'] for url in urls})
+        self.assertEqual(self.caldav_obj.get_nc_deleted_in_odoo(nc_listing, {'event-%s' % i for i in range(5)}, user, full_sync=True), [])
+
+
+
+class TestSyncResume(common.TransactionCase):
+
+    def setUp(self):
+        super(TestSyncResume, self).setUp()
+        self.server = CaldavStandIn().start()
+        self.addCleanup(self.server.stop)
+        self.patch(self.env.cr, 'commit', lambda: None)
+        config_obj = self.env['ir.config_parameter'].sudo()
+        config_obj.set_param('nextcloud_odoo_sync.nextcloud_url', self.server.url)
+        config_obj.set_param('nextcloud_odoo_sync.pull_batch_size', 4)
+        config_obj.set_param('nextcloud_odoo_sync.pull_chunk_size', 2)
+        self.calendar_url = '%s/remote.php/dav/calendars/resume/personal/' % self.server.url
+        self.calendar = SimpleNamespace(url=self.calendar_url, canonical_url=self.calendar_url, name='Personal')
+        self.user_id = self.env['res.users'].create({'name': 'Resume', 'login': 'resume'})
+        nc_calendar_id = self.env['nc.calendar'].create({'name': 'Personal', 'user_id': self.user_id.id, 'calendar_url': self.calendar_url})
+        self.sync_user_id = self.env['nc.sync.user'].create({'user_id': self.user_id.id, 'user_name': 'resume', 'nc_calendar_id': nc_calendar_id.id})
+        self.transport = caldav_transport.CaldavTransport('resume', 'resume')
+        # A budget of 0 never runs out, the check is forced once the first chunk of events is pushed
+        self.exhausted = False
+        send = self.transport.send
+
+        def exhausting_send(request_list):
+            responses = send(request_list)
+            if any(x.method == 'PUT' for x in request_list):
+                self.exhausted = True
+            return responses
+        self.patch(self.transport, 'send', exhausting_send)
+        self.downloaded = []
+
+        # The caldav library discovery is not supported by the stand-in
+        caldav_class = type(self.env['nextcloud.caldav'])
+        get_nc_events_by_href = caldav_class.get_nc_events_by_href
+
+        def recorded_get_nc_events_by_href(obj, nc_listing, hrefs, transport):
+            self.downloaded.extend(hrefs)
+            return get_nc_events_by_href(obj, nc_listing, hrefs, transport)
+        principal = SimpleNamespace(get_vcal_address=lambda: 'mailto:resume@example.com')
+        self.patch(caldav_class, 'check_nextcloud_connection', lambda obj, **kwargs: (SimpleNamespace(), principal))
+        self.patch(caldav_class, 'get_nc_user_calendars', lambda obj, principal, uris=False: [self.calendar])
+        self.patch(caldav_class, 'get_nc_user_event_listing', lambda obj, calendars: self.get_listing())
+        self.patch(caldav_class, 'get_user_calendar', lambda obj, connection, principal, name: self.calendar)
+        self.patch(caldav_class, 'get_caldav_transport', lambda obj, user: self.transport)
+        self.patch(caldav_class, 'check_time_budget', lambda obj, start_time, budget: self.exhausted)
+        self.patch(caldav_class, 'get_nc_events_by_href', recorded_get_nc_events_by_href)
+        self.patch(type(self.env['nextcloud.base']), 'get_users', lambda obj, *args, **kwargs: {
+            'ocs': {'data': {'users': [{'id': 'resume', 'email': 'resume@example.com'}]}}})
+
+    def get_listing(self):
+        path = self.calendar_url[len(self.server.url):]
+        return {self.server.url + x: {'etag': event['etag'], 'calendar': self.calendar}
+                for x, event in self.server.events.items() if x.startswith(path)}
+
+    def test_resume_push(self):
+        nc_urls = ['%snc-event-%s.ics' % (self.calendar_url, i) for i in range(6)]
+        self.transport.send([self.transport.put_request(url, EVENT % ('nc-event-%s' % i, i)) for i, url in enumerate(nc_urls)])
+        self.server.changes.clear()
+        event_ids = self.env['calendar.event'].create([{
+            'name': 'Odoo event %s' % i, 'user_id': self.user_id.id, 'partner_ids': [(6, 0, self.user_id.partner_id.ids)],
+            'nc_calendar_ids': [(6, 0, self.sync_user_id.nc_calendar_id.ids)],
+            'start': datetime(2023, 6, 15, 10) + timedelta(hours=i), 'stop': datetime(2023, 6, 15, 11) + timedelta(hours=i)} for i in range(60)])
+        caldav_obj = self.env['nextcloud.caldav']
+
+        # First run: a batch of the NextCloud events is pulled, then the push stops after the first chunk of creations
+        caldav_obj.run_sync(sync_user_ids=[self.sync_user_id.id])
+        self.assertEqual(self.sync_user_id.sync_checkpoint, 'push')
+        self.assertEqual(self.sync_user_id.sync_pull_cursor, sorted(nc_urls)[3])
+        self.assertEqual(self.downloaded, sorted(nc_urls)[:4])
+        self.assertEqual(len(self.server.changes), nextcloud_caldav.CREATE_CHUNK_SIZE)
+        self.assertEqual(len(event_ids.filtered('nc_href')), nextcloud_caldav.CREATE_CHUNK_SIZE)
+
+        # Second run: resumes after the cursor and pushes the remaining events only
+        self.exhausted = False
+        caldav_obj.run_sync(sync_user_ids=[self.sync_user_id.id])
+        self.assertFalse(self.sync_user_id.sync_checkpoint)
+        self.assertFalse(self.sync_user_id.sync_pull_cursor)
+        self.assertEqual(sorted(self.downloaded), sorted(nc_urls))
+        self.assertEqual(len(self.server.changes), len(event_ids))
+        self.assertEqual(len(set(self.server.changes)), len(event_ids))
+        self.assertTrue(all(event_ids.mapped('nc_synced')))
+        self.assertEqual(len(self.server.events), len(nc_urls) + len(event_ids))
+        self.assertEqual({x[len(self.server.url):] for x in event_ids.mapped('nc_href')}, set(self.server.changes))
+        pulled_ids = self.env['calendar.event'].search([('user_id', '=', self.user_id.id), ('nc_uid', 'like', 'nc-event-')])
+        self.assertEqual(sorted(pulled_ids.mapped('nc_href')), sorted(nc_urls))
+        self.assertFalse(self.env['nc.sync.journal'].search([('res_id', 'in', event_ids.ids)]))
+
+
+@tagged('-standard', 'nc_benchmark')
+class BenchmarkCaldavTransport(common.TransactionCase):
+
+    def test_benchmark_concurrency(self):
+        number = 200
+        server = CaldavStandIn(latency=0.02).start()
+        self.addCleanup(server.stop)
+        calendar_url = '%s/remote.php/dav/calendars/admin/personal/' % server.url
+        throughputs = {}
+        for concurrency in (1, 4, 16, 32):
+            transport = caldav_transport.CaldavTransport('admin', 'admin', max_in_flight=concurrency)
+            request_list = [transport.put_request('%s%s-%s.ics' % (calendar_url, concurrency, i), EVENT % (i, i)) for i in range(number)]
+            start = time.perf_counter()
+            responses = transport.send(request_list)
+            elapsed = time.perf_counter() - start
+            self.assertTrue(all(x.ok for x in responses))
+            throughputs[concurrency] = number / elapsed
+            _logger.info('CalDAV PUT with %s request(s) in flight: %.1f requests/s (%s, no rate limit)',
+                         concurrency, throughputs[concurrency], 'httpx' if transport.use_httpx else 'requests')
+        self.assertGreater(throughputs[16], throughputs[1] * 2)
+
+    def test_benchmark_default_rate_limits(self):
+        # Production settings: serial caldav calls held to push_rate_limit, concurrent transport to its own limit
+        number = 100
+        server = CaldavStandIn(latency=0.02).start()
+        self.addCleanup(server.stop)
+        calendar_url = '%s/remote.php/dav/calendars/admin/personal/' % server.url
+        throughputs = {}
+        for name, concurrency, rate in (('serial', 1, 10), ('concurrent', 8, caldav_transport.DEFAULT_RATE_LIMIT)):
+            transport = caldav_transport.CaldavTransport('admin', 'admin', max_in_flight=concurrency, rate_limiter=throttle.RateLimiter(rate))
+            request_list = [transport.put_request('%s%s-%s.ics' % (calendar_url, name, i), EVENT % (i, i)) for i in range(number)]
+            start = time.perf_counter()
+            responses = transport.send(request_list)
+            elapsed = time.perf_counter() - start
+            self.assertTrue(all(x.ok for x in responses))
+            throughputs[name] = number / elapsed
+            _logger.info('CalDAV PUT %s with %s request(s) in flight and %s requests/s allowed: %.1f requests/s',
+                         name, concurrency, rate, throughputs[name])
+        self.assertGreater(throughputs['concurrent'], throughputs['serial'] * 3)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from datetime import datetime, timedelta
+
+from odoo.exceptions import ValidationError
+from odoo.tests import common
+
+
+class TestCalendarEventCompute(common.TransactionCase):
+
+    def setUp(self):
+        super(TestCalendarEventCompute, self).setUp()
+        self.nc_calendar_id = self.env['nc.calendar'].create({'name': 'Personal'})
+        start = datetime(2023, 6, 1, 8)
+        self.event_ids = self.env['calendar.event'].with_context(sync=True).create([{
+            'name': 'Event %s' % i,
+            'start': start + timedelta(hours=i),
+            'stop': start + timedelta(hours=i, minutes=30),
+            'nc_calendar_ids': [(6, 0, self.nc_calendar_id.ids)],
+        } for i in range(60)])
+        # Let the first compute link the calendar of the user
+        self.event_ids.mapped('nc_calendar_id')
+
+    def get_query_count(self, event_ids):
+        event_ids.invalidate_cache()
+        query_count = self.env.cr.sql_log_count
+        event_ids.mapped('nc_calendar_id')
+        event_ids.mapped('nc_require_calendar')
+        return self.env.cr.sql_log_count - query_count
+
+    def test_compute_nc_calendar(self):
+        self.assertEqual(self.event_ids.mapped('nc_calendar_id'), self.nc_calendar_id)
+        self.assertTrue(all(self.event_ids.mapped('nc_require_calendar')))
+
+    def test_compute_query_count(self):
+        # A month view costs the same number of queries as a day view
+        self.assertEqual(self.get_query_count(self.event_ids[:3]), self.get_query_count(self.event_ids))
+
+    def test_check_duplicate(self):
+        vals = {'name': 'Event 0', 'start': self.event_ids[0].start, 'stop': self.event_ids[0].stop}
+        with self.assertRaises(ValidationError):
+            self.env['calendar.event'].create(vals)
+        # Events coming from Nextcloud are identified by their UID
+        self.env['calendar.event'].with_context(sync=True).create(dict(vals, nc_uid='duplicate'))
+
+
+class TestDefaultCalendar(common.TransactionCase):
+
+    def setUp(self):
+        super(TestDefaultCalendar, self).setUp()
+        self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.calendar_assign_chunk_size', 2)
+        # Chunks are committed by the cron
+        self.commit_count = 0
+        self.patch(self.env.cr, 'commit', self.count_commit)
+        self.user_id = self.env['res.users'].create({'name': 'Default Calendar', 'login': 'default_calendar'})
+        self.sync_user_id = self.env['nc.sync.user'].create({'user_id': self.user_id.id, 'user_name': 'default_calendar'})
+        start = datetime(2023, 6, 1, 8)
+        self.event_ids = self.env['calendar.event'].with_context(sync=True).create([{
+            'name': 'Event %s' % i, 'user_id': self.user_id.id, 'start': start + timedelta(hours=i),
+            'stop': start + timedelta(hours=i, minutes=30)} for i in range(5)])
+
+    def count_commit(self):
+        self.commit_count += 1
+
+    def test_assign_default_calendar(self):
+        self.event_ids.with_context(sync=True).write({'nc_synced': True})
+        nc_calendar_id = self.env['nc.calendar'].with_context(sync=True).create({'name': 'Personal', 'user_id': self.user_id.id})
+        self.sync_user_id.nc_calendar_id = nc_calendar_id
+        # Linked in the background
+        self.assertTrue(self.sync_user_id.calendar_assign_pending)
+        self.assertFalse(self.event_ids.nc_calendar_ids)
+        self.sync_user_id.assign_default_calendars()
+        self.assertFalse(self.sync_user_id.calendar_assign_pending)
+        self.assertTrue(all(x.nc_calendar_ids == nc_calendar_id for x in self.event_ids))
+        # Three chunks of 2 events, then the pending flag
+        self.assertEqual(self.commit_count, 4)
+
+        # Journaled like a change made in Odoo, to be pushed at the next sync
+        self.assertFalse(any(self.event_ids.mapped('nc_synced')))
+        entry_ids = self.env['nc.sync.journal'].search([('res_id', 'in', self.event_ids.ids)])
+        self.assertEqual(entry_ids.event_id, self.event_ids)
+        self.assertEqual(set(entry_ids.mapped('changed_fields')), {'nc_calendar_ids'})
+        events, changed_fields, deleted = entry_ids.get_pending_changes()
+        self.assertEqual(events, self.event_ids)
+        self.assertEqual(changed_fields[self.event_ids[0].id], {'nc_calendar_ids'})
+
+    def test_create_with_default_calendar(self):
+        # Linking the default calendar is part of the creation, it is not journaled as a change of its own
+        nc_calendar_id = self.env['nc.calendar'].with_context(sync=True).create({'name': 'Personal', 'user_id': self.env.user.id})
+        self.env['nc.sync.user'].create({'user_id': self.env.user.id, 'user_name': 'default_calendar_admin', 'nc_calendar_id': nc_calendar_id.id})
+        event_id = self.env['calendar.event'].create({'name': 'New', 'user_id': self.env.user.id,
+                                                      'start': datetime(2023, 6, 2, 8), 'stop': datetime(2023, 6, 2, 9)})
+        self.assertEqual(event_id.nc_calendar_ids, nc_calendar_id)
+        self.assertEqual(self.env['nc.sync.journal'].search([('res_id', '=', event_id.id)]).mapped('operation'), ['create'])
+
+    def test_assign_calendar_of_another_user(self):
+        # The inserted rows do not make the events leave the candidates through the calendar owner
+        nc_calendar_id = self.env['nc.calendar'].create({'name': 'Shared'})
+        self.assertNotEqual(nc_calendar_id.user_id, self.user_id)
+        self.event_ids[:2].with_context(sync=True).write({'nc_calendar_ids': [(4, nc_calendar_id.id)]})
+        self.sync_user_id.set_default_calendar(nc_calendar_id.id)
+        self.assertTrue(all(x.nc_calendar_ids == nc_calendar_id for x in self.event_ids))
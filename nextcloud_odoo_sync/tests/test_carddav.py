@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from odoo.tests import common
+from odoo.addons.nextcloud_odoo_sync.models import caldav_transport, sync_record
+from odoo.addons.nextcloud_odoo_sync.tests.caldav_server import CaldavStandIn
+
+VCARD = """BEGIN:VCARD\r
+VERSION:3.0\r
+UID:%s\r
+FN:%s\r
+item1.EMAIL;TYPE=WORK:%s\r
+TEL;TYPE=CELL:+1 555 0100\r
+ORG:Acme\\, Inc.;Sales\r
+END:VCARD\r
+"""
+
+
+class TestCarddav(common.TransactionCase):
+
+    def setUp(self):
+        super(TestCarddav, self).setUp()
+        self.server = CaldavStandIn().start()
+        self.addCleanup(self.server.stop)
+        self.addressbook_url = '%s/remote.php/dav/addressbooks/users/admin/contacts/' % self.server.url
+        self.transport = caldav_transport.CaldavTransport('admin', 'admin')
+        self.carddav_obj = self.env['nextcloud.carddav']
+        # Chunks are committed during the sync
+        self.patch(self.env.cr, 'commit', lambda: None)
+        self.addressbook_id = self.env['nc.addressbook'].create({'name': 'Contacts', 'user_id': self.env.user.id,
+                                                                'addressbook_url': self.addressbook_url})
+
+    def put_vcard(self, number, name=False):
+        url = '%scard-%s.vcf' % (self.addressbook_url, number)
+        self.transport.send([self.transport.put_request(url, VCARD % ('card-%s' % number, name or 'Contact %s' % number,
+                                                                      'contact%s@example.com' % number))])
+        return url
+
+    def test_nc_contact(self):
+        nc_contact = sync_record.NcContact('card-1.vcf', '"etag"', VCARD % ('card-1', 'Jane Doe', 'mailto:Jane@Example.com'))
+        self.assertEqual(nc_contact.get_partner_values(), {'name': 'Jane Doe', 'email': 'Jane@Example.com', 'phone': False,
+                                                           'mobile': '+1 555 0100', 'company_name': 'Acme, Inc.', 'function': False})
+        self.assertEqual(set(nc_contact.get_partner_values(complete=False)), {'name', 'email', 'mobile', 'company_name'})
+
+    def test_incremental_sync(self):
+        urls = [self.put_vcard(i) for i in range(3)]
+        existing_id = self.env['res.partner'].create({'name': 'Existing', 'email': 'Contact1@example.com', 'phone': '+1 555 0199'})
+
+        # First sync: every vCard is downloaded, the partner with the same email is linked
+        counts = self.carddav_obj.sync_addressbook(self.addressbook_id, self.transport)
+        self.assertEqual(counts, {'create': 2, 'write': 1, 'delete': 0})
+        self.assertEqual(existing_id.nc_card_uid, 'card-1')
+        self.assertEqual(existing_id.phone, '+1 555 0199')
+        self.assertEqual(len(self.addressbook_id.partner_ids), 3)
+        self.assertTrue(self.addressbook_id.sync_token)
+
+        # Only the changes since the token are listed and downloaded
+        self.server.reports.clear()
+        self.put_vcard(2, 'Renamed')
+        self.transport.send([self.transport.delete_request(urls[0])])
+        counts = self.carddav_obj.sync_addressbook(self.addressbook_id, self.transport)
+        self.assertEqual(counts, {'create': 0, 'write': 1, 'delete': 1})
+        self.assertEqual(len(self.server.reports), 2)
+        self.assertEqual(self.addressbook_id.partner_ids.filtered(lambda x: x.nc_card_uid == 'card-2').name, 'Renamed')
+        self.assertEqual(self.addressbook_id.partner_ids.mapped('nc_card_uid'), ['card-1', 'card-2'])
+
+        # Nothing changed: nothing is downloaded
+        self.server.reports.clear()
+        counts = self.carddav_obj.sync_addressbook(self.addressbook_id, self.transport)
+        self.assertEqual(counts, {'create': 0, 'write': 0, 'delete': 0})
+        self.assertEqual(len(self.server.reports), 1)
+
+    def test_expired_sync_token(self):
+        url = self.put_vcard(0)
+        self.carddav_obj.sync_addressbook(self.addressbook_id, self.transport)
+        partner_id = self.addressbook_id.partner_ids
+        # Token unknown to the server, which also lost a vCard: the full listing replaces the change list
+        self.addressbook_id.sync_token = 'http://sabre.io/ns/sync/999'
+        del self.server.events[url[len(self.server.url):]]
+        self.put_vcard(1)
+        counts = self.carddav_obj.sync_addressbook(self.addressbook_id, self.transport)
+        self.assertEqual(counts, {'create': 1, 'write': 0, 'delete': 1})
+        self.assertFalse(partner_id.nc_addressbook_id)
+        self.assertTrue(partner_id.exists())
+
+    def test_partner_matching(self):
+        other_addressbook_url = '%s/remote.php/dav/addressbooks/users/admin/work/' % self.server.url
+        other_addressbook_id = self.env['nc.addressbook'].create({'name': 'Work', 'user_id': self.env.user.id,
+                                                                  'addressbook_url': other_addressbook_url})
+        linked_id = self.env['res.partner'].create({'name': 'Linked', 'email': 'contact1@example.com', 'nc_card_uid': 'other-card'})
+        self.put_vcard(1)
+        self.transport.send([self.transport.put_request('%scard-1.vcf' % other_addressbook_url,
+                                                        VCARD % ('card-1', 'Contact 1', 'contact1@example.com'))])
+
+        # The partner of another vCard with the same email is not taken over
+        self.carddav_obj.sync_addressbook(self.addressbook_id, self.transport)
+        self.assertEqual(linked_id.nc_card_uid, 'other-card')
+        self.assertEqual(linked_id.name, 'Linked')
+        # The same UID in another address book is another partner
+        counts = self.carddav_obj.sync_addressbook(other_addressbook_id, self.transport)
+        self.assertEqual(counts, {'create': 1, 'write': 0, 'delete': 0})
+        self.assertEqual(len(self.addressbook_id.partner_ids), 1)
+        self.assertEqual(len(other_addressbook_id.partner_ids), 1)
+        self.assertNotEqual(self.addressbook_id.partner_ids, other_addressbook_id.partner_ids)
+
+    def test_partner_matching_by_email(self):
+        user_id = self.env['res.users'].create({'name': 'User', 'login': 'contact1', 'email': 'contact1@example.com'})
+        company_id = self.env['res.partner'].create({'name': 'Company', 'email': 'contact2@example.com', 'is_company': True})
+        contact_id = self.env['res.partner'].create({'name': 'Old Name', 'email': 'Contact3@Example.com'})
+        for number in (1, 2, 3):
+            self.put_vcard(number)
+        counts = self.carddav_obj.sync_addressbook(self.addressbook_id, self.transport)
+        self.assertEqual(counts, {'create': 2, 'write': 1, 'delete': 0})
+        # Users and companies are left as they are, a new partner is created for their vCard
+        self.assertEqual((user_id.partner_id.name, user_id.partner_id.nc_card_uid), ('User', False))
+        self.assertEqual((company_id.name, company_id.nc_card_uid), ('Company', False))
+        self.assertEqual((contact_id.name, contact_id.nc_card_uid), ('Contact 3', 'card-3'))
+        self.assertEqual(len(self.addressbook_id.partner_ids), 3)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from bs4 import BeautifulSoup
+
+from odoo.tests import common
+from odoo.addons.nextcloud_odoo_sync.models import html_text
+
+SAMPLES = [
+    'Plain text',
+    # Entities
+    'Fish &amp; chips &lt;3 &eacute;t&eacute; &#8364;5 &#x42;&nbsp;end &AMP;',
+    '<p>Stray &unknown; entity, &copy2023, AT&T & R&D;</p>',
+    # Line breaks
+    '<p>Line 1<br>Line 2<br/>Line 3<br /></p>',
+    '<p>First</p>\n<p>Second</p>',
+    # Nested tags
+    '<div><p>Agenda</p><ul><li><b>Budget</b> review</li><li>Q&amp;A</li></ul></div>',
+    '<a href="https://example.com/?a=1&amp;b=2" title="x > y">link</a> <o:p>word</o:p>',
+    # Malformed markup
+    '<p>Unclosed <b>bold <i>italic</p> tail',
+    'a < b and c > d, x <3 y',
+    '<p>Cut<',
+    '<a\'<p>x</p>',
+    '<a "<img src="a>b"/>',
+    '</bc<img src="a>b"/>',
+    # Whitespace-only text nodes and carriage returns
+    '<p>a</p>  <p>b</p>',
+    '<p>a</p> \n <p>b</p>\x0c<p>c</p>\t<p>d</p>',
+    '<p>\r\n</p>',
+    'Line 1\r\nLine 2<br>\r',
+    ' \n ',
+    # Markup handled by BeautifulSoup only
+    '<p>Text</p><!-- comment --><p>More</p>',
+    '<p>Before</p><script>var x = "<p>";</script><p>After</p>',
+]
+
+
+class TestHtmlText(common.TransactionCase):
+
+    def setUp(self):
+        super(TestHtmlText, self).setUp()
+        html_text._cache.clear()
+        self.addCleanup(html_text._cache.clear)
+
+    def test_same_as_beautifulsoup(self):
+        for value in SAMPLES:
+            self.assertEqual(html_text.html_to_text(value), BeautifulSoup(value, 'html.parser').get_text('\n'), value)
+        self.assertEqual(html_text.html_to_text(False), '')
+
+    def test_regex_path(self):
+        # Simple descriptions are not parsed by BeautifulSoup
+        calls = []
+        self.patch(html_text, 'BeautifulSoup', lambda *args: calls.append(args))
+        self.assertEqual(html_text.html_to_text('<p>Budget<br>Q&amp;A</p>'), 'Budget\nQ&A')
+        self.assertEqual(calls, [])
+
+    def test_cache_eviction(self):
+        cache = html_text.BoundedCache(10)
+        cache.set('a', 'aaaa')
+        cache.set('b', 'bbbb')
+        # Least recently used first
+        self.assertEqual(cache.get('a'), 'aaaa')
+        cache.set('c', 'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), ('aaaa', 'cccc'))
+        self.assertEqual(cache.size, 8)
+        # Values larger than the cache are not cached
+        cache.set('d', 'd' * 11)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.size, 8)
+        cache.clear()
+        self.assertEqual((cache.size, cache.get('a')), (0, None))
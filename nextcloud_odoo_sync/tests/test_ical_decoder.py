@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import logging
+import timeit
+from datetime import date, datetime
+
+import pytz
+from dateutil.parser import parse
+
+from odoo.tests import common, tagged
+from odoo.addons.nextcloud_odoo_sync.models import ical_decoder
+
+_logger = logging.getLogger(__name__)
+
+VTIMEZONE_EVENT = """BEGIN:VCALENDAR
+VERSION:2.0
+BEGIN:VTIMEZONE
+TZID:W. Europe Standard Time
+BEGIN:STANDARD
+DTSTART:16011028T030000
+RRULE:FREQ=YEARLY;BYDAY=-1SU;BYMONTH=10
+TZOFFSETFROM:+0200
+TZOFFSETTO:+0100
+END:STANDARD
+BEGIN:DAYLIGHT
+DTSTART:16010325T020000
+RRULE:FREQ=YEARLY;BYDAY=-1SU;BYMONTH=3
+TZOFFSETFROM:+0100
+TZOFFSETTO:+0200
+END:DAYLIGHT
+END:VTIMEZONE
+BEGIN:VEVENT
+UID:vtimezone-event
+DTSTART;TZID=W. Europe Standard Time:20230615T100000
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+class TestIcalDecoder(common.TransactionCase):
+
+    def test_split_property(self):
+        self.assertEqual(ical_decoder.split_property('SUMMARY'), ('summary', {}))
+        self.assertEqual(ical_decoder.split_property('DTSTART;TZID=Europe/Berlin;VALUE=DATE-TIME'),
+                         ('dtstart', {'TZID': 'Europe/Berlin', 'VALUE': 'DATE-TIME'}))
+
+    def test_decode_date(self):
+        self.assertEqual(ical_decoder.decode_date('20230615', {'VALUE': 'DATE'}), date(2023, 6, 15))
+        self.assertEqual(ical_decoder.decode_date('20230615T100000Z', {}), datetime(2023, 6, 15, 10))
+        self.assertEqual(ical_decoder.decode_date('20230615T100000', {'TZID': 'Europe/Berlin'}), datetime(2023, 6, 15, 8))
+        self.assertEqual(ical_decoder.decode_date('20230615T100000', {}), datetime(2023, 6, 15, 10))
+
+    def test_decode_vtimezone(self):
+        params = {'TZID': 'W. Europe Standard Time'}
+        self.assertEqual(ical_decoder.decode_date('20230615T100000', params, VTIMEZONE_EVENT), datetime(2023, 6, 15, 8))
+
+    def test_decode_text_property(self):
+        # Text properties are never handed to the date parser
+        self.assertEqual(ical_decoder.decode_property('summary', {}, '20230615'), '20230615')
+
+
+@tagged('-standard', 'nc_benchmark')
+class BenchmarkIcalDecoder(common.TransactionCase):
+
+    def test_benchmark_decode_date(self):
+        values = [('DTSTART;TZID=Europe/Berlin', '20230615T100000'),
+                  ('SUMMARY', 'Weekly meeting'),
+                  ('DESCRIPTION', 'Discuss the roadmap'),
+                  ('DTEND;VALUE=DATE', '20230616')]
+        number = 20000
+
+        def legacy():
+            for key, value in values:
+                field_name = key.lower().split(';')
+                try:
+                    data = parse(value)
+                    tz = field_name[-1].split('=')[-1]
+                    if tz != 'date':
+                        pytz.timezone(tz).localize(data, is_dst=None).astimezone(pytz.utc)
+                except Exception:
+                    pass
+
+        def decoder():
+            for key, value in values:
+                name, params = ical_decoder.split_property(key)
+                try:
+                    ical_decoder.decode_property(name, params, value)
+                except Exception:
+                    pass
+
+        legacy_time = timeit.timeit(legacy, number=number)
+        decoder_time = timeit.timeit(decoder, number=number)
+        _logger.info('iCalendar decoding of %s events: dateutil %.3fs, ical_decoder %.3fs (x%.1f)',
+                     number, legacy_time, decoder_time, legacy_time / decoder_time)
+        self.assertLess(decoder_time, legacy_time)
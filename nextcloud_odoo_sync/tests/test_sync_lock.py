@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from odoo import api
+from odoo.tests import common
+from odoo.addons.nextcloud_odoo_sync.models.nextcloud_caldav import SHARD_CRON_XMLID, SYNC_RUN_LOCK, SYNC_USER_LOCK
+
+
+class TestSyncLock(common.TransactionCase):
+
+    def test_sync_locks(self):
+        caldav_obj = self.env['nextcloud.caldav']
+        self.assertTrue(caldav_obj.acquire_sync_lock(SYNC_RUN_LOCK))
+        self.assertTrue(caldav_obj.acquire_sync_lock(SYNC_USER_LOCK, 1))
+        try:
+            with self.registry.cursor() as cr:
+                other_caldav_obj = api.Environment(cr, self.env.uid, {})['nextcloud.caldav']
+                # A second run and a second claim of the same user are refused
+                self.assertFalse(other_caldav_obj.sync_cron())
+                self.assertFalse(other_caldav_obj.acquire_sync_lock(SYNC_USER_LOCK, 1))
+                # Other users can still be claimed
+                self.assertTrue(other_caldav_obj.acquire_sync_lock(SYNC_USER_LOCK, 2))
+                other_caldav_obj.release_sync_locks()
+        finally:
+            caldav_obj.release_sync_locks()
+        self.env.cr.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+        self.assertEqual(self.env.cr.fetchone()[0], 0)
+
+    def test_run_lock_shards(self):
+        caldav_obj = self.env['nextcloud.caldav']
+        self.assertTrue(caldav_obj.acquire_run_lock(shard=0))
+        try:
+            with self.registry.cursor() as cr:
+                other_caldav_obj = api.Environment(cr, self.env.uid, {})['nextcloud.caldav']
+                # The sync wizard and the cron without shards are refused while a shard runs
+                self.assertFalse(other_caldav_obj.acquire_run_lock())
+                self.assertFalse(other_caldav_obj.acquire_run_lock(shard=0))
+                # Other shards run alongside
+                self.assertTrue(other_caldav_obj.acquire_run_lock(shard=1))
+                other_caldav_obj.release_sync_locks()
+            caldav_obj.release_sync_locks()
+            self.assertTrue(caldav_obj.acquire_run_lock())
+            with self.registry.cursor() as cr:
+                other_caldav_obj = api.Environment(cr, self.env.uid, {})['nextcloud.caldav']
+                # No shard runs alongside a run over all the users
+                self.assertFalse(other_caldav_obj.acquire_run_lock(shard=1))
+                self.assertFalse(other_caldav_obj.acquire_run_lock())
+                other_caldav_obj.release_sync_locks()
+        finally:
+            caldav_obj.release_sync_locks()
+        self.env.cr.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+        self.assertEqual(self.env.cr.fetchone()[0], 0)
+
+    def test_sync_shards(self):
+        caldav_obj = self.env['nextcloud.caldav']
+        config_obj = self.env['ir.config_parameter'].sudo()
+        user_ids = self.env['res.users'].create([{'name': 'Shard %s' % i, 'login': 'shard%s' % i} for i in range(7)])
+        sync_user_ids = self.env['nc.sync.user'].create([{'user_id': x.id, 'user_name': x.login} for x in user_ids])
+
+        config_obj.set_param('nextcloud_odoo_sync.sync_shard_count', 3)
+        caldav_obj.update_sync_shard_crons()
+        cron_ids = [caldav_obj.get_sync_cron(shard) for shard in range(3)]
+        self.assertEqual([x.code for x in cron_ids], ['model.sync_cron(shard=%s)' % shard for shard in range(3)])
+        self.assertEqual(len(set(cron_ids)), 3)
+        # The shards split the users without overlap
+        shard_user_ids = [caldav_obj.get_shard_user_ids(shard, 3) for shard in range(3)]
+        self.assertEqual(sorted(sum(shard_user_ids, [])), sorted(set(sum(shard_user_ids, []))))
+        self.assertTrue(set(sync_user_ids.ids) <= set(sum(shard_user_ids, [])))
+
+        # Fewer shards: the extra crons are removed and do nothing if they were already running
+        config_obj.set_param('nextcloud_odoo_sync.sync_shard_count', 1)
+        caldav_obj.update_sync_shard_crons()
+        self.assertFalse(cron_ids[2].exists())
+        self.assertFalse(self.env['ir.model.data'].search([('module', '=', 'nextcloud_odoo_sync'), ('name', '=like', SHARD_CRON_XMLID + '%')]))
+        self.assertEqual(caldav_obj.get_sync_cron().code, 'model.sync_cron()')
+        self.assertFalse(caldav_obj.sync_cron(shard=2))
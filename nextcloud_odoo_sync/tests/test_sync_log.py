@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from datetime import datetime, timedelta
+
+from odoo.tests import common
+
+
+class TestSyncLog(common.TransactionCase):
+
+    def test_cleanup_interrupted(self):
+        log_obj = self.env['nc.sync.log']
+        self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.log_cleanup_batch_size', 2)
+        log_ids = log_obj.create([{'name': 'Old %s' % i, 'duration_seconds': 10,
+                                   'line_ids': [(0, 0, {'severity': 'error'}), (0, 0, {'severity': 'info'})]} for i in range(3)])
+        log_obj.flush()
+        self.env.cr.execute('UPDATE nc_sync_log SET create_date = %s WHERE id IN %s', (datetime.now() - timedelta(days=60), tuple(log_ids.ids)))
+        commits = []
+
+        def interrupted_commit():
+            # The worker is killed after the first batch of lines
+            commits.append(True)
+            if len(commits) == 2:
+                raise KeyboardInterrupt()
+        self.patch(self.env.cr, 'commit', interrupted_commit)
+        with self.assertRaises(KeyboardInterrupt):
+            log_obj.cleanup_logs()
+        self.assertTrue(log_ids.exists())
+
+        # The next run deletes the logs without counting them again
+        self.patch(self.env.cr, 'commit', lambda: None)
+        log_obj.cleanup_logs()
+        self.assertFalse(log_ids.exists())
+        rollup_id = self.env['nc.sync.log.rollup'].search([])
+        self.assertEqual(rollup_id.mapped('run_count'), [3])
+        self.assertEqual(rollup_id.error_count, 3)
+        self.assertEqual(rollup_id.duration_total, 30)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import logging
+import tracemalloc
+from datetime import datetime, timedelta
+
+from psycopg2 import IntegrityError
+
+from odoo.tests import common, tagged
+from odoo.tools import mute_logger
+from odoo.addons.nextcloud_odoo_sync.models import sync_record
+
+_logger = logging.getLogger(__name__)
+
+EVENT = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:event-%s\r
+DTSTAMP:20230615T080000Z\r
+DTSTART:20230615T100000Z\r
+DTEND:20230615T110000Z\r
+SUMMARY:Weekly review %s\r
+ATTENDEE;CN="Doe: Jane";PARTSTAT=ACCEPTED:mailto:jane@exa\r
+ mple.com\r
+ATTENDEE;CN=John:mailto:john@example.com\r
+BEGIN:VALARM\r
+ACTION:EMAIL\r
+ATTENDEE:mailto:alarm@example.com\r
+TRIGGER:-PT15M\r
+END:VALARM\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+def get_memory(factory, number):
+    tracemalloc.start()
+    try:
+        items = [factory(i) for i in range(number)]
+        return tracemalloc.get_traced_memory()[0], items
+    finally:
+        tracemalloc.stop()
+
+
+class TestSyncRecord(common.TransactionCase):
+
+    def test_get_vevent_values(self):
+        self.assertEqual(sync_record.get_vevent_values(EVENT % (1, 1), 'ATTENDEE'),
+                         ['mailto:jane@example.com', 'mailto:john@example.com'])
+        self.assertEqual(sync_record.get_vevent_values(EVENT % (1, 1), 'summary'), ['Weekly review 1'])
+        self.assertEqual(sync_record.get_vevent_values(EVENT % (1, 1), 'LOCATION'), [])
+
+    def test_nc_event(self):
+        nc_event = sync_record.NcEvent('https://cloud.example.com/event-1.ics', '"etag"', EVENT % (1, 1), False)
+        self.assertEqual(nc_event.uid, 'event-1')
+        self.assertFalse(hasattr(nc_event, '__dict__'))
+
+    def test_odoo_event(self):
+        now = datetime(2023, 6, 15, 10)
+        odoo_event = sync_record.OdooEvent(1, uid='event-1', calendar_name='Personal', summary='Review', dtstart=now, dtend=now)
+        self.assertEqual(odoo_event.get_values({'summary', 'attendee'}), {'summary': 'Review', 'attendee': ()})
+        self.assertEqual(set(odoo_event.get_values()), set(sync_record.OdooEvent.PROPERTIES))
+
+    def test_odoo_events_by_uid(self):
+        # An event shared with two users only matches the Odoo event of the synced user
+        user_ids = self.env['res.users'].create([{'name': 'Shared %s' % i, 'login': 'shared_%s' % i} for i in range(2)])
+        event_ids = self.env['calendar.event'].with_context(sync=True).create([{
+            'name': 'Shared', 'user_id': user.id, 'nc_uid': 'event-shared',
+            'start': datetime(2023, 6, 15, 10), 'stop': datetime(2023, 6, 15, 11)} for user in user_ids])
+        result = self.env['nextcloud.caldav'].get_odoo_events_by_uid(['event-shared', 'event-other'], user_ids[1].id)
+        self.assertEqual(result, {'event-shared': event_ids[1]})
+
+    def test_odoo_events_by_uid_index(self):
+        event_obj = self.env['calendar.event']
+        user_id = self.env['res.users'].create({'name': 'Indexed', 'login': 'indexed'})
+        event_ids = event_obj.with_context(sync=True).create([{
+            'name': 'Indexed %s' % i, 'user_id': user_id.id, 'nc_uid': 'event-indexed-%s' % i,
+            'start': datetime(2023, 6, 15, 10 + i), 'stop': datetime(2023, 6, 15, 11 + i)} for i in range(3)])
+        # One search per chunk of 1000 UIDs
+        domains = []
+        search = type(event_obj).search
+
+        def counted_search(model, domain, *args, **kwargs):
+            domains.append(domain)
+            return search(model, domain, *args, **kwargs)
+        self.patch(type(event_obj), 'search', counted_search)
+        nc_uids = ['event-indexed-%s' % i for i in range(2500)]
+        result = self.env['nextcloud.caldav'].get_odoo_events_by_uid(nc_uids + [False], user_id.id)
+        self.assertEqual(result, {x.nc_uid: x for x in event_ids})
+        self.assertEqual(len(domains), 3)
+
+        # Answered by an index on the UID rather than a scan of the events
+        query = event_obj._where_calc([('nc_uid', 'in', nc_uids[:1000]), ('user_id', '=', user_id.id)])
+        query_str, params = query.select()
+        self.env.cr.execute('SET LOCAL enable_seqscan = off')
+        self.env.cr.execute('EXPLAIN ' + query_str, params)
+        plan = '\n'.join(x[0] for x in self.env.cr.fetchall())
+        self.env.cr.execute('SET LOCAL enable_seqscan = on')
+        self.assertIn('calendar_event_nc_uid', plan)
+
+        # Linked once per user
+        with self.assertRaises(IntegrityError), mute_logger('odoo.sql_db'), self.env.cr.savepoint():
+            event_obj.with_context(sync=True).create({'name': 'Duplicate', 'user_id': user_id.id, 'nc_uid': 'event-indexed-0',
+                                                      'start': datetime(2023, 6, 16, 10), 'stop': datetime(2023, 6, 16, 11)})
+
+
+@tagged('-standard', 'nc_benchmark')
+class BenchmarkSyncRecord(common.TransactionCase):
+
+    def test_benchmark_memory(self):
+        number = 100000
+        now = datetime(2023, 6, 15, 10)
+
+        # Staged Odoo events: free-form dictionaries against slotted records
+        dict_size, items = get_memory(lambda i: {
+            'odoo_id': i, 'uid': 'event-%s' % i, 'nc_calendar_ids': 'Personal', 'last-modified': now, 'summary': 'Weekly review',
+            'dtstart': now, 'dtend': now + timedelta(hours=1), 'status': 'CONFIRMED', 'transp': 'OPAQUE', 'valarm': ['-PT15M']}, number)
+        del items
+        record_size, items = get_memory(lambda i: sync_record.OdooEvent(
+            i, uid='event-%s' % i, calendar_name='Personal', last_modified=now, summary='Weekly review', dtstart=now,
+            dtend=now + timedelta(hours=1), status='CONFIRMED', transp='OPAQUE', valarm=['-PT15M']), number)
+        del items
+        _logger.info('%s staged Odoo events: %.1f MB as dictionaries, %.1f MB as records',
+                     number, dict_size / 1024 ** 2, record_size / 1024 ** 2)
+        self.assertLess(record_size, dict_size)
+
+        # Downloaded Nextcloud events: caldav.Event with their parsed tree against NcEvent
+        import caldav
+        sample = 2000
+        tracemalloc.start()
+        items = [caldav.Event(url='https://cloud.example.com/event-%s.ics' % i, data=EVENT % (i, i)) for i in range(sample)]
+        for item in items:
+            item.icalendar_instance
+        caldav_size = tracemalloc.get_traced_memory()[0] * number / sample
+        tracemalloc.stop()
+        del items
+        nc_event_size, items = get_memory(lambda i: sync_record.NcEvent('https://cloud.example.com/event-%s.ics' % i, '"etag"', EVENT % (i, i), False), number)
+        del items
+        _logger.info('%s downloaded Nextcloud events: %.1f MB as caldav.Event (extrapolated from %s), %.1f MB as NcEvent',
+                     number, caldav_size / 1024 ** 2, sample, nc_event_size / 1024 ** 2)
+        self.assertLess(nc_event_size, caldav_size / 2)
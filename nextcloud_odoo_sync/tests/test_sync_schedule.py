@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from odoo.tests import common
+from odoo.tools import config
+
+
+class TestSyncSchedule(common.TransactionCase):
+
+    def setUp(self):
+        super(TestSyncSchedule, self).setUp()
+        config_obj = self.env['ir.config_parameter'].sudo()
+        config_obj.set_param('nextcloud_odoo_sync.sync_interval_min', 5)
+        config_obj.set_param('nextcloud_odoo_sync.sync_interval_max', 60)
+        config_obj.set_param('nextcloud_odoo_sync.sync_backoff_factor', 2)
+        self.user_id = self.env['res.users'].create({'name': 'Scheduled', 'login': 'scheduled'})
+        self.sync_user_id = self.env['nc.sync.user'].create({'user_id': self.user_id.id, 'user_name': 'scheduled'})
+
+    def test_backoff(self):
+        # Idle users are synced less and less often, up to the maximum interval
+        intervals = []
+        for i in range(6):
+            self.sync_user_id.schedule_next_sync(0)
+            intervals.append(self.sync_user_id.sync_interval)
+        self.assertEqual(intervals, [10, 20, 40, 60, 60, 60])
+        self.assertGreater(self.sync_user_id.date_next_sync, datetime.now() + timedelta(minutes=59))
+        self.assertFalse(self.sync_user_id.date_last_activity)
+
+        # Changes found by a sync bring the user back to the minimum interval
+        self.sync_user_id.schedule_next_sync(3)
+        self.assertEqual(self.sync_user_id.sync_interval, 5)
+        self.assertTrue(self.sync_user_id.date_last_activity)
+        self.assertAlmostEqual(self.sync_user_id.change_rate, 0.6)
+
+    def test_odoo_change_resets_interval(self):
+        for i in range(4):
+            self.sync_user_id.schedule_next_sync(0)
+        self.assertEqual(self.sync_user_id.sync_interval, 60)
+        self.env['calendar.event'].create({'name': 'Review', 'user_id': self.user_id.id,
+                                           'start': datetime(2023, 6, 15, 10), 'stop': datetime(2023, 6, 15, 11)})
+        self.assertEqual(self.sync_user_id.sync_interval, 5)
+        self.assertLessEqual(self.sync_user_id.date_next_sync, datetime.now())
+
+    def test_journal_synced_users_only(self):
+        journal_obj = self.env['nc.sync.journal']
+        other_user_id = self.env['res.users'].create({'name': 'Not Synced', 'login': 'not_synced'})
+        vals = {'start': datetime(2023, 6, 15, 10), 'stop': datetime(2023, 6, 15, 11)}
+        event_id = self.env['calendar.event'].create(dict(vals, name='Synced', user_id=self.user_id.id))
+        other_event_id = self.env['calendar.event'].create(dict(vals, name='Not Synced', user_id=other_user_id.id))
+        self.assertEqual(journal_obj.search([('res_id', '=', event_id.id)]).operation, 'create')
+        # Nothing would ever drain the journal entries of the users not syncing their calendar
+        other_event_id.write({'name': 'Renamed'})
+        self.assertFalse(journal_obj.search([('res_id', '=', other_event_id.id)]))
+        self.sync_user_id.sync_calendar = False
+        event_id.write({'name': 'Renamed'})
+        self.assertEqual(len(journal_obj.search([('res_id', '=', event_id.id)])), 1)
+
+    def test_journal_recordset(self):
+        journal_obj = self.env['nc.sync.journal']
+        start = datetime(2023, 6, 15, 10)
+        event_ids = self.env['calendar.event'].with_context(sync=True).create([{
+            'name': 'Event %s' % i, 'user_id': self.user_id.id, 'start': start + timedelta(hours=i),
+            'stop': start + timedelta(hours=i, minutes=30)} for i in range(5)])
+        # The synced users are cached: journaling a change does not search them again
+        journal_obj.log_changes(event_ids[:1], 'write')
+        with patch.object(type(self.sync_user_id), 'search', side_effect=AssertionError('nc.sync.user searched')):
+            entry_ids = journal_obj.log_changes(event_ids, 'write', ['name'])
+        self.assertEqual(entry_ids.event_id, event_ids)
+        # Cache invalidated by the users changing their setting
+        self.sync_user_id.sync_calendar = False
+        self.assertFalse(journal_obj.log_changes(event_ids, 'write'))
+
+    def create_journal_entry(self):
+        config_obj = self.env['ir.config_parameter'].sudo()
+        config_obj.set_param('nextcloud_odoo_sync.push_max_attempts', 4)
+        config_obj.set_param('nextcloud_odoo_sync.push_retry_delay', 60)
+        event_id = self.env['calendar.event'].create({'name': 'Failing', 'user_id': self.user_id.id,
+                                                      'start': datetime(2023, 6, 15, 10), 'stop': datetime(2023, 6, 15, 11)})
+        return self.env['nc.sync.journal'].search([('res_id', '=', event_id.id), ('operation', '=', 'create')])
+
+    def test_journal_failure_backoff(self):
+        entry_id = self.create_journal_entry()
+        for attempt_count, delay in enumerate([60, 120, 240], 1):
+            before = datetime.now().replace(microsecond=0)
+            entry_id.register_failure('Server error')
+            after = datetime.now()
+            # Exponential backoff with up to 10% of jitter (datetime fields are stored to the second)
+            self.assertEqual((entry_id.attempt_count, entry_id.state, entry_id.last_error), (attempt_count, 'pending', 'Server error'))
+            self.assertGreaterEqual(entry_id.date_next_attempt, before + timedelta(seconds=delay))
+            self.assertLessEqual(entry_id.date_next_attempt, after + timedelta(seconds=delay * 1.1))
+            self.assertNotIn(entry_id, entry_id.get_due_entries(self.user_id.id))
+
+        # Given up at the maximum number of attempts
+        entry_id.register_failure('Server error', operation='create')
+        self.assertEqual((entry_id.attempt_count, entry_id.state, entry_id.operation), (4, 'dead', 'create'))
+        entry_id.date_next_attempt = datetime.now() - timedelta(minutes=1)
+        self.assertNotIn(entry_id, entry_id.get_due_entries(self.user_id.id))
+
+    def test_journal_failure_delay_cap(self):
+        entry_id = self.create_journal_entry()
+        entry_id.attempt_count = 2
+        self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.push_retry_delay', 86400)
+        before = datetime.now().replace(microsecond=0)
+        entry_id.register_failure('Server error')
+        self.assertGreaterEqual(entry_id.date_next_attempt, before + timedelta(days=1))
+        self.assertLessEqual(entry_id.date_next_attempt, datetime.now() + timedelta(days=1.1))
+
+    def test_journal_retry(self):
+        entry_id = self.create_journal_entry()
+        for i in range(4):
+            entry_id.register_failure('Server error')
+        self.assertEqual(entry_id.state, 'dead')
+        # A dead entry retried by hand is due at once, with all its attempts
+        entry_id.action_retry()
+        self.assertEqual((entry_id.state, entry_id.attempt_count, entry_id.date_next_attempt), ('pending', 0, False))
+        self.assertIn(entry_id, entry_id.get_due_entries(self.user_id.id))
+        entry_id.register_failure('Server error')
+        self.assertEqual((entry_id.state, entry_id.attempt_count), ('pending', 1))
+
+    def test_pull_batch_rotation(self):
+        caldav_obj = self.env['nextcloud.caldav']
+        hrefs = ['/event-%s.ics' % i for i in range(5)]
+        self.assertEqual(caldav_obj.get_pull_batch(hrefs[::-1], False, 2), hrefs[:2])
+        # Each run continues after the previous batch, the events failing on every run do not block the others
+        self.assertEqual(caldav_obj.get_pull_batch(hrefs, hrefs[1], 2), hrefs[2:4])
+        self.assertEqual(caldav_obj.get_pull_batch(hrefs, hrefs[3], 2), [hrefs[4], hrefs[0]])
+        self.assertEqual(caldav_obj.get_pull_batch(hrefs[2:], hrefs[0], 2), hrefs[2:4])
+
+    def test_sync_time_budget(self):
+        caldav_obj = self.env['nextcloud.caldav']
+        with patch.dict(config.options, {'workers': 2, 'limit_time_real': 120, 'limit_time_real_cron': -1}):
+            self.assertEqual(caldav_obj.get_sync_time_budget(), 96)
+            # 0: the cron workers have no time limit
+            config.options['limit_time_real_cron'] = 0
+            self.assertEqual(caldav_obj.get_sync_time_budget(), 0)
+            config.options['limit_time_real_cron'] = 600
+            self.assertEqual(caldav_obj.get_sync_time_budget(), 480)
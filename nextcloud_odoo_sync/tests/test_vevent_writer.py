@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+from datetime import date, datetime, timedelta
+
+import pytz
+from icalendar import Calendar, vCalAddress
+
+from odoo.tests import common
+from odoo.addons.nextcloud_odoo_sync.models import vevent_writer
+
+EVENT = """BEGIN:VCALENDAR\r
+VERSION:2.0\r
+BEGIN:VEVENT\r
+UID:event-1\r
+DTSTAMP:20230615T080000Z\r
+DTSTART:20230615T100000Z\r
+DTEND:20230615T110000Z\r
+SUMMARY:Weekly review\r
+DESCRIPTION:Agenda\r
+LOCATION:Room 1\r
+X-NC-CUSTOM:kept\r
+ATTENDEE;CN=Jane;PARTSTAT=ACCEPTED:mailto:jane@example.com\r
+BEGIN:VALARM\r
+ACTION:DISPLAY\r
+TRIGGER:-PT15M\r
+END:VALARM\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+
+class TestVeventWriter(common.TransactionCase):
+
+    def get_component(self):
+        return Calendar.from_ical(EVENT).walk('VEVENT')[0]
+
+    def get_triggers(self, component):
+        return [x.decoded('trigger') for x in component.walk('VALARM')]
+
+    def test_partial_update(self):
+        component = self.get_component()
+        vals = {'summary': 'Renamed', 'location': False, 'description': False, 'valarm': ['-PT5M'], 'attendee': ['john@example.com']}
+        vevent_writer.write_properties(component, vals, {'summary'})
+        # Only the changed properties are written, the others are kept as they are on the server
+        self.assertEqual(component['summary'], 'Renamed')
+        self.assertEqual((component['description'], component['location'], component['x-nc-custom']), ('Agenda', 'Room 1', 'kept'))
+        self.assertEqual(self.get_triggers(component), [timedelta(minutes=-15)])
+        self.assertEqual(component['attendee'], 'mailto:jane@example.com')
+        self.assertEqual(component['attendee'].params['PARTSTAT'], 'ACCEPTED')
+
+    def test_clear_properties(self):
+        component = self.get_component()
+        vevent_writer.write_properties(component, {'description': '', 'location': False}, {'description', 'location'})
+        self.assertNotIn('description', component)
+        self.assertNotIn('location', component)
+
+        # Also cleared by a full update without the values
+        component = self.get_component()
+        vevent_writer.write_properties(component, {'summary': 'Weekly review'})
+        self.assertNotIn('description', component)
+        self.assertNotIn('location', component)
+
+    def test_replace_alarms_attendees(self):
+        component = self.get_component()
+        john = vCalAddress('mailto:john@example.com')
+        john.params['CN'] = 'John'
+        vevent_writer.write_properties(component, {'valarm': ['-PT5M', '-P1D'], 'attendee': [john, 'anna@example.com']})
+        self.assertEqual(self.get_triggers(component), [timedelta(minutes=-5), timedelta(days=-1)])
+        attendees = component.get('attendee')
+        self.assertEqual([str(x) for x in attendees], ['mailto:john@example.com', 'mailto:anna@example.com'])
+        self.assertEqual(attendees[0].params['CN'], 'John')
+        # No invitation is sent by the server
+        self.assertTrue(all(x.params['SCHEDULE-AGENT'] == 'NONE' and x.params['PARTSTAT'] == 'NEEDS-ACTION' for x in attendees))
+
+        # Empty values leave the alarms in place
+        vevent_writer.write_properties(component, {'valarm': [False]}, {'valarm'})
+        self.assertEqual(len(self.get_triggers(component)), 2)
+
+    def test_unknown_keys(self):
+        component = self.get_component()
+        vals = {'last-modified': datetime(2023, 6, 15, 10), 'nc_calendar_ids': 'Personal', 'x-unknown': 'value', 'summary': 'Renamed'}
+        vevent_writer.write_properties(component, vals)
+        self.assertEqual(component['summary'], 'Renamed')
+        self.assertNotIn('last-modified', component)
+        self.assertNotIn('x-unknown', component)
+        self.assertNotIn('nc_calendar_ids', component)
+
+    def test_all_day_round_trip(self):
+        # All-day events have date values, written as VALUE=DATE
+        vals = {'uid': 'event-2', 'summary': 'Holiday', 'dtstart': date(2023, 6, 15), 'dtend': date(2023, 6, 16)}
+        content = vevent_writer.build_vcalendar(vals).to_ical()
+        self.assertIn(b'DTSTART;VALUE=DATE:20230615', content)
+        component = Calendar.from_ical(content).walk('VEVENT')[0]
+        self.assertEqual((component.decoded('dtstart'), component.decoded('dtend')), (date(2023, 6, 15), date(2023, 6, 16)))
+
+        # Timed again
+        start = pytz.utc.localize(datetime(2023, 6, 15, 10))
+        vevent_writer.write_properties(component, {'dtstart': start, 'dtend': start + timedelta(hours=1)}, {'dtstart', 'dtend'})
+        content = component.to_ical()
+        self.assertIn(b'DTSTART:20230615T100000Z', content)
+        self.assertNotIn(b'VALUE=DATE', content)
+        component = Calendar.from_ical(content)
+        self.assertEqual((component.decoded('dtstart'), component.decoded('dtend')), (start, start + timedelta(hours=1)))
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import io
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+from odoo.tests import common, tagged
+from odoo.addons.nextcloud_odoo_sync.models import webdav_client
+from odoo.addons.nextcloud_odoo_sync.tests.webdav_server import WebdavStandIn
+
+_logger = logging.getLogger(__name__)
+
+
+class TestWebdav(common.TransactionCase):
+
+    def setUp(self):
+        super(TestWebdav, self).setUp()
+        self.server = WebdavStandIn().start()
+        self.addCleanup(self.server.stop)
+        self.client = webdav_client.WebdavClient('%s/remote.php/dav' % self.server.url, 'admin', 'admin', chunk_size=webdav_client.MIN_CHUNK_SIZE)
+        self.webdav_obj = self.env['nextcloud.webdav']
+
+    def get_requests(self, method):
+        return [path for request_method, path in self.server.requests if request_method == method]
+
+    def test_upload_download(self):
+        attachment_id = self.env['ir.attachment'].create({'name': 'plan.txt', 'raw': b'Project plan'})
+        self.assertTrue(self.webdav_obj.upload_attachment(attachment_id, 'Projects/2023/plan.txt', client=self.client))
+        self.assertEqual(attachment_id.nc_path, 'Projects/2023/plan.txt')
+        self.assertEqual(attachment_id.nc_etag, self.server.etags['files/admin/Projects/2023/plan.txt'])
+        # Unchanged on both sides: nothing is sent
+        self.server.requests.clear()
+        self.assertFalse(self.webdav_obj.upload_attachment(attachment_id, client=self.client))
+        self.assertEqual(self.get_requests('PUT'), [])
+
+        # Downloaded into a new attachment, then only once the file changed in Nextcloud
+        download_id = self.webdav_obj.download_attachment('Projects/2023/plan.txt', client=self.client)
+        self.assertEqual(download_id.raw, b'Project plan')
+        self.assertEqual(download_id.checksum, attachment_id.checksum)
+        self.assertEqual(download_id.mimetype, 'text/plain')
+        self.server.requests.clear()
+        self.assertEqual(self.webdav_obj.download_attachment('Projects/2023/plan.txt', download_id, client=self.client), download_id)
+        self.assertEqual(self.get_requests('GET'), [])
+        self.client.upload(self.client.file_url('Projects/2023/plan.txt'), io.BytesIO(), 0, 'empty')
+        self.webdav_obj.download_attachment('Projects/2023/plan.txt', download_id, client=self.client)
+        self.assertEqual(download_id.file_size, 0)
+        self.assertEqual(download_id.nc_etag, self.server.etags['files/admin/Projects/2023/plan.txt'])
+
+    def test_resume_chunked_upload(self):
+        content = os.urandom(2 * webdav_client.MIN_CHUNK_SIZE + 10)
+        attachment_id = self.env['ir.attachment'].create({'name': 'large.bin', 'raw': content})
+        request = self.client.request
+
+        def interrupted_request(method, url, **kwargs):
+            if method == 'PUT' and url.endswith('/00002'):
+                raise IOError('Connection reset')
+            return request(method, url, **kwargs)
+        self.patch(self.client, 'request', interrupted_request)
+        with self.assertRaises(IOError):
+            self.webdav_obj.upload_attachment(attachment_id, 'large.bin', client=self.client)
+        self.assertFalse(attachment_id.nc_etag)
+
+        # The chunks sent before the interruption are not sent again
+        self.patch(self.client, 'request', request)
+        self.server.requests.clear()
+        self.webdav_obj.upload_attachment(attachment_id, 'large.bin', client=self.client)
+        self.assertEqual([x.rsplit('/', 1)[1] for x in self.get_requests('PUT')], ['00002', '00003'])
+        self.assertEqual(self.webdav_obj.download_attachment('large.bin', client=self.client).raw, content)
+
+    def test_chunk_size(self):
+        url = '%s/remote.php/dav' % self.server.url
+        self.assertEqual(webdav_client.WebdavClient(url, 'admin', 'admin', chunk_size=1024).chunk_size, webdav_client.MIN_CHUNK_SIZE)
+        self.assertEqual(webdav_client.WebdavClient(url, 'admin', 'admin', chunk_size=2 ** 40).chunk_size, webdav_client.MAX_CHUNK_SIZE)
+
+        # Chunks smaller than 5 MiB are rejected when the file is assembled
+        self.client.chunk_size = 256 * 1024
+        content = os.urandom(600 * 1024)
+        with self.assertRaises(requests.HTTPError) as error:
+            self.client.upload(self.client.file_url('small.bin'), io.BytesIO(content), len(content), 'small')
+        self.assertEqual(error.exception.response.status_code, 400)
+        self.assertIsNone(self.client.stat(self.client.file_url('small.bin')))
+
+
+@tagged('-standard', 'nc_benchmark')
+class BenchmarkWebdav(common.TransactionCase):
+
+    def test_benchmark_transfer(self):
+        size = 256 * 1024 * 1024
+        chunk_size = 16 * 1024 * 1024
+        server = WebdavStandIn().start()
+        self.addCleanup(server.stop)
+        client = webdav_client.WebdavClient('%s/remote.php/dav' % server.url, 'admin', 'admin', chunk_size=chunk_size)
+        with tempfile.NamedTemporaryFile() as fileobj:
+            block = os.urandom(1024 * 1024)
+            for i in range(size // len(block)):
+                fileobj.write(block)
+            fileobj.flush()
+            fileobj.seek(0)
+            tracemalloc.start()
+            start = time.perf_counter()
+            client.upload(client.file_url('benchmark.bin'), fileobj, size, 'benchmark')
+            upload_time = time.perf_counter() - start
+            upload_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        attachment_id = self.env['nextcloud.webdav'].download_attachment('benchmark.bin', client=client)
+        download_time = time.perf_counter() - start
+        download_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertEqual(attachment_id.file_size, size)
+
+        _logger.info('WebDAV transfer of %s MB: upload in %s MB chunks %.1f MB/s (peak memory %.1f MB), '
+                     'download to the filestore %.1f MB/s (peak memory %.1f MB)',
+                     size // 1024 ** 2, chunk_size // 1024 ** 2, size / upload_time / 1024 ** 2, upload_peak / 1024 ** 2,
+                     size / download_time / 1024 ** 2, download_peak / 1024 ** 2)
+        # Memory does not depend on the file size
+        self.assertLess(upload_peak, 8 * 1024 * 1024)
+        self.assertLess(download_peak, 8 * 1024 * 1024)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import json
+from datetime import datetime, timedelta
+
+from odoo.tests import common, tagged
+
+WEBHOOK_URL = '/nextcloud_odoo_sync/webhook'
+
+
+@tagged('post_install', '-at_install')
+class TestNextcloudWebhook(common.HttpCase):
+
+    def setUp(self):
+        super(TestNextcloudWebhook, self).setUp()
+        self.env['ir.config_parameter'].sudo().set_param('nextcloud_odoo_sync.webhook_secret', 'secret')
+        self.sync_user_id = self.env['nc.sync.user'].create({'user_id': self.env.ref('base.user_admin').id,
+                                                             'user_name': 'alice',
+                                                             'nextcloud_user_id': 'alice'})
+        self.request_obj = self.env['nc.sync.request']
+
+    def post_notification(self, payload, secret='secret'):
+        """
+        Local stand-in for Nextcloud webhook_listeners posting a calendar notification
+        """
+        headers = {'Content-Type': 'application/json', 'Authorization': 'Bearer %s' % secret}
+        return self.url_open(WEBHOOK_URL, data=json.dumps(payload), headers=headers)
+
+    def calendar_payload(self, calendar_uri='personal'):
+        return {'user': {'uid': 'alice', 'displayName': 'Alice'},
+                'event': {'class': 'OCA\\DAV\\Events\\CalendarObjectUpdatedEvent',
+                          'calendarId': 1,
+                          'calendarData': {'principaluri': 'principals/users/alice', 'uri': calendar_uri},
+                          'objectData': {'uri': 'event.ics'}}}
+
+    def test_webhook_authentication(self):
+        response = self.post_notification(self.calendar_payload(), secret='wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(self.request_obj.search([('sync_user_id', '=', self.sync_user_id.id)]))
+
+    def test_webhook_coalescing(self):
+        for i in range(5):
+            response = self.post_notification(self.calendar_payload())
+            self.assertEqual(response.status_code, 202)
+        self.post_notification(self.calendar_payload('work'))
+        request_ids = self.request_obj.search([('sync_user_id', '=', self.sync_user_id.id), ('state', '=', 'pending')])
+        self.assertEqual(len(request_ids), 2)
+        personal_request_id = request_ids.filtered(lambda x: x.calendar_uri == 'personal')
+        self.assertEqual(personal_request_id.notification_count, 5)
+
+
+class TestSyncRequest(common.TransactionCase):
+
+    def test_skipped_user_stays_pending(self):
+        user_ids = self.env['res.users'].create([{'name': 'Request %s' % i, 'login': 'request_%s' % i} for i in range(2)])
+        sync_user_ids = self.env['nc.sync.user'].create([{'user_id': x.id, 'user_name': x.login} for x in user_ids])
+        request_obj = self.env['nc.sync.request']
+        request_ids = request_obj.create([{'sync_user_id': x.id, 'date_run': datetime.now() - timedelta(seconds=1)} for x in sync_user_ids])
+
+        def sync_cron(model, sync_user_ids=False, calendar_uris=False, shard=None, force=False):
+            # The second user is being synced by another run
+            self.assertEqual(sorted(sync_user_ids), sorted(request_ids.sync_user_id.ids))
+            model.env['nc.sync.user'].browse(min(sync_user_ids)).date_last_sync = datetime.now()
+            return True
+        self.patch(type(self.env['nextcloud.caldav']), 'sync_cron', sync_cron)
+        request_obj.run_sync_requests()
+        done_id = request_ids.filtered(lambda x: x.sync_user_id.id == min(sync_user_ids.ids))
+        self.assertEqual(done_id.state, 'done')
+        self.assertEqual((request_ids - done_id).state, 'pending')
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2023 iScale Solutions Inc.
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+from xml.sax.saxutils import escape
+
+BLOCK_SIZE = 64 * 1024
+# Smallest size of the chunks of an upload but the last one
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+DAV_PREFIX = '/remote.php/dav/'
+
+
+class WebdavStandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path(self, url=None):
+        path = unquote(urlparse(url or self.path).path)
+        return path[len(DAV_PREFIX):].strip('/') if path.startswith(DAV_PREFIX) else None
+
+    def _local(self, path):
+        return os.path.join(self.server.root, *path.split('/'))
+
+    def _drain(self):
+        # Bodies are read block by block, like a real server would
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining > 0:
+            block = self.rfile.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+    def _record(self):
+        with self.server.lock:
+            self.server.requests.append((self.command, self._path()))
+
+    def do_PUT(self):
+        self._record()
+        path = self._path()
+        local = self._local(path)
+        if not os.path.isdir(os.path.dirname(local)):
+            list(self._drain())
+            return self._reply(409)
+        existed = os.path.isfile(local)
+        sha1 = hashlib.sha1()
+        with open(local, 'wb') as fileobj:
+            for block in self._drain():
+                fileobj.write(block)
+                sha1.update(block)
+        etag = self.server.etags[path] = '"%s"' % sha1.hexdigest()
+        self._reply(204 if existed else 201, headers={'ETag': etag})
+
+    def do_GET(self):
+        self._record()
+        path = self._path()
+        local = self._local(path)
+        if not os.path.isfile(local):
+            return self._reply(404)
+        self.send_response(200)
+        self.send_header('Content-Length', str(os.path.getsize(local)))
+        self.send_header('ETag', self.server.etags[path])
+        self.send_header('Last-Modified', formatdate(os.path.getmtime(local), usegmt=True))
+        self.end_headers()
+        with open(local, 'rb') as fileobj:
+            shutil.copyfileobj(fileobj, self.wfile, BLOCK_SIZE)
+
+    def do_MKCOL(self):
+        self._record()
+        local = self._local(self._path())
+        if os.path.exists(local):
+            return self._reply(405)
+        if not os.path.isdir(os.path.dirname(local)):
+            return self._reply(409)
+        os.mkdir(local)
+        self._reply(201)
+
+    def do_PROPFIND(self):
+        self._record()
+        list(self._drain())
+        path = self._path()
+        local = self._local(path)
+        if not os.path.exists(local):
+            return self._reply(404)
+        paths = [path]
+        if os.path.isdir(local) and self.headers.get('Depth') == '1':
+            paths += ['%s/%s' % (path, x) for x in sorted(os.listdir(local))]
+        responses = []
+        for item in paths:
+            item_local = self._local(item)
+            href = quote(DAV_PREFIX + item)
+            if os.path.isdir(item_local):
+                props = '<d:resourcetype><d:collection/></d:resourcetype>'
+                href += '/'
+            else:
+                props = ('<d:resourcetype/><d:getcontentlength>%s</d:getcontentlength><d:getetag>%s</d:getetag>'
+                         '<d:getlastmodified>%s</d:getlastmodified>' % (os.path.getsize(item_local), escape(self.server.etags.get(item, '')),
+                                                                        formatdate(os.path.getmtime(item_local), usegmt=True)))
+            responses.append('<d:response><d:href>%s</d:href><d:propstat><d:prop>%s</d:prop>'
+                             '<d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>' % (escape(href), props))
+        content = ('<?xml version="1.0" encoding="utf-8"?><d:multistatus xmlns:d="DAV:">%s</d:multistatus>' % ''.join(responses)).encode('utf-8')
+        self._reply(207, content, {'Content-Type': 'application/xml; charset=utf-8'})
+
+    def do_MOVE(self):
+        # Only the assembly of chunked uploads: MOVE uploads/<user>/<id>/.file to the Destination
+        self._record()
+        path = self._path()
+        destination = self._path(self.headers.get('Destination'))
+        upload_dir = self._local(path.rsplit('/', 1)[0])
+        if not path.endswith('/.file') or not os.path.isdir(upload_dir) or not destination:
+            return self._reply(400)
+        names = sorted(os.listdir(upload_dir))
+        if any(os.path.getsize(os.path.join(upload_dir, x)) < self.server.min_chunk_size for x in names[:-1]):
+            return self._reply(400)
+        local = self._local(destination)
+        existed = os.path.isfile(local)
+        sha1 = hashlib.sha1()
+        with open(local, 'wb') as fileobj:
+            for name in names:
+                with open(os.path.join(upload_dir, name), 'rb') as chunk:
+                    for block in iter(lambda: chunk.read(BLOCK_SIZE), b''):
+                        fileobj.write(block)
+                        sha1.update(block)
+        if os.path.getsize(local) != int(self.headers.get('OC-Total-Length') or 0):
+            return self._reply(400)
+        shutil.rmtree(upload_dir)
+        etag = self.server.etags[destination] = '"%s"' % sha1.hexdigest()
+        self._reply(204 if existed else 201, headers={'OC-ETag': etag, 'ETag': etag})
+
+
+class WebdavStandIn(ThreadingHTTPServer):
+    """
+    Minimal local Nextcloud WebDAV server storing files in a temporary folder, it supports
+    plain and chunked (v2) uploads and streamed downloads. Like Nextcloud, it rejects the
+    assembly of chunked uploads with chunks smaller than 5 MiB (except the last one).
+    """
+    daemon_threads = True
+
+    def __init__(self, username='admin'):
+        super(WebdavStandIn, self).__init__(('127.0.0.1', 0), WebdavStandInHandler)
+        self.root = tempfile.mkdtemp(prefix='nc-webdav-')
+        for folder in ('files', 'uploads'):
+            os.makedirs(os.path.join(self.root, folder, username))
+        self.etags = {}
+        self.min_chunk_size = MIN_CHUNK_SIZE
+        # Method and path of the requests received
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a request are expected
+        pass
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.root, ignore_errors=True)
@@ -2,7 +2,8 @@
 # Copyright (c) 2023 iScale Solutions Inc.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl)
 
-from odoo import fields, models
+from odoo import fields, models, _
+from odoo.exceptions import UserError
 
 class RunSyncTestWizard(models.TransientModel):
     _name = 'run.sync.test.wizard'
@@ -10,4 +11,5 @@ class RunSyncTestWizard(models.TransientModel):
     message = fields.Text()
     
     def run_sync_cron_test(self):
-        self.env['nextcloud.caldav'].sync_cron()
\ No newline at end of file
+        if not self.env['nextcloud.caldav'].sync_cron(force=True):
+            raise UserError(_('A Nextcloud sync is already running, please try again later'))
\ No newline at end of file